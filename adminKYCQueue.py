@@ -0,0 +1,338 @@
+import os
+import json
+import psycopg2
+import datetime
+from psycopg2.extras import execute_values
+import idempotency
+import kyc_status
+
+# Claimed submissions return to the queue if not reviewed within the lease
+CLAIM_LEASE_MINUTES = int(os.getenv("KYC_CLAIM_LEASE_MINUTES", "15"))
+MAX_CLAIM = 100
+MAX_DECISIONS = 500
+REVIEW_STATUSES = ("approved", "rejected")
+AGE_PERCENTILES = (0.5, 0.9, 0.99)
+
+def handler(event, context):
+    """
+    Netlify Python Function: /adminKYCQueue
+    KYC review queue for admins.
+
+    GET returns queue depth and the age of pending submissions (p50/p90/p99).
+
+    POST {"action": "claim", "limit": 10}
+        Claims the oldest pending submissions not claimed by another reviewer
+        (or whose claim expired) for KYC_CLAIM_LEASE_MINUTES. Your own
+        unreviewed claims are returned again with a renewed lease.
+    POST {"action": "review", "decisions": [{"id": 1, "status": "approved", "admin_note": "..."}]}
+        Approves/rejects submissions you hold an unexpired claim on.
+    POST {"action": "release", "ids": [1, 2]}
+        Returns your claims to the queue.
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Connect to Neon DB using DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role, u.name, u.email
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role, name, email = user_result
+        user = {"id": user_id, "role": role, "name": name, "email": email}
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Check if user is admin
+    if user["role"] != "admin":
+        cur.close()
+        conn.close()
+        return {"statusCode": 403, "body": json.dumps({"error": "Only admins allowed"})}
+
+    now = datetime.datetime.utcnow()
+
+    # Queue statistics
+    if event.get("httpMethod") == "GET":
+        try:
+            # The oldest pending submission has the highest age, so the age
+            # percentile p is the submitted_at percentile 1 - p
+            cur.execute("""
+                SELECT count(*),
+                       count(*) FILTER (WHERE claim_expires_at > %s),
+                       min(submitted_at),
+                       percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY submitted_at)
+                FROM kyc_submissions
+                WHERE status = 'pending';
+            """, (now, [1 - p for p in AGE_PERCENTILES]))
+            depth, claimed, oldest, percentiles = cur.fetchone()
+            cur.close()
+            conn.close()
+
+            def age(ts):
+                return round((now - ts).total_seconds(), 1) if ts else None
+
+            ages = {f"p{round(p * 100)}": age(ts)
+                    for p, ts in zip(AGE_PERCENTILES, percentiles or [None] * len(AGE_PERCENTILES))}
+            ages["max"] = age(oldest)
+
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({
+                    "pending": depth,
+                    "claimed": claimed,
+                    "unclaimed": depth - claimed,
+                    "age_seconds": ages
+                })
+            }
+
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
+            return {"statusCode": 500, "body": json.dumps({"error": "Database query failed", "details": str(e)})}
+
+    # Parse request body
+    try:
+        body = json.loads(event.get("body") or "{}")
+        action = body.get("action")
+    except Exception:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
+
+    if action == "claim":
+        limit = body.get("limit", 10)
+        if not isinstance(limit, int) or not 1 <= limit <= MAX_CLAIM:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": f"limit must be between 1 and {MAX_CLAIM}"})}
+
+        try:
+            # SKIP LOCKED lets concurrent reviewers claim disjoint rows
+            # without waiting on each other
+            cur.execute("""
+                UPDATE kyc_submissions k
+                SET claimed_by = %s, claim_expires_at = %s
+                FROM users u
+                WHERE k.id IN (
+                    SELECT id FROM kyc_submissions
+                    WHERE status = 'pending'
+                      AND (claim_expires_at IS NULL OR claim_expires_at <= %s OR claimed_by = %s)
+                    ORDER BY submitted_at, id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                AND u.id = k.user_id
+                RETURNING k.id, k.user_id, u.email, u.name, k.kyc_type, k.submitted_at,
+                          k.files_processed_at, k.claim_expires_at;
+            """, (user["id"], now + datetime.timedelta(minutes=CLAIM_LEASE_MINUTES), now, user["id"], limit))
+            claimed = sorted(cur.fetchall(), key=lambda r: (r[5], r[0]))
+
+            files = {}
+            if claimed:
+                cur.execute("""
+                    SELECT kyc_submission_id, id, file_name, COALESCE(detected_mime_type, mime_type),
+                           size_bytes, page_count, thumbnail_sha256 IS NOT NULL, processing_status
+                    FROM escrow_files
+                    WHERE kyc_submission_id = ANY(%s)
+                    ORDER BY id;
+                """, ([r[0] for r in claimed],))
+                for row in cur.fetchall():
+                    files.setdefault(row[0], []).append({
+                        "id": row[1],
+                        "filename": row[2],
+                        "mime_type": row[3],
+                        "size": row[4],
+                        "page_count": row[5],
+                        "has_thumbnail": row[6],
+                        "processing_status": row[7]
+                    })
+
+            conn.commit()
+            cur.close()
+            conn.close()
+
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"submissions": [{
+                    "id": r[0],
+                    "user_id": r[1],
+                    "email": r[2],
+                    "name": r[3],
+                    "kyc_type": r[4],
+                    "submitted_at": r[5].isoformat() if r[5] else None,
+                    "files_processed_at": r[6].isoformat() if r[6] else None,
+                    "claim_expires_at": r[7].isoformat(),
+                    "files": files.get(r[0], [])
+                } for r in claimed]})
+            }
+
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
+            return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
+
+    if action == "review":
+        decisions = body.get("decisions")
+        if not isinstance(decisions, list) or not 1 <= len(decisions) <= MAX_DECISIONS:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": f"decisions must be a list of 1 to {MAX_DECISIONS} items"})}
+
+        rows = []
+        for decision in decisions:
+            if (not isinstance(decision, dict) or not isinstance(decision.get("id"), int)
+                    or decision.get("status") not in REVIEW_STATUSES):
+                cur.close()
+                conn.close()
+                return {"statusCode": 400, "body": json.dumps({"error": "Each decision needs an id and a status of approved or rejected"})}
+            rows.append((decision["id"], decision["status"], decision.get("admin_note")))
+        # The last decision for an id wins
+        rows = list({row[0]: row for row in rows}.values())
+
+        try:
+            # A retried review gets the stored result, not "not_reviewed"
+            # for the submissions its first attempt already reviewed
+            idem, replay = idempotency.begin(cur, event, "adminKYCQueue", user["id"])
+            if replay:
+                cur.close()
+                conn.close()
+                return replay
+
+            # One statement for the whole batch; only rows this reviewer
+            # still holds an unexpired claim on are updated
+            reviewed = execute_values(cur, """
+                UPDATE kyc_submissions k
+                SET status = v.status,
+                    admin_note = v.admin_note,
+                    reviewed_at = v.reviewed_at,
+                    reviewed_by = v.reviewer_id,
+                    claimed_by = NULL,
+                    claim_expires_at = NULL
+                FROM (VALUES %s) AS v (id, status, admin_note, reviewer_id, reviewed_at)
+                WHERE k.id = v.id
+                  AND k.status = 'pending'
+                  AND k.claimed_by = v.reviewer_id
+                  AND k.claim_expires_at > v.reviewed_at
+                RETURNING k.id, k.user_id;
+            """, [row + (user["id"], now) for row in rows],
+                template="(%s::integer, %s, %s, %s::integer, %s::timestamp)", fetch=True)
+            reviewed_ids = {r[0] for r in reviewed}
+
+            response = {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({
+                    "reviewed": sorted(reviewed_ids),
+                    "not_reviewed": [r[0] for r in rows if r[0] not in reviewed_ids]
+                })
+            }
+            idempotency.finish(cur, idem, response)
+            conn.commit()
+            kyc_status.invalidate(*{r[1] for r in reviewed})
+            cur.close()
+            conn.close()
+
+            return response
+
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
+            return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
+
+    if action == "release":
+        ids = body.get("ids")
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": "ids must be a list of submission ids"})}
+
+        try:
+            cur.execute("""
+                UPDATE kyc_submissions
+                SET claimed_by = NULL, claim_expires_at = NULL
+                WHERE id = ANY(%s) AND status = 'pending' AND claimed_by = %s
+                RETURNING id;
+            """, (ids, user["id"]))
+            released = sorted(r[0] for r in cur.fetchall())
+
+            conn.commit()
+            cur.close()
+            conn.close()
+
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"released": released})
+            }
+
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
+            return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
+
+    cur.close()
+    conn.close()
+    return {"statusCode": 400, "body": json.dumps({"error": "action must be claim, review or release"})}
@@ -1,9 +1,15 @@
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.utils import send_file
 import importlib.util
 import sys
 import os
-import json
+import re
+import threading
 from flask_cors import CORS  # ADD THIS
+from http_cache import strong_etag
+from response_compression import compress_response
+import metrics
 
 app = Flask(__name__)
 
@@ -12,7 +18,7 @@ CORS(app, resources={
     r"/*": {
         "origins": ["https://vanguardescrow.online", "https://www.vanguardescrow.online"],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"]
     }
 })
 
@@ -20,7 +26,7 @@ CORS(app, resources={
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', 'https://vanguardescrow.online')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Origin,Accept')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Idempotency-Key,Origin,Accept')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
@@ -30,9 +36,82 @@ def after_request(response):
 def handle_options(path=None):
     return '', 200
 
+# Files returned by functions (see escrowFiles) are sent with the OS
+# sendfile() through the WSGI file wrapper. Behind a proxy the transfer can
+# be handed off entirely: USE_X_SENDFILE=1 sets X-Sendfile (Apache,
+# lighttpd); X_ACCEL_REDIRECT_PREFIX sets nginx's X-Accel-Redirect to that
+# internal location plus the file's store-relative path
+USE_X_SENDFILE = os.getenv("USE_X_SENDFILE") == "1"
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX")
+
+def file_response(result):
+    """
+    Response for a function result of the form {"statusCode": 200, "file":
+    {"path", "filename", "mimetype", "etag", "last_modified", "accel_path"},
+    "headers": {...}}. Range, If-Range, If-None-Match and If-Modified-Since
+    are answered by send_file; the file is never read into Python.
+    """
+    file = result['file']
+    accel = bool(X_ACCEL_REDIRECT_PREFIX and file.get('accel_path'))
+    try:
+        response = send_file(file['path'], request.environ, mimetype=file.get('mimetype'),
+                             as_attachment=True, download_name=file.get('filename'),
+                             # nginx answers Range/conditional requests itself
+                             conditional=not accel,
+                             etag=file.get('etag', True), last_modified=file.get('last_modified'),
+                             use_x_sendfile=USE_X_SENDFILE or accel, response_class=app.response_class)
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response(request.environ)
+    if accel:
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + file['accel_path']
+    for name, value in (result.get('headers') or {}).items():
+        if not name.lower().startswith('access-control-'):
+            response.headers[name] = value
+    return response
+
 # Your existing route function below...
 functions_dir = "."
 
+# Function modules are imported once per worker and reused, so module-level
+# caches (e.g. paymentMethods) survive between requests. Shared helpers and
+# maintenance commands live alongside the functions but are not endpoints:
+# a file is only executed if it defines handler(event, context), so e.g.
+# metrics, jobs and this app never are, and a module already imported is
+# reused rather than executed again
+loaded_functions = {}
+loaded_functions_lock = threading.Lock()
+
+_HANDLER_DEF = re.compile(rb"^def handler\(event, context\):", re.MULTILINE)
+
+def load_function(function_name, python_file):
+    """The function's module, or None if python_file is not an endpoint."""
+    if function_name in loaded_functions:
+        return loaded_functions[function_name]
+
+    with loaded_functions_lock:
+        if function_name in loaded_functions:
+            return loaded_functions[function_name]
+        module = None
+        with open(python_file, 'rb') as f:
+            is_endpoint = _HANDLER_DEF.search(f.read()) is not None
+        if is_endpoint and function_name in sys.modules:
+            # Only the same file counts; anything else of that name is not ours
+            module = sys.modules[function_name]
+            if os.path.abspath(getattr(module, '__file__', None) or '') != os.path.abspath(python_file):
+                module = None
+        elif is_endpoint:
+            spec = importlib.util.spec_from_file_location(function_name, python_file)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[function_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[function_name]
+                raise
+        loaded_functions[function_name] = module
+        return module
+
 @app.route('/.netlify/functions/<function_name>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
 @app.route('/<function_name>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
 def route_function(function_name):
@@ -47,30 +126,54 @@ def route_function(function_name):
         if not os.path.exists(python_file):
             return jsonify({"error": f"Function {function_name} not found at {python_file}"}), 404
         
-        # Dynamically import the module
-        spec = importlib.util.spec_from_file_location(function_name, python_file)
-        module = importlib.util.module_from_spec(spec)
-        sys.modules[function_name] = module
-        spec.loader.exec_module(module)
-        
-        # Create event object from request
+        # Import the module (once per worker)
+        module = load_function(function_name, python_file)
+        if module is None:
+            return jsonify({"error": f"Function {function_name} not found at {python_file}"}), 404
+
+        # Create event object from request. Functions that set
+        # STREAM_REQUEST_BODY read the body themselves from bodyStream
+        # (see uploads.py) instead of having it buffered here
+        streaming_upload = getattr(module, 'STREAM_REQUEST_BODY', False)
         event = {
             "httpMethod": request.method,
             "path": request.path,
             "headers": dict(request.headers),
             "queryStringParameters": dict(request.args),
-            "body": request.get_data().decode('utf-8') if request.data else None
+            "body": None if streaming_upload else (request.get_data().decode('utf-8') if request.data else None)
         }
+        if streaming_upload:
+            event["bodyStream"] = request.stream
         
         # Call the handler function
         context = {}
         result = module.handler(event, context)
         
+        # Files bypass ETag, compression and buffering
+        if isinstance(result, dict) and result.get('file') and result.get('statusCode', 200) == 200:
+            return file_response(result)
+
         # Return the response
         if isinstance(result, dict) and 'body' in result:
-            return jsonify(json.loads(result['body'])), result.get('statusCode', 200)
+            response = app.response_class(result['body'] or '', status=result.get('statusCode', 200),
+                                          mimetype='application/json')
+            for name, value in (result.get('headers') or {}).items():
+                # CORS headers are set once for every response, above
+                if not name.lower().startswith('access-control-'):
+                    response.headers[name] = value
         else:
-            return jsonify(result), 200
+            response = jsonify(result)
+
+        # Read responses without a version-based ETag get one from the body
+        if request.method in ('GET', 'HEAD') and response.status_code == 200 and 'ETag' not in response.headers:
+            response.headers['ETag'] = strong_etag(response.get_data())
+
+        # Answer If-None-Match / If-Modified-Since with 304 when the function
+        # returned a matching ETag or Last-Modified
+        response = response.make_conditional(request)
+
+        # gzip/brotli for larger bodies, per Accept-Encoding
+        return compress_response(response, request)
         
     except Exception as e:
         import traceback
@@ -81,5 +184,13 @@ def route_function(function_name):
 def health_check():
     return jsonify({"status": "healthy", "message": "Vanguard Escrow API is running"})
 
+# Per-worker metrics in Prometheus text format
+@app.route('/metrics')
+def metrics_endpoint():
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and request.headers.get('Authorization', '') != f"Bearer {metrics_token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,83 @@
+"""
+Deposit watcher scan throughput (deposit_watcher.py) on a synthetic chain,
+without a database: reading blocks from an NDJSON file source and matching
+every output against the watched address set.
+
+    python benchmarks/deposit_scan.py [--blocks 200] [--txs 2000] [--watched 50000]
+
+Each transaction has two outputs; one in --hit-every transactions pays a
+watched address. Reports transactions and outputs per second on one core.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import deposit_watcher  # noqa: E402
+
+_BECH32_ALPHABET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+def fake_address(rng):
+    return "bc1q" + "".join(rng.choice(_BECH32_ALPHABET) for _ in range(38))
+
+
+def write_chain(path, blocks, txs, watched, hit_every, rng):
+    watched = list(watched)
+    previous = None
+    with open(path, "w") as f:
+        for height in range(blocks):
+            block_hash = "%064x" % rng.getrandbits(256)
+            tx = []
+            for i in range(txs):
+                outputs = [fake_address(rng), fake_address(rng)]
+                if i % hit_every == 0:
+                    outputs[0] = rng.choice(watched)
+                tx.append({
+                    "txid": "%064x" % rng.getrandbits(256),
+                    "vout": [{"n": n, "value": round(rng.uniform(0.0001, 2), 8),
+                              "scriptPubKey": {"address": address, "type": "witness_v0_keyhash"}}
+                             for n, address in enumerate(outputs)],
+                })
+            block = {"height": height, "hash": block_hash, "tx": tx}
+            if previous:
+                block["previousblockhash"] = previous
+            f.write(json.dumps(block) + "\n")
+            previous = block_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=200)
+    parser.add_argument("--txs", type=int, default=2000, help="transactions per block")
+    parser.add_argument("--watched", type=int, default=50000, help="watched deposit addresses")
+    parser.add_argument("--hit-every", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    watched = {fake_address(rng): escrow_id for escrow_id in range(args.watched)}
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "chain.ndjson")
+        write_chain(path, args.blocks, args.txs, watched, args.hit_every, rng)
+        print(f"chain: {args.blocks} blocks x {args.txs} txs, {os.path.getsize(path) / (1024 * 1024):.1f} MB; "
+              f"{args.watched} watched addresses")
+
+        source = deposit_watcher.FileBlockSource(path)
+        started = time.perf_counter()
+        hits = 0
+        for height in range(source.tip() + 1):
+            hits += len(deposit_watcher.match_block(source.block(height), watched))
+        elapsed = time.perf_counter() - started
+
+    txs = args.blocks * args.txs
+    print(f"{hits} matching outputs in {elapsed:.2f}s: {txs / elapsed:,.0f} tx/s, {2 * txs / elapsed:,.0f} outputs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Enqueue and dequeue throughput of the job queue (jobs.py) at several
+worker counts.
+
+    DATABASE_URL=postgres://... python benchmarks/job_queue.py [--jobs 20000] [--concurrency 1 8 32] [--batch-size 20]
+
+Runs against a scratch schema in the given database (created and dropped
+by the benchmark; nothing else is touched). Every thread has its own
+connection.
+
+"enqueue" is what a request handler does: one jobs.enqueue() and a commit
+per job. "dequeue" is workers draining the queue with jobs.run_batch() and
+a handler that does nothing, so it measures the queue's own overhead:
+claim, savepoint, delete, two commits per batch.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import jobs  # noqa: E402
+
+SCHEMA = f"bench_jobs_{os.getpid()}"
+
+
+@jobs.handler("bench.noop")
+def noop(cur, payload):
+    pass
+
+
+def connect(database_url):
+    return psycopg2.connect(database_url, options=f"-c search_path={SCHEMA}")
+
+
+def setup(database_url):
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path = {SCHEMA}")
+    with open(os.path.join(ROOT, "migrations", "017_jobs.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    conn.close()
+
+
+def run_threads(database_url, concurrency, work):
+    """Run work(index, conn) on concurrency threads started together. Returns elapsed seconds."""
+    connections = [connect(database_url) for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        barrier.wait()
+        work(index, connections[index])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    for conn in connections:
+        conn.close()
+    return elapsed
+
+
+def bench_enqueue(database_url, concurrency, count):
+    latencies = []
+    lock = threading.Lock()
+
+    def work(index, conn):
+        cur = conn.cursor()
+        mine = []
+        for n in range(index, count, concurrency):
+            started = time.perf_counter()
+            jobs.enqueue(cur, "bench.noop", {"n": n}, priority=n % 3)
+            conn.commit()
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    elapsed = run_threads(database_url, concurrency, work)
+    return elapsed, sorted(latencies)
+
+
+def bench_dequeue(database_url, concurrency, batch_size):
+    processed = [0] * concurrency
+
+    def work(index, conn):
+        worker = f"bench-{index}"
+        while True:
+            n = jobs.run_batch(conn, worker, batch_size)
+            processed[index] += n
+            if n == 0:
+                return
+
+    elapsed = run_threads(database_url, concurrency, work)
+    return elapsed, sum(processed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--batch-size", type=int, default=jobs.BATCH_SIZE, help="jobs claimed per worker batch")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    setup(database_url)
+    try:
+        print(f"{args.jobs} jobs, dequeue batch size {args.batch_size}")
+        for concurrency in args.concurrency:
+            elapsed, latencies = bench_enqueue(database_url, concurrency, args.jobs)
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+            print(f"enqueue x{concurrency:<3}: {len(latencies) / elapsed:8.0f} jobs/s, "
+                  f"latency p50 {p50:6.2f} ms, p99 {p99:6.2f} ms")
+
+            elapsed, processed = bench_dequeue(database_url, concurrency, args.batch_size)
+            print(f"dequeue x{concurrency:<3}: {processed / elapsed:8.0f} jobs/s ({processed} jobs in {elapsed:.2f}s)")
+    finally:
+        conn = psycopg2.connect(database_url)
+        conn.cursor().execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Throughput of concurrent releases to one seller: the old balance-row update
+vs. ledger appends (transactions.py).
+
+    DATABASE_URL=postgres://... python benchmarks/release_contention.py [--concurrency 200] [--rounds 5]
+
+Runs against a scratch schema in the given database (created and dropped
+by the benchmark; nothing else is touched). Every worker has its own
+connection and releases --rounds escrows of the same seller, all workers
+starting together.
+
+"before" is releaseFunds as it was: mark the escrow released, then
+UPDATE users SET balance = balance + amount and read it back, so every
+release waits for the previous one's commit on the seller's row lock.
+"after" appends the release posting and reads the balance as snapshot +
+delta; releases only conflict on their own escrow row.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import threading
+import time
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import transactions  # noqa: E402
+
+SCHEMA = f"bench_release_{os.getpid()}"
+
+SCHEMA_SQL = """
+    CREATE TABLE users (
+        id      SERIAL PRIMARY KEY,
+        balance NUMERIC NOT NULL DEFAULT 0
+    );
+    CREATE TABLE escrows (
+        id         SERIAL PRIMARY KEY,
+        buyer_id   INTEGER,
+        seller_id  INTEGER REFERENCES users(id),
+        amount     NUMERIC,
+        status     TEXT,
+        updated_at TIMESTAMP
+    );
+    CREATE TABLE seller_withdrawal_methods (
+        id          SERIAL PRIMARY KEY,
+        user_id     INTEGER,
+        method_code TEXT,
+        details     JSONB,
+        active      BOOLEAN DEFAULT TRUE
+    );
+"""
+
+
+def connect(database_url):
+    return psycopg2.connect(database_url, options=f"-c search_path={SCHEMA}")
+
+
+def release_before(cur, escrow_id, seller_id, amount):
+    cur.execute("UPDATE escrows SET status = 'released', updated_at = %s WHERE id = %s",
+                (datetime.datetime.utcnow(), escrow_id))
+    cur.execute("UPDATE users SET balance = balance + %s WHERE id = %s", (amount, seller_id))
+    cur.execute("SELECT balance FROM users WHERE id = %s", (seller_id,))
+    return cur.fetchone()[0]
+
+
+def release_after(cur, escrow_id, seller_id, amount):
+    cur.execute("UPDATE escrows SET status = 'released', updated_at = %s WHERE id = %s",
+                (datetime.datetime.utcnow(), escrow_id))
+    transactions.release(cur, escrow_id, seller_id, amount)
+    return transactions.balance(cur, transactions.user_account(seller_id))
+
+
+def setup(database_url):
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path = {SCHEMA}")
+    cur.execute(SCHEMA_SQL)
+    with open(os.path.join(ROOT, "migrations", "011_ledger.sql")) as f:
+        cur.execute(f.read())
+    cur.execute("INSERT INTO users DEFAULT VALUES RETURNING id")
+    seller_id = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return seller_id
+
+
+def create_escrows(database_url, seller_id, count, amount):
+    conn = connect(database_url)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO escrows (buyer_id, seller_id, amount, status)
+        SELECT 1, %s, %s, 'paid' FROM generate_series(1, %s)
+        RETURNING id
+    """, (seller_id, amount, count))
+    escrow_ids = [row[0] for row in cur.fetchall()]
+    for escrow_id in escrow_ids:
+        transactions.hold(cur, escrow_id, amount)
+    conn.commit()
+    conn.close()
+    return escrow_ids
+
+
+def run_mode(database_url, release, seller_id, concurrency, rounds, amount):
+    escrow_ids = create_escrows(database_url, seller_id, concurrency * rounds, amount)
+    connections = [connect(database_url) for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index):
+        conn = connections[index]
+        cur = conn.cursor()
+        mine = escrow_ids[index::concurrency]
+        barrier.wait()
+        for escrow_id in mine:
+            started = time.perf_counter()
+            try:
+                release(cur, escrow_id, seller_id, amount)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    for conn in connections:
+        conn.close()
+    return elapsed, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5, help="releases per worker")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    amount = 10
+    seller_id = setup(database_url)
+    try:
+        print(f"{args.concurrency} concurrent workers x {args.rounds} releases to one seller")
+        for mode, release in (("before", release_before), ("after", release_after)):
+            elapsed, latencies, errors = run_mode(database_url, release, seller_id,
+                                                  args.concurrency, args.rounds, amount)
+            done = len(latencies)
+            p50 = statistics.median(latencies) * 1000 if latencies else 0
+            p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+            print(f"{mode:>6}: {done} releases in {elapsed:6.2f}s = {done / elapsed:8.1f}/s, "
+                  f"latency p50 {p50:7.1f} ms, p99 {p99:7.1f} ms, {len(errors)} errors")
+
+        conn = connect(database_url)
+        cur = conn.cursor()
+        print("seller ledger balance:", transactions.balance(cur, transactions.user_account(seller_id)))
+        conn.close()
+    finally:
+        conn = psycopg2.connect(database_url)
+        conn.cursor().execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Peak RSS for one large base64-in-JSON attachment (sellerSubmitDelivery /
+sellerUploadKYC format), before and after streaming.
+
+    python benchmarks/upload_memory.py [--size-mb 50]
+
+"before" mirrors the old path: app.py buffers and decodes the body, the
+function json.loads() it and base64-decodes the attachment in one go.
+"after" is uploads.read_json_attachments() reading the request stream.
+Each mode runs in its own process so ru_maxrss is not shared.
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def write_body(path, size_mb):
+    """Write a JSON body with one random attachment without holding it in memory."""
+    raw_chunk = 3 * 64 * 1024
+    remaining = size_mb * 1024 * 1024
+    with open(path, "wb") as f:
+        f.write(b'{"escrowId": 1, "deliveryTerms": "benchmark", '
+                b'"attachments": [{"filename": "bench.bin", "content": "')
+        while remaining > 0:
+            n = min(raw_chunk, remaining)
+            f.write(base64.b64encode(os.urandom(n)))
+            remaining -= n
+        f.write(b'"}]}')
+
+
+def run_before(body_path, upload_dir):
+    with open(body_path, "rb") as f:
+        raw = f.read()
+    body = raw.decode("utf-8")
+    data = json.loads(body)
+    for attachment in data["attachments"]:
+        with open(os.path.join(upload_dir, attachment["filename"]), "wb") as out:
+            out.write(base64.b64decode(attachment["content"]))
+
+
+def run_after(body_path, upload_dir):
+    os.environ["BLOB_STORE_DIR"] = upload_dir
+    sys.path.insert(0, ROOT)
+    import uploads
+
+    with open(body_path, "rb") as f:
+        uploads.read_json_attachments({"headers": {}, "bodyStream": f},
+                                      max_file_bytes=1 << 40, max_request_bytes=1 << 40)
+
+
+def child(mode, body_path, upload_dir):
+    baseline = peak_rss_mb()
+    (run_before if mode == "before" else run_after)(body_path, upload_dir)
+    print(json.dumps({"mode": mode, "baseline_mb": baseline, "peak_mb": peak_rss_mb()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--child", choices=["before", "after"], help=argparse.SUPPRESS)
+    parser.add_argument("--body", help=argparse.SUPPRESS)
+    parser.add_argument("--upload-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.body, args.upload_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        body_path = os.path.join(workdir, "body.json")
+        write_body(body_path, args.size_mb)
+        body_mb = os.path.getsize(body_path) / (1024 * 1024)
+        print(f"attachment: {args.size_mb} MB decoded, request body: {body_mb:.1f} MB")
+
+        for mode in ("before", "after"):
+            upload_dir = os.path.join(workdir, mode)
+            os.mkdir(upload_dir)
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--body", body_path, "--upload-dir", upload_dir],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(out)
+            print(f"{mode:>6}: peak RSS {result['peak_mb']:7.1f} MB "
+                  f"({result['peak_mb'] - result['baseline_mb']:+.1f} MB over interpreter baseline)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; there a single process is assumed
+    fcntl = None
+
+# Content-addressed storage for escrow/KYC attachments. Blobs are stored
+# under their SHA-256, so identical uploads share one copy; escrow_files rows
+# (files and their thumbnails) and upload_session_chunks rows reference them
+# by sha256. Unreferenced blobs are removed by gc(), which only considers
+# blobs untouched for GC_GRACE_SECONDS so uploads whose row has not
+# committed yet are never swept. Storing a blob and deleting it both hold
+# the blob's lock, so a deduplicated upload either refreshes the blob
+# before gc looks at it or writes it again after gc removed it.
+#
+#     python blob_store.py gc [--loop SECONDS]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+BLOB_STORE = os.getenv("BLOB_STORE", "local")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(ROOT, "blobs"))
+GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+GC_BATCH_SIZE = 1000
+
+
+class LocalBlobWriter:
+    """Streams one blob to a temp file; commit() moves it to its content address."""
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir, prefix="upload-")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+        self.file.write(chunk)
+
+    def commit(self):
+        """Store the blob; returns (sha256, size, created) where created is False for a duplicate."""
+        self.file.close()
+        digest = self.sha256.hexdigest()
+        path = self.store.path(digest)
+
+        with self.store.lock(digest):
+            if os.path.exists(path):
+                # Already stored: drop our copy and refresh the blob's mtime so
+                # gc() sees it as recently used
+                os.unlink(self.tmp_path)
+                os.utime(path)
+                return digest, self.size, False
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp_path, path)
+        return digest, self.size, True
+
+    def abort(self):
+        try:
+            self.file.close()
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+
+class LocalBlobStore:
+    """Blobs as files under root/ab/cd/<sha256>."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.lock_dir = os.path.join(root, "locks")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def relative_path(self, sha256):
+        return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+    def path(self, sha256):
+        return os.path.join(self.root, self.relative_path(sha256))
+
+    def open_writer(self):
+        return LocalBlobWriter(self)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def open(self, sha256):
+        return open(self.path(sha256), "rb")
+
+    @contextlib.contextmanager
+    def lock(self, sha256):
+        """Exclusive lock on a blob across processes; blobs share 256 lock files by prefix."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.lock_dir, sha256[:2] + ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def delete(self, sha256):
+        try:
+            os.unlink(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def delete_if_unused(self, sha256, cutoff):
+        """Delete a blob unless it was written or deduplicated against since cutoff; True if deleted."""
+        with self.lock(sha256):
+            last_used = self.last_used(sha256)
+            if last_used is None or last_used >= cutoff:
+                return False
+            self.delete(sha256)
+            return True
+
+    def last_used(self, sha256):
+        """Last write/dedup time of a blob, or None if it does not exist."""
+        try:
+            return os.stat(self.path(sha256)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def iter_blobs(self):
+        """Yield (sha256, last_used) for every stored blob."""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d not in ("tmp", "locks")]
+            for name in filenames:
+                try:
+                    yield name, os.stat(os.path.join(dirpath, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+
+
+def concatenate(digests, store=None, read_size=1024 * 1024):
+    """
+    Stream the given blobs, in order, into a new blob. Returns the same
+    (sha256, size, created) tuple as a writer's commit().
+    """
+    store = store or get_blob_store()
+    writer = store.open_writer()
+    try:
+        for digest in digests:
+            with store.open(digest) as f:
+                while True:
+                    data = f.read(read_size)
+                    if not data:
+                        break
+                    writer.write(data)
+        return writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+
+
+BLOB_STORES = {
+    "local": lambda: LocalBlobStore(BLOB_STORE_DIR),
+}
+
+_store = None
+
+
+def get_blob_store():
+    """The configured blob store (BLOB_STORE, default "local")."""
+    global _store
+    if _store is None:
+        if BLOB_STORE not in BLOB_STORES:
+            raise ValueError(f"Unknown BLOB_STORE {BLOB_STORE!r}")
+        _store = BLOB_STORES[BLOB_STORE]()
+    return _store
+
+
+def _sweep_tmp(store, cutoff):
+    # Temp files left by crashed uploads
+    tmp_dir = getattr(store, "tmp_dir", None)
+    if not tmp_dir:
+        return
+    for name in os.listdir(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def gc(conn, store=None, grace_seconds=GC_GRACE_SECONDS):
+    """
+    Delete blobs that nothing references and that have not been written or
+    deduplicated against for grace_seconds. Expired upload sessions are
+    dropped first so their chunks become collectable. References are checked
+    in batches through the sha256 indexes. Returns the number deleted.
+    """
+    store = store or get_blob_store()
+    cutoff = time.time() - grace_seconds
+    _sweep_tmp(store, cutoff)
+
+    deleted = 0
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            DELETE FROM upload_sessions
+            WHERE status = 'open' AND expires_at < (now() AT TIME ZONE 'utc');
+        """)
+        conn.commit()
+
+        batch = []
+        for sha256, last_used in store.iter_blobs():
+            if last_used < cutoff:
+                batch.append(sha256)
+            if len(batch) >= GC_BATCH_SIZE:
+                deleted += _gc_batch(cur, store, batch, cutoff)
+                batch = []
+        if batch:
+            deleted += _gc_batch(cur, store, batch, cutoff)
+    finally:
+        cur.close()
+        conn.rollback()
+    return deleted
+
+
+def _gc_batch(cur, store, batch, cutoff):
+    cur.execute("""
+        SELECT sha256 FROM escrow_files WHERE sha256 = ANY(%s)
+        UNION
+        SELECT thumbnail_sha256 FROM escrow_files WHERE thumbnail_sha256 = ANY(%s)
+        UNION
+        SELECT sha256 FROM upload_session_chunks WHERE sha256 = ANY(%s);
+    """, (batch, batch, batch))
+    referenced = {row[0] for row in cur.fetchall()}
+    deleted = 0
+    for sha256 in batch:
+        if sha256 in referenced:
+            continue
+        # Re-checked under the blob's lock in case an upload deduplicated
+        # against it since it was listed
+        if store.delete_if_unused(sha256, cutoff):
+            deleted += 1
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blob store maintenance")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--loop", type=int, metavar="SECONDS",
+                        help="keep running, sweeping every SECONDS")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    while True:
+        conn = psycopg2.connect(database_url)
+        try:
+            print(f"Deleted {gc(conn)} unreferenced blobs")
+        finally:
+            conn.close()
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
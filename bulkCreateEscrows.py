@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import psycopg2
+import datetime
+import idempotency
+import bulk_escrows
+
+# Larger files go through "python bulk_escrows.py", which commits in batches
+MAX_ROWS = int(os.getenv("BULK_ESCROW_MAX_ROWS", "10000"))
+
+def handler(event, context):
+    """
+    Netlify Python Function: /bulkCreateEscrows
+    Creates escrows in bulk for the authenticated buyer. The body is CSV
+    (Content-Type text/csv, header seller_email,amount,payment_method) or
+    NDJSON (application/x-ndjson, one object per line); ?format=csv|ndjson
+    overrides the Content-Type. Responds with one result per row, in order:
+    {"row": 1, "escrow_id": 123} or {"row": 2, "error": "..."}
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Parse request body
+    query = event.get("queryStringParameters") or {}
+    content_type = headers.get('content-type', '') or headers.get('Content-Type', '')
+    fmt = query.get("format") or bulk_escrows.detect_format(content_type)
+    if fmt not in bulk_escrows.FORMATS:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": f"format must be one of {', '.join(bulk_escrows.FORMATS)}"})
+        }
+
+    try:
+        rows = list(bulk_escrows.read_rows(io.StringIO(event.get("body") or "", newline=""), fmt))
+    except bulk_escrows.BulkInputError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    except Exception as e:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Invalid request body", "details": str(e)})
+        }
+
+    if not rows:
+        return {"statusCode": 400, "body": json.dumps({"error": "No rows provided"})}
+    if len(rows) > MAX_ROWS:
+        return {"statusCode": 413, "body": json.dumps({"error": f"At most {MAX_ROWS} rows per request"})}
+
+    # Connect to Neon DB
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, user_role = user_result
+
+        # Check if user is a buyer
+        if user_role != 'buyer':
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 403,
+                "body": json.dumps({"error": "Only buyers can create escrows"})
+            }
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Create escrows
+    try:
+        # A retried request gets the stored response instead of a second set of escrows
+        idem, replay = idempotency.begin(cur, event, "bulkCreateEscrows", user_id)
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
+        results = bulk_escrows.create(cur, user_id, rows)
+        created = sum(1 for r in results if "escrow_id" in r)
+
+        response = {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({
+                "success": True,
+                "created": created,
+                "failed": len(results) - created,
+                "results": results
+            })
+        }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
+
+    except Exception as e:
+        conn.rollback()
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to create escrows", "details": str(e)})
+        }
@@ -0,0 +1,227 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+
+import notifications
+import seller_directory
+
+# Bulk escrow creation for marketplace partners (bulkCreateEscrows and the
+# command below). Input is CSV with a seller_email,amount,payment_method
+# header, or NDJSON with one {"seller_email", "amount", "payment_method"}
+# object per line. Rows are validated in Python, every seller email in the
+# batch is resolved at once (seller_directory.py), and the valid rows are
+# loaded into a temp staging table with COPY and inserted into escrows with
+# one INSERT ... SELECT. Each input row gets a result: its escrow_id or an
+# error. Invalid rows never stop the valid ones in their batch. The
+# escrow_created emails are queued for every new escrow in the same
+# transaction, as createEscrow does (notifications.py).
+#
+#     python bulk_escrows.py --buyer-email partner@example.com escrows.csv [--format ndjson] [--batch-size N]
+
+FIELDS = ("seller_email", "amount", "payment_method")
+FORMATS = ("csv", "ndjson")
+BATCH_SIZE = 50000
+MAX_EMAIL_LENGTH = 254
+MAX_PAYMENT_METHOD_LENGTH = 100
+
+
+class BulkInputError(Exception):
+    """The input as a whole can't be read (e.g. a CSV without the required header)."""
+
+
+def detect_format(name_or_content_type, default="csv"):
+    """csv or ndjson from a file name or Content-Type."""
+    value = (name_or_content_type or "").lower()
+    if "json" in value:
+        return "ndjson"
+    if "csv" in value:
+        return "csv"
+    return default
+
+
+def read_rows(lines, fmt):
+    """
+    Yield (row_number, row) for each data row, numbered from 1. An NDJSON
+    line that isn't a JSON object yields None for its row. Raises
+    BulkInputError if a CSV header lacks a required column.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        missing = [f for f in FIELDS if f not in (reader.fieldnames or [])]
+        if missing:
+            raise BulkInputError(f"CSV header is missing {', '.join(missing)}")
+        for row_number, row in enumerate(reader, 1):
+            yield row_number, row
+        return
+
+    row_number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row_number, row if isinstance(row, dict) else None
+
+
+def validate(row):
+    """(seller_email, amount, payment_method) for a row; raises ValueError with a message."""
+    if row is None:
+        raise ValueError("Invalid JSON object")
+    seller_email = str(row.get("seller_email") or "").strip()
+    payment_method = str(row.get("payment_method") or "").strip()
+    if not seller_email or not payment_method or row.get("amount") in (None, ""):
+        raise ValueError("Missing required fields (seller_email, amount, payment_method)")
+    if len(seller_email) > MAX_EMAIL_LENGTH or "@" not in seller_email:
+        raise ValueError("Invalid seller_email")
+    if len(payment_method) > MAX_PAYMENT_METHOD_LENGTH:
+        raise ValueError("Invalid payment_method")
+    try:
+        amount = Decimal(str(row["amount"]).strip())
+    except InvalidOperation:
+        raise ValueError("Invalid amount")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("amount must be a positive number")
+    return seller_email, amount, payment_method
+
+
+def create(cur, buyer_id, rows):
+    """
+    Create escrows for buyer_id from [(row_number, row), ...] in the
+    caller's transaction. Returns one result dict per row, in row order:
+    {"row": n, "escrow_id": id} or {"row": n, "error": message}.
+    """
+    results = {}
+    valid = []
+    for row_number, row in rows:
+        try:
+            valid.append((row_number,) + validate(row))
+        except ValueError as e:
+            results[row_number] = {"row": row_number, "error": str(e)}
+
+    # Every seller in the batch at once: cached ones from the directory,
+    # the rest in one query
+    seller_ids = seller_directory.lookup_many(cur, [r[1] for r in valid]) if valid else {}
+
+    staged = io.StringIO()
+    writer = csv.writer(staged)
+    staged_count = 0
+    for row_number, seller_email, amount, payment_method in valid:
+        seller_id = seller_ids.get(seller_email)
+        if seller_id is None:
+            results[row_number] = {"row": row_number, "error": "Seller not found or not a seller"}
+            continue
+        writer.writerow((row_number, seller_id, amount, payment_method))
+        staged_count += 1
+
+    if staged_count:
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS bulk_escrow_staging (
+                row_no         INTEGER NOT NULL,
+                seller_id      INTEGER NOT NULL,
+                amount         NUMERIC NOT NULL,
+                payment_method TEXT NOT NULL
+            ) ON COMMIT DELETE ROWS;
+            TRUNCATE bulk_escrow_staging;
+        """)
+        staged.seek(0)
+        cur.copy_expert("""
+            COPY bulk_escrow_staging (row_no, seller_id, amount, payment_method)
+            FROM STDIN WITH (FORMAT csv)
+        """, staged)
+
+        # Ids are drawn up front so each one can be reported against its row
+        cur.execute("""
+            WITH staged AS (
+                SELECT row_no, seller_id, amount, payment_method,
+                       nextval(pg_get_serial_sequence('escrows', 'id')) AS escrow_id
+                FROM bulk_escrow_staging
+            ), inserted AS (
+                INSERT INTO escrows (id, buyer_id, seller_id, amount, payment_method, status)
+                SELECT escrow_id, %s, seller_id, amount, payment_method, 'pending'
+                FROM staged
+                ORDER BY row_no
+            )
+            SELECT row_no, escrow_id FROM staged;
+        """, (buyer_id,))
+        created = cur.fetchall()
+        for row_number, escrow_id in created:
+            results[row_number] = {"row": row_number, "escrow_id": escrow_id}
+        notifications.enqueue_many(cur, "escrow_created", [escrow_id for _, escrow_id in created])
+
+    return [results[n] for n in sorted(results)]
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create escrows in bulk from CSV or NDJSON")
+    parser.add_argument("file", help="input file, or - for stdin")
+    parser.add_argument("--buyer-email", required=True, help="buyer the escrows are created for")
+    parser.add_argument("--format", choices=FORMATS, help="input format (default: from the file name, else csv)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    fmt = args.format or detect_format(args.file)
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    lines = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    created = failed = 0
+    try:
+        cur.execute("SELECT id FROM users WHERE email = %s AND role = 'buyer';", (args.buyer_email,))
+        buyer = cur.fetchone()
+        if not buyer:
+            print(f"No buyer with email {args.buyer_email}", file=sys.stderr)
+            return 1
+
+        # One transaction per batch; results go to stdout as NDJSON
+        for batch in _batches(read_rows(lines, fmt), args.batch_size):
+            try:
+                results = create(cur, buyer[0], batch)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            for result in results:
+                if "escrow_id" in result:
+                    created += 1
+                else:
+                    failed += 1
+                print(json.dumps(result))
+    except BulkInputError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        cur.close()
+        conn.close()
+
+    print(f"Created {created} escrows, {failed} rows failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,9 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
+import seller_directory
+import notifications
 
 def handler(event, context):
     """
@@ -96,18 +99,22 @@ def handler(event, context):
 
     # Create escrow
     try:
-        # Check if seller exists
-        cur.execute("SELECT id FROM users WHERE email = %s AND role = 'seller'", (seller_email,))
-        seller_result = cur.fetchone()
-        if not seller_result:
+        # A retried request gets the stored response instead of a second escrow
+        idem, replay = idempotency.begin(cur, event, "createEscrow", user_id)
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
+        # Check if seller exists (cached; see seller_directory.py)
+        seller_id = seller_directory.lookup(cur, seller_email)
+        if seller_id is None:
             cur.close()
             conn.close()
             return {
                 "statusCode": 400,
                 "body": json.dumps({"error": "Seller not found or not a seller"})
             }
-        
-        seller_id = seller_result[0]
 
         # Insert escrow (without currency column)
         cur.execute("""
@@ -117,11 +124,11 @@ def handler(event, context):
         """, (user_id, seller_id, amount, paymentMethod))
         
         escrow_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
 
-        return {
+        # Emailed by the notification relay once this commits
+        notifications.enqueue(cur, "escrow_created", escrow_id)
+
+        response = {
             "statusCode": 200,
             "body": json.dumps({
                 "success": True,
@@ -133,6 +140,12 @@ def handler(event, context):
                 "payment_method": paymentMethod
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         conn.rollback()
@@ -3,6 +3,7 @@ import os
 import psycopg2
 import datetime
 from decimal import Decimal
+import deposit_addresses
 
 def handler(event, context):
     """
@@ -77,12 +78,14 @@ def handler(event, context):
             "body": json.dumps({"error": "Token validation failed", "details": str(e)})
         }
 
-    # Get escrow and generate deposit address
+    # Get escrow and its deposit instructions
     try:
-        # Check if the user is allowed to view this escrow (must be the buyer)
+        # Check if the user is allowed to view this escrow (must be the buyer).
+        # Instructions are allocated on the first call and read back after
         cur.execute("""
-            SELECT e.id, e.amount, e.payment_method, e.status
+            SELECT e.id, e.amount, e.payment_method, e.status, d.deposit_address, d.deposit_info
             FROM escrows e
+            LEFT JOIN escrow_deposit_instructions d ON d.escrow_id = e.id
             WHERE e.id = %s AND e.buyer_id = %s
         """, (escrow_id, user_id))
 
@@ -95,30 +98,22 @@ def handler(event, context):
                 "body": json.dumps({"error": "Escrow not found or access denied"})
             }
 
-        escrow_id, amount, payment_method, status = escrow_result
-
-        # Generate a mock deposit address (in a real app, this would call a payment processor API)
-        if payment_method == 'bank_transfer':
-            deposit_address = "BANK-ACC-1234567890"
-            deposit_info = {
-                "bank_name": "Vanguard Bank",
-                "account_number": "1234567890",
-                "routing_number": "021000021",
-                "reference": f"ESCROW-{escrow_id}"
-            }
-        elif payment_method == 'crypto':
-            deposit_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
-            deposit_info = {
-                "crypto_type": "Bitcoin",
-                "network": "BTC Mainnet",
-                "memo": f"ESCROW-{escrow_id}"
-            }
-        else:
-            deposit_address = f"PAYMENT-{escrow_id}-{payment_method}"
-            deposit_info = {
-                "instructions": f"Send payment for escrow {escrow_id}",
-                "reference": f"ESCROW-{escrow_id}"
-            }
+        escrow_id, amount, payment_method, status, deposit_address, deposit_info = escrow_result
+
+        if deposit_address is None:
+            try:
+                deposit_address, deposit_info = deposit_addresses.allocate(cur, escrow_id, payment_method)
+                conn.commit()
+            except deposit_addresses.PoolExhausted:
+                # Commit sends the refill NOTIFY
+                conn.commit()
+                cur.close()
+                conn.close()
+                return {
+                    "statusCode": 503,
+                    "headers": {"Retry-After": "30"},
+                    "body": json.dumps({"error": "No deposit address available right now, please retry shortly"})
+                }
 
         # Convert Decimal to float for JSON serialization
         if isinstance(amount, Decimal):
@@ -143,6 +138,7 @@ def handler(event, context):
         }
 
     except Exception as e:
+        conn.rollback()
         cur.close()
         conn.close()
         return {
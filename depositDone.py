@@ -2,6 +2,7 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
 
 def handler(event, context):
     """POST /.netlify/functions/depositDone"""
@@ -85,6 +86,13 @@ def handler(event, context):
 
     # Update escrow status
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "depositDone", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         cur.execute("""
             UPDATE escrows 
             SET status = 'funds_in_escrow', 
@@ -100,14 +108,16 @@ def handler(event, context):
                 "body": json.dumps({"error": "Escrow not found or already confirmed"})
             }
         
+        response = {
+            "statusCode": 200,
+            "body": json.dumps({"message": "Deposit confirmed successfully"})
+        }
+        idempotency.finish(cur, idem, response)
         conn.commit()
         cur.close()
         conn.close()
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({"message": "Deposit confirmed successfully"})
-        }
+        return response
 
     except Exception as e:
         print("DB error:", e)
@@ -0,0 +1,366 @@
+import argparse
+import hashlib
+import hmac
+import logging
+import os
+import re
+import select
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+logger = logging.getLogger(__name__)
+
+# Per-escrow deposit instructions for depositAddress (see
+# migrations/014_deposit_addresses.sql).
+#
+# Crypto escrows get their own Bitcoin address. Addresses are derived
+# deterministically from DEPOSIT_XPUB (an account-level xpub/zpub; receive
+# chain .../0/i, native segwit) ahead of time into deposit_address_pool, and
+# an escrow claims the lowest free one with SKIP LOCKED, so no key material
+# or EC math is on the request path. Every escrow also gets a bank payment
+# reference ESCROW-<id>-<check digits> (ISO 7064 MOD 97-10), which
+# reconciliation can verify. Instructions are stored once per escrow in
+# escrow_deposit_instructions; later calls read them back by primary key.
+#
+# "refill" tops the pool back up to DEPOSIT_POOL_TARGET free addresses when
+# it drops below DEPOSIT_POOL_LOW_WATERMARK. It runs on a timer and on
+# NOTIFY deposit_address_pool_low, which a claim sends when it finds the
+# pool empty:
+#
+#     python deposit_addresses.py refill [--loop SECONDS]
+
+DEPOSIT_XPUB = os.getenv("DEPOSIT_XPUB", "")
+NETWORK = "bitcoin"
+POOL_LOW_WATERMARK = int(os.getenv("DEPOSIT_POOL_LOW_WATERMARK", "200"))
+POOL_TARGET = int(os.getenv("DEPOSIT_POOL_TARGET", "1000"))
+NOTIFY_CHANNEL = "deposit_address_pool_low"
+
+BANK_DETAILS = {
+    "bank_name": os.getenv("DEPOSIT_BANK_NAME", "Vanguard Bank"),
+    "account_number": os.getenv("DEPOSIT_BANK_ACCOUNT_NUMBER", "1234567890"),
+    "routing_number": os.getenv("DEPOSIT_BANK_ROUTING_NUMBER", "021000021"),
+}
+
+# ESCROW-<id>, optionally followed by -<two check digits>; references
+# handed out before check digits were added have none
+REFERENCE_RE = re.compile(r"\bESCROW-(\d{1,10})(?:-(\d{2}))?\b", re.IGNORECASE)
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BECH32_ALPHABET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+# Extended public key version bytes -> bech32 human-readable part
+_XPUB_VERSIONS = {
+    bytes.fromhex("0488b21e"): "bc",  # xpub
+    bytes.fromhex("04b24746"): "bc",  # zpub
+    bytes.fromhex("043587cf"): "tb",  # tpub
+    bytes.fromhex("045f1c42"): "tb",  # vpub
+}
+
+# secp256k1
+_P = 2 ** 256 - 2 ** 32 - 977
+_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+      0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+
+class PoolExhausted(Exception):
+    """No free deposit address; a refill has been requested."""
+
+
+def bank_reference(escrow_id):
+    """ESCROW-<id>-<check digits>, with ISO 7064 MOD 97-10 check digits."""
+    escrow_id = int(escrow_id)
+    return f"ESCROW-{escrow_id}-{98 - escrow_id * 100 % 97:02d}"
+
+
+def parse_reference(text):
+    """
+    Escrow id from the first ESCROW-<id>[-<check>] reference in text, or
+    None. A reference whose check digits don't match is ignored.
+    """
+    for match in REFERENCE_RE.finditer(text or ""):
+        escrow_id, check = int(match.group(1)), match.group(2)
+        if check is None or (escrow_id * 100 + int(check)) % 97 == 1:
+            return escrow_id
+    return None
+
+
+def _point_add(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a[0] == b[0]:
+        if (a[1] + b[1]) % _P == 0:
+            return None
+        slope = 3 * a[0] * a[0] * pow(2 * a[1], -1, _P) % _P
+    else:
+        slope = (b[1] - a[1]) * pow(b[0] - a[0], -1, _P) % _P
+    x = (slope * slope - a[0] - b[0]) % _P
+    return x, (slope * (a[0] - x) - a[1]) % _P
+
+
+def _point_mul(k, point=_G):
+    result = None
+    while k:
+        if k & 1:
+            result = _point_add(result, point)
+        point = _point_add(point, point)
+        k >>= 1
+    return result
+
+
+def _decompress(key):
+    x = int.from_bytes(key[1:], "big")
+    y = pow((x * x * x + 7) % _P, (_P + 1) // 4, _P)
+    if y % 2 != key[0] % 2:
+        y = _P - y
+    return x, y
+
+
+def _compress(point):
+    return bytes([2 + (point[1] & 1)]) + point[0].to_bytes(32, "big")
+
+
+def _ckd_pub(key, chain_code, index):
+    """BIP32 public child key derivation (non-hardened index)."""
+    digest = hmac.new(chain_code, key + index.to_bytes(4, "big"), hashlib.sha512).digest()
+    tweak = int.from_bytes(digest[:32], "big")
+    if tweak >= _N:
+        raise ValueError(f"index {index} is not derivable")
+    child = _point_add(_point_mul(tweak), _decompress(key))
+    if child is None:
+        raise ValueError(f"index {index} is not derivable")
+    return _compress(child), digest[32:]
+
+
+def parse_xpub(xpub):
+    """(public key, chain code, bech32 hrp) from an extended public key."""
+    number = 0
+    try:
+        for char in xpub.strip():
+            number = number * 58 + _BASE58_ALPHABET.index(char)
+        raw = number.to_bytes(82, "big")
+    except (ValueError, OverflowError):
+        raise ValueError("not an extended public key (xpub/zpub/tpub/vpub)")
+    payload, checksum = raw[:-4], raw[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("extended public key has an invalid checksum")
+    hrp = _XPUB_VERSIONS.get(payload[:4])
+    if hrp is None or payload[45] not in (2, 3):
+        raise ValueError("not an extended public key (xpub/zpub/tpub/vpub)")
+    return payload[45:78], payload[13:45], hrp
+
+
+def _bech32_polymod(values):
+    generator = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= generator[i]
+    return checksum
+
+
+def p2wpkh_address(key, hrp="bc"):
+    """Native segwit (bech32, v0) address for a compressed public key."""
+    program = hashlib.new("ripemd160", hashlib.sha256(key).digest()).digest()
+    data = [0]
+    acc = bits = 0
+    for byte in program:
+        acc = (acc << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            data.append((acc >> bits) & 31)
+    if bits:
+        data.append((acc << (5 - bits)) & 31)
+    expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(_BECH32_ALPHABET[d] for d in data + checksum)
+
+
+def derive_addresses(xpub, start, count):
+    """[(index, address)] for receive addresses start .. start+count-1 of xpub."""
+    key, chain_code, hrp = parse_xpub(xpub)
+    receive_key, receive_chain = _ckd_pub(key, chain_code, 0)
+    addresses = []
+    for index in range(start, start + count):
+        try:
+            child, _ = _ckd_pub(receive_key, receive_chain, index)
+        except ValueError:
+            continue
+        addresses.append((index, p2wpkh_address(child, hrp)))
+    return addresses
+
+
+def key_source(xpub):
+    """Short id of the xpub a pool row was derived from."""
+    return hashlib.sha256(xpub.strip().encode()).hexdigest()[:16]
+
+
+def allocate(cur, escrow_id, payment_method):
+    """
+    Create and store deposit instructions for an escrow that has none yet,
+    in the caller's transaction. Returns (deposit_address, deposit_info).
+    Raises PoolExhausted if a crypto escrow finds no free address; the
+    caller should commit so the refill NOTIFY goes out.
+    """
+    # Serializes allocation per escrow; re-check under the lock
+    cur.execute("SELECT id FROM escrows WHERE id = %s FOR UPDATE;", (escrow_id,))
+    cur.execute("""
+        SELECT deposit_address, deposit_info
+        FROM escrow_deposit_instructions
+        WHERE escrow_id = %s;
+    """, (escrow_id,))
+    row = cur.fetchone()
+    if row:
+        return row[0], row[1]
+
+    reference = bank_reference(escrow_id)
+    if payment_method == 'crypto':
+        # Lowest free address; concurrent claims skip each other's rows
+        cur.execute("""
+            UPDATE deposit_address_pool
+            SET escrow_id = %s, claimed_at = (now() AT TIME ZONE 'utc')
+            WHERE address = (
+                SELECT address FROM deposit_address_pool
+                WHERE network = %s AND escrow_id IS NULL
+                ORDER BY derivation_index
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING address;
+        """, (escrow_id, NETWORK))
+        row = cur.fetchone()
+        if not row:
+            cur.execute("SELECT pg_notify(%s, '');", (NOTIFY_CHANNEL,))
+            raise PoolExhausted()
+        deposit_address = row[0]
+        deposit_info = {
+            "crypto_type": "Bitcoin",
+            "network": "BTC Mainnet" if deposit_address.startswith("bc1") else "BTC Testnet",
+            "memo": reference
+        }
+    elif payment_method == 'bank_transfer':
+        deposit_address = f"BANK-ACC-{BANK_DETAILS['account_number']}"
+        deposit_info = dict(BANK_DETAILS, reference=reference)
+    else:
+        deposit_address = f"PAYMENT-{escrow_id}-{payment_method}"
+        deposit_info = {
+            "instructions": f"Send payment for escrow {escrow_id}",
+            "reference": reference
+        }
+
+    cur.execute("""
+        INSERT INTO escrow_deposit_instructions (escrow_id, payment_method, deposit_address, reference, deposit_info)
+        VALUES (%s, %s, %s, %s, %s);
+    """, (escrow_id, payment_method, deposit_address, reference, Json(deposit_info)))
+    return deposit_address, deposit_info
+
+
+def refill(conn, xpub=None, low_watermark=POOL_LOW_WATERMARK, target=POOL_TARGET):
+    """Top the pool up to target free addresses if it is below low_watermark. Returns the number added."""
+    xpub = xpub or DEPOSIT_XPUB
+    if not xpub:
+        raise ValueError("DEPOSIT_XPUB is not set")
+    source = key_source(xpub)
+    cur = conn.cursor()
+    try:
+        # One refill at a time; claims are not blocked
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('deposit_address_pool'));")
+        cur.execute("""
+            SELECT count(*) FROM deposit_address_pool
+            WHERE network = %s AND escrow_id IS NULL;
+        """, (NETWORK,))
+        free = cur.fetchone()[0]
+        if free >= low_watermark:
+            conn.rollback()
+            return 0
+
+        cur.execute("""
+            SELECT COALESCE(max(derivation_index) + 1, 0)
+            FROM deposit_address_pool
+            WHERE network = %s AND key_source = %s;
+        """, (NETWORK, source))
+        start = cur.fetchone()[0]
+        addresses = derive_addresses(xpub, start, target - free)
+        execute_values(cur, """
+            INSERT INTO deposit_address_pool (address, network, key_source, derivation_index)
+            VALUES %s
+            ON CONFLICT DO NOTHING;
+        """, [(address, NETWORK, source, index) for index, address in addresses])
+        conn.commit()
+        return len(addresses)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def run_forever(database_url, interval):
+    """Refill every interval seconds, and at once when a claim finds the pool empty."""
+    while True:
+        conn = listen = None
+        try:
+            conn = psycopg2.connect(database_url)
+            listen = psycopg2.connect(database_url)
+            listen.autocommit = True
+            listen.cursor().execute(f"LISTEN {NOTIFY_CHANNEL};")
+            while True:
+                added = refill(conn)
+                if added:
+                    logger.info("added %s deposit addresses", added)
+                readable, _, _ = select.select([listen], [], [], interval)
+                if readable:
+                    listen.poll()
+                    listen.notifies.clear()
+        except Exception as e:
+            logger.warning("deposit address refill failed: %s", e)
+        finally:
+            for c in (conn, listen):
+                if c is not None:
+                    try:
+                        c.close()
+                    except Exception:
+                        pass
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deposit address pool maintenance")
+    parser.add_argument("command", choices=["refill"])
+    parser.add_argument("--loop", type=int, metavar="SECONDS",
+                        help="keep running, checking the pool every SECONDS")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+    if not DEPOSIT_XPUB:
+        print("DEPOSIT_XPUB environment variable not set", file=sys.stderr)
+        return 2
+
+    if args.loop:
+        logging.basicConfig(level=logging.INFO)
+        run_forever(database_url, args.loop)
+        return 0
+
+    conn = psycopg2.connect(database_url)
+    try:
+        print(f"Added {refill(conn)} deposit addresses")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+from psycopg2.extras import execute_values
+
+import transactions
+
+# Marking escrows funded from observed deposits (reconciliation.py for bank
+# statements, deposit_watcher.py for crypto). An escrow still waiting for
+# the buyer's money moves to 'paid', as markPaid does, with the ledger hold
+# and an audit row in transactions, for a whole batch in one statement.
+
+AWAITING_PAYMENT_STATUSES = ("pending", "awaiting_confirmation", "confirmed", "pending_deposit")
+FUNDED_STATUS = "paid"
+
+_STATUS_LIST = ", ".join(f"'{s}'" for s in AWAITING_PAYMENT_STATUSES)
+
+
+def load_awaiting_payment(conn, payment_method=None):
+    """
+    {escrow_id: amount} for every escrow still waiting for payment,
+    optionally only those with payment_method. Read with a server-side
+    cursor so building the index never holds all rows twice.
+    """
+    index = {}
+    with conn.cursor(name="awaiting_payment") as cur:
+        cur.itersize = 10000
+        cur.execute(f"""
+            SELECT id, amount FROM escrows
+            WHERE status IN ({_STATUS_LIST})
+              AND (%s::text IS NULL OR payment_method = %s);
+        """, (payment_method, payment_method))
+        for escrow_id, amount in cur:
+            index[escrow_id] = amount
+    conn.rollback()
+    return index
+
+
+def mark_funded(cur, deposits):
+    """
+    Move escrows to 'paid' for [(escrow_id, description), ...], in the
+    caller's transaction; description goes on the audit row. Escrows no
+    longer waiting for payment are left alone. Returns the ids funded.
+    """
+    if not deposits:
+        return []
+    rows = execute_values(cur, f"""
+        WITH v (id, description) AS (
+            VALUES %s
+        ), funded AS (
+            UPDATE escrows e
+            SET status = '{FUNDED_STATUS}', updated_at = (now() AT TIME ZONE 'utc')
+            FROM v
+            WHERE e.id = v.id AND e.status IN ({_STATUS_LIST})
+            RETURNING e.id, e.amount, v.description
+        ), held AS (
+            SELECT f.id, f.amount, nextval('ledger_posting_seq') AS posting_id
+            FROM funded f
+            WHERE f.amount > 0
+              AND NOT EXISTS (
+                  SELECT 1 FROM ledger_entries l
+                  WHERE l.escrow_id = f.id AND l.kind = '{transactions.KIND_HOLD}' AND l.amount > 0
+              )
+        ), entries AS (
+            INSERT INTO ledger_entries (posting_id, account, amount, kind, escrow_id)
+            SELECT posting_id, 'escrow:' || id, amount, '{transactions.KIND_HOLD}', id FROM held
+            UNION ALL
+            SELECT posting_id, '{transactions.EXTERNAL_DEPOSITS}', -amount, '{transactions.KIND_HOLD}', id FROM held
+        ), audit AS (
+            INSERT INTO transactions (escrow_id, type, amount, description)
+            SELECT id, 'deposit', amount, description FROM funded
+        )
+        SELECT id FROM funded;
+    """, [(int(escrow_id), description) for escrow_id, description in deposits],
+        template="(%s::integer, %s::text)", fetch=True)
+    return [r[0] for r in rows]
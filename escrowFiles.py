@@ -0,0 +1,189 @@
+import json
+import os
+import psycopg2
+import datetime
+from blob_store import get_blob_store
+
+# Blobs are content-addressed, so a file id always maps to the same bytes
+FILE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def handler(event, context):
+    """
+    Netlify Python Function: /escrowFiles
+    GET ?escrow_id=123 lists the files attached to an escrow;
+    GET ?file_id=456 downloads one of them (supports Range and conditional
+    requests); add &thumbnail=1 for the preview of a processed image.
+    Only the escrow's buyer and seller have access, plus admins for KYC
+    documents.
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+    
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+    
+    token = auth_header.replace('Bearer ', '').strip()
+
+    query_params = event.get('queryStringParameters', {})
+    escrow_id = query_params.get('escrow_id')
+    file_id = query_params.get('file_id')
+
+    if not escrow_id and not file_id:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Missing escrow_id or file_id parameter"})
+        }
+
+    # Connect to Neon DB using ONLY DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+        
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role
+            FROM sessions s 
+            JOIN users u ON s.user_id = u.id 
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+        
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+        
+        user_id, role = user_result
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Download one file
+    if file_id:
+        try:
+            # KYC documents have no escrow; admins reviewing them may read them
+            cur.execute("""
+                SELECT f.file_name, f.sha256, f.detected_mime_type, f.uploaded_at, f.thumbnail_sha256
+                FROM escrow_files f
+                LEFT JOIN escrows e ON e.id = f.escrow_id
+                WHERE f.id = %s
+                  AND (e.buyer_id = %s OR e.seller_id = %s OR (%s AND f.kyc_submission_id IS NOT NULL))
+            """, (file_id, user_id, user_id, role == "admin"))
+            file_result = cur.fetchone()
+            cur.close()
+            conn.close()
+        except Exception as e:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "Failed to get file", "details": str(e)})
+            }
+
+        if not file_result:
+            return {
+                "statusCode": 404,
+                "body": json.dumps({"error": "File not found or access denied"})
+            }
+
+        # The type the uploader claimed is never served; only the one
+        # file_processing sniffed from the content, once it has run
+        file_name, sha256, mime_type, uploaded_at, thumbnail_sha256 = file_result
+        if query_params.get('thumbnail'):
+            sha256 = thumbnail_sha256
+            file_name = os.path.splitext(file_name)[0] + "-thumbnail.jpg"
+            mime_type = "image/jpeg"
+
+        store = get_blob_store()
+        # Files recorded before the blob store have no stored content
+        if not sha256 or not store.exists(sha256):
+            return {
+                "statusCode": 404,
+                "body": json.dumps({"error": "File content is not available"})
+            }
+
+        # app.py sends the blob with sendfile / X-Sendfile
+        return {
+            "statusCode": 200,
+            "headers": {"Cache-Control": FILE_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"},
+            "file": {
+                "path": store.path(sha256),
+                "accel_path": store.relative_path(sha256),
+                "filename": file_name,
+                "mimetype": mime_type or "application/octet-stream",
+                "etag": sha256,
+                "last_modified": uploaded_at
+            }
+        }
+
+    # List an escrow's files
+    try:
+        cur.execute("""
+            SELECT id FROM escrows
+            WHERE id = %s AND (buyer_id = %s OR seller_id = %s)
+        """, (escrow_id, user_id, user_id))
+        if not cur.fetchone():
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 404,
+                "body": json.dumps({"error": "Escrow not found or access denied"})
+            }
+
+        cur.execute("""
+            SELECT id, file_name, purpose, size_bytes, mime_type, sha256, uploaded_at
+            FROM escrow_files
+            WHERE escrow_id = %s
+            ORDER BY uploaded_at, id
+        """, (escrow_id,))
+        files = [{
+            "id": row[0],
+            "filename": row[1],
+            "purpose": row[2],
+            "size": row[3],
+            "mime_type": row[4],
+            "sha256": row[5],
+            "uploaded_at": row[6].isoformat() if row[6] else None
+        } for row in cur.fetchall()]
+
+        cur.close()
+        conn.close()
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"files": files})
+        }
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to list files", "details": str(e)})
+        }
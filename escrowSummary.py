@@ -0,0 +1,110 @@
+import json
+import os
+import psycopg2
+import datetime
+
+# Statuses always present in the response, even when the user has none
+SUMMARY_STATUSES = ("pending", "confirmed", "delivered", "release_requested", "released", "rejected")
+
+def handler(event, context):
+    """
+    Netlify Python Function: /escrowSummary
+    Returns the current user's escrow counts and totals per status (requires authentication via token)
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Connect to Neon DB using ONLY DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role = user_result
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Read the maintained summary row (one primary-key lookup)
+    try:
+        cur.execute("""
+            SELECT status_counts, status_totals, updated_at
+            FROM escrow_user_summary
+            WHERE user_id = %s
+        """, (user_id,))
+
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+
+        status_counts, status_totals, updated_at = row if row else ({}, {}, None)
+
+        statuses = {}
+        for status in SUMMARY_STATUSES + tuple(s for s in status_counts if s not in SUMMARY_STATUSES):
+            statuses[status] = {
+                "count": status_counts.get(status, 0),
+                "total": float(status_totals.get(status, 0))
+            }
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "user_id": user_id,
+                "role": role,
+                "escrow_count": sum(status_counts.values()),
+                "statuses": statuses,
+                "updated_at": updated_at.isoformat() if updated_at else None
+            })
+        }
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to get escrow summary", "details": str(e)})
+        }
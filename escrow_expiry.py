@@ -0,0 +1,256 @@
+import argparse
+import datetime
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+
+import psycopg2
+
+import transactions
+
+logger = logging.getLogger(__name__)
+
+# Timeout transitions for escrows one side has abandoned (see
+# migrations/016_escrow_expiry.sql).
+#
+#     python escrow_expiry.py run [--batch-size N] [--dry-run] [--loop SECONDS]
+#
+# Each rule moves escrows that have sat in one of its statuses for longer
+# than its deadline:
+#
+#   unconfirmed        pending / awaiting_confirmation / pending_deposit for
+#                      ESCROW_UNCONFIRMED_EXPIRY_DAYS (7) -> cancelled. Never
+#                      for an escrow with held funds or a crypto deposit seen.
+#   release_requested  release_requested for ESCROW_RELEASE_REQUESTED_EXPIRY_DAYS
+#                      (14) -> released, crediting the seller as releaseFunds
+#                      does. Only escrows whose funds are held; the others
+#                      are logged as a warning on every run.
+#
+# A deadline of 0 turns its rule off. Every batch is one statement in its
+# own short transaction: it picks at most --batch-size due rows from the
+# (status, updated_at) index, skips rows a handler has locked, updates them,
+# appends ledger entries where money moves and writes an audit row per
+# escrow to transactions. lock_timeout stops a batch rather than letting it
+# queue behind anything else.
+
+BATCH_SIZE = 500
+LOCK_TIMEOUT = "2s"
+
+Rule = namedtuple("Rule", ["name", "statuses", "days", "new_status", "audit_type", "description"])
+
+RULES = [
+    Rule("unconfirmed", ("pending", "awaiting_confirmation", "pending_deposit"),
+         int(os.getenv("ESCROW_UNCONFIRMED_EXPIRY_DAYS", "7")),
+         "cancelled", "expired", "Cancelled after {days} days without confirmation or payment"),
+    Rule("release_requested", ("release_requested",),
+         int(os.getenv("ESCROW_RELEASE_REQUESTED_EXPIRY_DAYS", "14")),
+         "released", "auto_release", "Released automatically {days} days after the seller's request"),
+]
+
+# Escrows that may be expired: no held funds and no crypto deposit on the way
+_CANCELLABLE = f"""
+    NOT EXISTS (
+        SELECT 1 FROM ledger_entries l
+        WHERE l.escrow_id = e.id AND l.kind = '{transactions.KIND_HOLD}' AND l.amount > 0
+    )
+    AND NOT EXISTS (SELECT 1 FROM crypto_deposits d WHERE d.escrow_id = e.id)
+"""
+
+# Escrows that can be auto-released: held and not released yet
+_RELEASABLE = f"""
+    EXISTS (
+        SELECT 1 FROM ledger_entries l
+        WHERE l.escrow_id = e.id AND l.kind = '{transactions.KIND_HOLD}' AND l.amount > 0
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM ledger_entries l
+        WHERE l.escrow_id = e.id AND l.kind = '{transactions.KIND_RELEASE}' AND l.amount > 0
+    )
+"""
+
+_CANCEL_SQL = f"""
+    WITH due AS (
+        SELECT e.id FROM escrows e
+        WHERE e.status = ANY(%(statuses)s) AND e.updated_at < %(cutoff)s AND {_CANCELLABLE}
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ), expired AS (
+        UPDATE escrows e
+        SET status = %(new_status)s, updated_at = (now() AT TIME ZONE 'utc')
+        FROM due
+        WHERE e.id = due.id
+        RETURNING e.id, e.amount
+    ), audit AS (
+        INSERT INTO transactions (escrow_id, type, amount, description)
+        SELECT id, %(audit_type)s, amount, %(description)s FROM expired
+    )
+    SELECT count(*) FROM expired;
+"""
+
+_RELEASE_SQL = f"""
+    WITH due AS (
+        SELECT e.id FROM escrows e
+        WHERE e.status = ANY(%(statuses)s) AND e.updated_at < %(cutoff)s AND {_RELEASABLE}
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ), released AS (
+        UPDATE escrows e
+        SET status = %(new_status)s, updated_at = (now() AT TIME ZONE 'utc')
+        FROM due
+        WHERE e.id = due.id
+        RETURNING e.id, e.amount, e.seller_id
+    ), posted AS (
+        SELECT id, amount, seller_id, nextval('ledger_posting_seq') AS posting_id
+        FROM released
+        WHERE amount > 0
+    ), entries AS (
+        INSERT INTO ledger_entries (posting_id, account, amount, kind, escrow_id)
+        SELECT posting_id, 'escrow:' || id, -amount, '{transactions.KIND_RELEASE}', id FROM posted
+        UNION ALL
+        SELECT posting_id, 'user:' || seller_id, amount, '{transactions.KIND_RELEASE}', id FROM posted
+    ), audit AS (
+        INSERT INTO transactions (escrow_id, type, amount, description)
+        SELECT id, %(audit_type)s, amount, %(description)s FROM released
+    )
+    SELECT count(*) FROM released;
+"""
+
+_COUNT_SQL = """
+    SELECT count(*) FROM escrows e
+    WHERE e.status = ANY(%(statuses)s) AND e.updated_at < %(cutoff)s AND {condition};
+"""
+
+
+def _params(rule, now, batch_size):
+    return {
+        "statuses": list(rule.statuses),
+        "cutoff": now - datetime.timedelta(days=rule.days),
+        "limit": batch_size,
+        "new_status": rule.new_status,
+        "audit_type": rule.audit_type,
+        "description": rule.description.format(days=rule.days),
+    }
+
+
+def _batches(conn, sql, params, batch_size):
+    """Run sql in its own transaction until a batch comes back short. Returns the rows changed."""
+    total = 0
+    while True:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';")
+            cur.execute(sql, params)
+            count = cur.fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        total += count
+        if count < batch_size:
+            return total
+
+
+def backfill_updated_at(conn, batch_size=BATCH_SIZE):
+    """Give escrows in a rule's statuses without updated_at their created_at, a batch at a time."""
+    statuses = sorted({s for rule in RULES for s in rule.statuses})
+    return _batches(conn, """
+        WITH filled AS (
+            UPDATE escrows e
+            SET updated_at = COALESCE(e.created_at, now() AT TIME ZONE 'utc')
+            WHERE e.id IN (
+                SELECT id FROM escrows
+                WHERE status = ANY(%(statuses)s) AND updated_at IS NULL
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING 1
+        )
+        SELECT count(*) FROM filled;
+    """, {"statuses": statuses, "limit": batch_size}, batch_size)
+
+
+def run(conn, batch_size=BATCH_SIZE, dry_run=False, now=None):
+    """Apply every enabled rule. Returns {rule name: escrows moved (or due, with dry_run)}."""
+    now = now or datetime.datetime.utcnow()
+    results = {}
+    if not dry_run:
+        filled = backfill_updated_at(conn, batch_size)
+        if filled:
+            logger.info("set updated_at on %s escrows", filled)
+    for rule in RULES:
+        if rule.days <= 0:
+            continue
+        params = _params(rule, now, batch_size)
+        if dry_run:
+            condition = _RELEASABLE if rule.new_status == "released" else _CANCELLABLE
+            cur = conn.cursor()
+            try:
+                cur.execute(_COUNT_SQL.format(condition=condition), params)
+                results[rule.name] = cur.fetchone()[0]
+            finally:
+                cur.close()
+            conn.rollback()
+            continue
+        sql = _RELEASE_SQL if rule.new_status == "released" else _CANCEL_SQL
+        results[rule.name] = _batches(conn, sql, params, batch_size)
+        if rule.new_status == "released":
+            _report_unheld(conn, rule, params)
+    return results
+
+
+def _report_unheld(conn, rule, params):
+    """Log escrows past a release deadline that have no held funds, which the rule never releases."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT e.id FROM escrows e
+            WHERE e.status = ANY(%(statuses)s) AND e.updated_at < %(cutoff)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM ledger_entries l
+                  WHERE l.escrow_id = e.id AND l.kind = %(hold)s AND l.amount > 0
+              )
+            ORDER BY e.id
+            LIMIT %(limit)s;
+        """, dict(params, hold=transactions.KIND_HOLD))
+        ids = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+    conn.rollback()
+    if ids:
+        logger.warning("%s: skipped escrows without held funds: %s", rule.name,
+                       ", ".join(str(i) for i in ids))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expire or auto-release escrows past their deadlines")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="count escrows due without changing them")
+    parser.add_argument("--loop", type=int, metavar="SECONDS",
+                        help="keep running, every SECONDS")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    while True:
+        conn = psycopg2.connect(database_url)
+        try:
+            for name, count in run(conn, args.batch_size, args.dry_run).items():
+                print(f"{name}: {count} escrows {'due' if args.dry_run else 'moved'}")
+        finally:
+            conn.close()
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import psycopg2
+
+# Recomputes every user's summary from escrows in one pass. Statuses with no
+# escrows are simply absent, matching what the triggers leave behind.
+COMPUTED_SUMMARY_SQL = """
+    SELECT user_id,
+           jsonb_object_agg(status, status_count) AS status_counts,
+           jsonb_object_agg(status, status_total) AS status_totals
+    FROM (
+        SELECT user_id, status, COUNT(*) AS status_count, SUM(COALESCE(amount, 0)) AS status_total
+        FROM (
+            SELECT buyer_id AS user_id, status, amount FROM escrows WHERE buyer_id IS NOT NULL
+            UNION ALL
+            SELECT seller_id AS user_id, status, amount FROM escrows WHERE seller_id IS NOT NULL
+        ) sides
+        WHERE status IS NOT NULL
+        GROUP BY user_id, status
+    ) per_status
+    GROUP BY user_id
+"""
+
+
+def summary_version(cur, user_id):
+    """
+    Version of a user's escrow list. The summary row is rewritten whenever one
+    of the user's escrows is created, deleted or changes status, so its
+    (updated_at, status_counts) pair changes whenever the list does.
+    """
+    cur.execute("""
+        SELECT updated_at, status_counts
+        FROM escrow_user_summary
+        WHERE user_id = %s
+    """, (user_id,))
+    return cur.fetchone()
+
+
+def rebuild(conn):
+    """
+    Replace escrow_user_summary with totals recomputed from escrows.
+    Escrow writes are blocked (reads are not) until the rebuild commits.
+    Returns the number of summary rows written.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("LOCK TABLE escrows IN SHARE MODE;")
+        cur.execute("DELETE FROM escrow_user_summary;")
+        cur.execute(f"""
+            INSERT INTO escrow_user_summary (user_id, status_counts, status_totals, updated_at)
+            SELECT user_id, status_counts, status_totals, now() AT TIME ZONE 'utc'
+            FROM ({COMPUTED_SUMMARY_SQL}) computed;
+        """)
+        written = cur.rowcount
+        conn.commit()
+        return written
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def check(conn):
+    """
+    Compare stored summaries against escrows without modifying anything.
+    Returns a list of (user_id, stored_counts, computed_counts) for drifted users.
+    """
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT COALESCE(s.user_id, c.user_id), s.status_counts, c.status_counts
+            FROM escrow_user_summary s
+            FULL OUTER JOIN ({COMPUTED_SUMMARY_SQL}) c ON c.user_id = s.user_id
+            WHERE COALESCE(s.status_counts, '{{}}') IS DISTINCT FROM COALESCE(c.status_counts, '{{}}')
+               OR COALESCE(s.status_totals, '{{}}') IS DISTINCT FROM COALESCE(c.status_totals, '{{}}')
+            ORDER BY 1;
+        """)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild or verify escrow_user_summary")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.command == "rebuild":
+            written = rebuild(conn)
+            print(f"Rebuilt {written} escrow summaries")
+            return 0
+
+        drifted = check(conn)
+        for user_id, stored, computed in drifted:
+            print(f"user {user_id}: stored={stored} computed={computed}")
+        print(f"{len(drifted)} summaries drifted")
+        return 1 if drifted else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
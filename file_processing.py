@@ -0,0 +1,383 @@
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import select
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from blob_store import get_blob_store
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is in requirements.txt; a dev setup may lack it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Post-upload processing for escrow_files (see
+# migrations/006_file_processing.sql). Uploads only store the blob and insert
+# the row; this worker picks pending rows up once the upload commits and runs
+# the CPU-bound work in a process pool:
+#
+#   - re-hash the stored blob and compare it with the recorded sha256
+#   - sniff the MIME type from the leading bytes
+#   - count PDF pages
+#   - render a JPEG thumbnail for KYC images (stored in the blob store)
+#
+# A file that kills its pool worker (a decoder crash, the OOM killer) breaks
+# the whole pool. The batch is rolled back, every file in it has its
+# processing_attempts bumped and the pool is replaced. Files that have
+# crashed a worker before are then retried one per batch, so only the
+# culprit keeps crashing, and it is marked 'failed' after MAX_ATTEMPTS.
+#
+#     python file_processing.py [--workers N] [--batch-size N] [--once]
+
+NOTIFY_CHANNEL = "file_processing"
+BATCH_SIZE = 16
+# Pending rows are also polled for, in case a notification was missed
+POLL_SECONDS = 60
+READ_SIZE = 1024 * 1024
+SNIFF_BYTES = 4096
+MAX_ATTEMPTS = 3
+
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+# Refuse to decode images larger than this (decompression bombs)
+THUMBNAIL_MAX_PIXELS = 50 * 1000 * 1000
+
+_SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+]
+THUMBNAIL_MIME_TYPES = ("image/png", "image/jpeg", "image/gif", "image/tiff", "image/webp")
+
+# Page objects, and the /Count of page tree nodes as a fallback for PDFs
+# whose objects sit in compressed object streams
+_PDF_PAGE = re.compile(rb"/Type\s{0,8}/Page(?![A-Za-z])")
+_PDF_COUNT = re.compile(rb"/Count\s{1,8}(\d{1,7})(?!\d)")
+_PDF_OVERLAP = 64
+
+
+def sniff_mime_type(head):
+    """MIME type from a file's leading bytes."""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1"):
+        return "image/heic"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is fine
+        if e.start < len(head) - 3:
+            return "application/octet-stream"
+    return "text/plain" if head else "application/octet-stream"
+
+
+class _PdfPageCounter:
+    """Counts page objects across chunk boundaries without buffering the file."""
+
+    def __init__(self):
+        self.tail = b""
+        self.pages = 0
+        self.max_count = 0
+
+    def _scan(self, data, final):
+        # Matches ending before the carried-over tail's end were counted with
+        # the previous chunk; matches touching the end of the data may still
+        # grow (/Page -> /Pages), so they wait for the next chunk
+        start = len(self.tail)
+        limit = len(data) if final else len(data) - 1
+        for m in _PDF_PAGE.finditer(data):
+            if start <= m.end() <= limit:
+                self.pages += 1
+        for m in _PDF_COUNT.finditer(data):
+            if start <= m.end() <= limit:
+                self.max_count = max(self.max_count, int(m.group(1)))
+
+    def feed(self, chunk):
+        data = self.tail + chunk
+        self._scan(data, final=False)
+        self.tail = data[-_PDF_OVERLAP:]
+
+    def close(self):
+        """Page count, or None if the file has no recognizable page objects."""
+        self._scan(self.tail, final=True)
+        return self.pages or self.max_count or None
+
+
+def _thumbnail(store, sha256):
+    """JPEG thumbnail of an image blob, stored in the blob store; returns its sha256."""
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_PIXELS
+    with store.open(sha256) as f:
+        image = Image.open(f)
+        # Let the JPEG decoder downscale while decoding
+        image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+
+    writer = store.open_writer()
+    writer.write(out.getvalue())
+    digest, _, _ = writer.commit()
+    return digest
+
+
+def process_file(file_id, sha256, purpose):
+    """
+    Process one stored file; runs in a pool worker. Returns a result dict
+    for record_results(). Never raises.
+    """
+    result = {"id": file_id, "status": "done", "error": None, "detected_mime_type": None,
+              "page_count": None, "thumbnail_sha256": None}
+    store = get_blob_store()
+    try:
+        if not sha256 or not store.exists(sha256):
+            result.update(status="failed", error="Stored content is missing")
+            return result
+
+        digest = hashlib.sha256()
+        head = b""
+        pdf = None
+        with store.open(sha256) as f:
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if pdf is None and head.startswith(b"%PDF-"):
+                        pdf = _PdfPageCounter()
+                if pdf is not None:
+                    pdf.feed(chunk)
+
+        if digest.hexdigest() != sha256:
+            result.update(status="corrupt", error="Stored content does not match its sha256")
+            return result
+
+        result["detected_mime_type"] = sniff_mime_type(head)
+        if pdf is not None:
+            result["page_count"] = pdf.close()
+        if purpose == "kyc" and Image is not None and result["detected_mime_type"] in THUMBNAIL_MIME_TYPES:
+            result["thumbnail_sha256"] = _thumbnail(store, sha256)
+    except Exception as e:
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    return result
+
+
+def _process(row):
+    return process_file(*row)
+
+
+def record_results(cur, results):
+    """Write results back to escrow_files in one statement."""
+    execute_values(cur, """
+        UPDATE escrow_files AS f
+        SET processing_status = v.status,
+            processing_error = v.error,
+            detected_mime_type = v.detected_mime_type,
+            page_count = v.page_count,
+            thumbnail_sha256 = v.thumbnail_sha256,
+            processed_at = (now() AT TIME ZONE 'utc')
+        FROM (VALUES %s) AS v (id, status, error, detected_mime_type, page_count, thumbnail_sha256)
+        WHERE f.id = v.id;
+    """, [(r["id"], r["status"], r["error"], r["detected_mime_type"], r["page_count"], r["thumbnail_sha256"])
+          for r in results],
+        template="(%s, %s, %s, %s, %s::integer, %s)")
+
+
+def _mark_processed_kyc(cur, kyc_ids):
+    """A KYC submission is processed once none of its files is pending."""
+    if not kyc_ids:
+        return
+    cur.execute("""
+        UPDATE kyc_submissions k
+        SET files_processed_at = (now() AT TIME ZONE 'utc')
+        WHERE k.id = ANY(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM escrow_files f
+              WHERE f.kyc_submission_id = k.id AND f.processing_status = 'pending'
+          );
+    """, (kyc_ids,))
+
+
+def _record_crash(conn, rows):
+    """Count a crashed attempt for each of rows; fail those out of attempts."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE escrow_files
+            SET processing_attempts = processing_attempts + 1,
+                processing_status = CASE WHEN processing_attempts + 1 >= %(max)s
+                                         THEN 'failed' ELSE processing_status END,
+                processing_error = CASE WHEN processing_attempts + 1 >= %(max)s
+                                        THEN 'Processing crashed the worker' ELSE processing_error END,
+                processed_at = CASE WHEN processing_attempts + 1 >= %(max)s
+                                    THEN (now() AT TIME ZONE 'utc') ELSE processed_at END
+            WHERE id = ANY(%(ids)s) AND processing_status = 'pending'
+            RETURNING id, processing_status;
+        """, {"ids": [r[0] for r in rows], "max": MAX_ATTEMPTS})
+        failed = [file_id for file_id, status in cur.fetchall() if status == "failed"]
+        _mark_processed_kyc(cur, sorted({r[3] for r in rows if r[3] is not None}))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    for file_id in failed:
+        logger.warning("file %s failed: crashed the worker %s times", file_id, MAX_ATTEMPTS)
+
+
+def run_batch(conn, pool, batch_size=BATCH_SIZE):
+    """
+    Claim up to batch_size pending files, process them in the pool and record
+    the results. The row locks are held until commit, so a batch whose
+    worker crashed is simply picked up again. Files that crashed a worker
+    before are claimed first and on their own. Returns the number processed;
+    raises BrokenProcessPool, after counting the attempt, if the pool broke.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, sha256, purpose, kyc_submission_id, processing_attempts
+            FROM escrow_files
+            WHERE processing_status = 'pending'
+            ORDER BY processing_attempts > 0 DESC, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED;
+        """, (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+        if rows[0][4] > 0:
+            rows = rows[:1]
+
+        try:
+            results = list(pool.map(_process, [(r[0], r[1], r[2]) for r in rows]))
+        except BrokenProcessPool:
+            conn.rollback()
+            _record_crash(conn, rows)
+            raise
+        record_results(cur, results)
+        _mark_processed_kyc(cur, sorted({r[3] for r in rows if r[3] is not None}))
+
+        conn.commit()
+        for r in results:
+            if r["status"] != "done":
+                logger.warning("file %s %s: %s", r["id"], r["status"], r["error"])
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def run_forever(database_url, workers, batch_size=BATCH_SIZE):
+    backoff = 1
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(database_url)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                conn.commit()
+                cur.close()
+                while True:
+                    while run_batch(conn, pool, batch_size) == batch_size:
+                        pass
+                    backoff = 1
+
+                    # Sleep until an upload commits or the poll interval elapses
+                    readable, _, _ = select.select([conn], [], [], POLL_SECONDS)
+                    if readable:
+                        conn.poll()
+                        conn.notifies.clear()
+            except BrokenProcessPool:
+                logger.warning("a pool worker died; starting a new pool")
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                backoff = 1
+            except Exception as e:
+                logger.warning("file processing failed: %s", e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            time.sleep(backoff)
+            backoff = min(backoff * 2, POLL_SECONDS)
+    finally:
+        pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process uploaded escrow/KYC files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes in the pool (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--once", action="store_true", help="drain pending files and exit")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+    if Image is None:
+        logger.warning("Pillow is not installed; KYC image thumbnails will not be made")
+
+    if not args.once:
+        run_forever(database_url, args.workers, args.batch_size)
+        return 0
+
+    processed = 0
+    conn = psycopg2.connect(database_url)
+    pool = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        while True:
+            try:
+                n = run_batch(conn, pool, args.batch_size)
+            except BrokenProcessPool:
+                logger.warning("a pool worker died; starting a new pool")
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=args.workers)
+                continue
+            processed += n
+            if n < args.batch_size:
+                break
+    finally:
+        pool.shutdown()
+        conn.close()
+    print(f"Processed {processed} files")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
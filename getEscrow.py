@@ -3,6 +3,7 @@ import os
 import psycopg2
 import datetime
 from decimal import Decimal
+from http_cache import version_etag, etag_matches, not_modified
 
 def handler(event, context):
     """
@@ -82,7 +83,8 @@ def handler(event, context):
         # Check if the user is allowed to view this escrow (either buyer or seller)
         cur.execute("""
             SELECT e.id, e.amount, e.payment_method, e.status, e.created_at,
-                   u_buyer.email as buyer_email, u_seller.email as seller_email
+                   u_buyer.email as buyer_email, u_seller.email as seller_email,
+                   COALESCE(e.updated_at, e.created_at) as version
             FROM escrows e
             JOIN users u_buyer ON e.buyer_id = u_buyer.id
             JOIN users u_seller ON e.seller_id = u_seller.id
@@ -98,6 +100,14 @@ def handler(event, context):
                 "body": json.dumps({"error": "Escrow not found or access denied"})
             }
 
+        # Every status change bumps updated_at, so it versions the payload;
+        # skip serialization if the client already has this version
+        etag = version_etag("getEscrow", escrow_result[0], escrow_result[3], escrow_result[7])
+        if etag_matches(event, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+
         # Convert Decimal to float for JSON serialization
         amount = escrow_result[1]
         if isinstance(amount, Decimal):
@@ -118,6 +128,7 @@ def handler(event, context):
 
         return {
             "statusCode": 200,
+            "headers": {"ETag": etag},
             "body": json.dumps(escrow_details)
         }
 
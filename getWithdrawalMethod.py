@@ -78,9 +78,7 @@ def handler(event, context):
         cur.execute("""
             SELECT method_code, details, active, updated_at
             FROM seller_withdrawal_methods
-            WHERE user_id = %s AND active = TRUE
-            ORDER BY updated_at DESC
-            LIMIT 1;
+            WHERE user_id = %s AND active = TRUE;
         """, (user["id"],))
 
         row = cur.fetchone()
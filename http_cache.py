@@ -0,0 +1,57 @@
+import hashlib
+
+# Helpers for conditional GETs. Functions that can name a cheap version for
+# their payload (an updated_at, a summary row) build an ETag from it and skip
+# the query/serialization work when the client already has that version; for
+# everything else app.py hashes the response body.
+
+
+def strong_etag(data):
+    """Strong ETag for a response body (str or bytes)."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def version_etag(*parts):
+    """
+    Strong ETag for a payload identified by version parts, e.g.
+    version_etag("getEscrow", escrow_id, updated_at). The first part should
+    name the function so two endpoints never share a tag.
+    """
+    return strong_etag("\x1f".join(repr(part) for part in parts))
+
+
+def etag_matches(event, etag):
+    """True if the request's If-None-Match already names this ETag."""
+    headers = event.get('headers') or {}
+    if_none_match = None
+    for name, value in headers.items():
+        if name.lower() == 'if-none-match':
+            if_none_match = value
+            break
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag, headers=None):
+    """304 response for a matching If-None-Match."""
+    response_headers = {"ETag": etag}
+    if headers:
+        response_headers.update(headers)
+    return {
+        "statusCode": 304,
+        "headers": response_headers,
+        "body": ""
+    }
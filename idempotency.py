@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import psycopg2
+
+# Idempotency-Key support for mutating handlers (see
+# migrations/012_idempotency_keys.sql). After authenticating, a handler
+# calls begin() inside its transaction; if the key was already used it gets
+# the stored response back and returns it without doing anything else.
+# Otherwise it does its work, calls finish() with its response and commits,
+# so the key and the response commit (or roll back) together with the work.
+# A retry that arrives while the first request is still running waits on
+# the key's row and then replays its response.
+#
+#     python idempotency.py sweep [--loop SECONDS]
+
+HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+SWEEP_BATCH_SIZE = 1000
+
+Claim = namedtuple("Claim", ["user_id", "key"])
+
+
+def request_key(event):
+    """The request's Idempotency-Key header, or None."""
+    for name, value in (event.get("headers") or {}).items():
+        if name.lower() == HEADER:
+            return value.strip() or None
+    return None
+
+
+def request_hash(event, fingerprint=None):
+    """
+    SHA-256 of what the request asks for: method, query string and body,
+    or fingerprint instead of the body for handlers that stream theirs.
+    """
+    h = hashlib.sha256()
+    h.update((event.get("httpMethod") or "").encode())
+    h.update(json.dumps(event.get("queryStringParameters") or {}, sort_keys=True).encode())
+    if fingerprint is not None:
+        h.update(json.dumps(fingerprint, sort_keys=True, default=str).encode())
+    else:
+        body = event.get("body") or ""
+        h.update(body if isinstance(body, bytes) else body.encode())
+    return h.hexdigest()
+
+
+def _error(status_code, message):
+    return {"statusCode": status_code, "body": json.dumps({"error": message})}
+
+
+def begin(cur, event, endpoint, user_id, fingerprint=None):
+    """
+    Claim the request's Idempotency-Key for user_id. Returns (claim, None)
+    when the handler should go ahead (claim is None if the request has no
+    key), or (None, response) with the response to return instead: the
+    stored one for a retry, or an error if the key was used for a different
+    request.
+    """
+    key = request_key(event)
+    if key is None:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        return None, _error(400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    digest = request_hash(event, fingerprint)
+    # A new or expired key is (re)claimed; a live one is left alone but
+    # locked, which waits for a request still running under it to finish
+    cur.execute("""
+        INSERT INTO idempotency_keys AS k (user_id, idempotency_key, endpoint, request_hash, expires_at)
+        VALUES (%s, %s, %s, %s, (now() AT TIME ZONE 'utc') + %s * interval '1 hour')
+        ON CONFLICT (user_id, idempotency_key) DO UPDATE
+        SET endpoint = EXCLUDED.endpoint,
+            request_hash = EXCLUDED.request_hash,
+            response = NULL,
+            created_at = EXCLUDED.created_at,
+            expires_at = EXCLUDED.expires_at
+        WHERE k.expires_at <= (now() AT TIME ZONE 'utc')
+        RETURNING 1;
+    """, (user_id, key, endpoint, digest, TTL_HOURS))
+    if cur.fetchone():
+        return Claim(user_id, key), None
+
+    cur.execute("""
+        SELECT endpoint, request_hash, response
+        FROM idempotency_keys
+        WHERE user_id = %s AND idempotency_key = %s;
+    """, (user_id, key))
+    stored_endpoint, stored_hash, response = cur.fetchone()
+    if stored_endpoint != endpoint or stored_hash != digest:
+        return None, _error(422, "Idempotency-Key was already used for a different request")
+    if response is None:
+        return None, _error(409, "A request with this Idempotency-Key is still in progress")
+
+    response = dict(response)
+    response["headers"] = dict(response.get("headers") or {}, **{REPLAYED_HEADER: "true"})
+    return None, response
+
+
+def finish(cur, claim, response):
+    """Store the handler's response under its claimed key; call before committing."""
+    if claim is None:
+        return
+    cur.execute("""
+        UPDATE idempotency_keys
+        SET response = %s::jsonb
+        WHERE user_id = %s AND idempotency_key = %s;
+    """, (json.dumps(response), claim.user_id, claim.key))
+
+
+def sweep(conn, batch_size=SWEEP_BATCH_SIZE):
+    """Delete expired keys in batches through the expires_at index. Returns the number deleted."""
+    deleted = 0
+    cur = conn.cursor()
+    try:
+        while True:
+            cur.execute("""
+                DELETE FROM idempotency_keys
+                WHERE ctid IN (
+                    SELECT ctid FROM idempotency_keys
+                    WHERE expires_at <= (now() AT TIME ZONE 'utc')
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                );
+            """, (batch_size,))
+            count = cur.rowcount
+            conn.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Idempotency key maintenance")
+    parser.add_argument("command", choices=["sweep"])
+    parser.add_argument("--loop", type=int, metavar="SECONDS",
+                        help="keep running, sweeping every SECONDS")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    while True:
+        conn = psycopg2.connect(database_url)
+        try:
+            print(f"Deleted {sweep(conn)} expired idempotency keys")
+        finally:
+            conn.close()
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
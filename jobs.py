@@ -0,0 +1,335 @@
+import argparse
+import importlib
+import logging
+import os
+import random
+import select
+import socket
+import sys
+import time
+from collections import namedtuple
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs on Postgres (see migrations/017_jobs.sql), for
+# work that should not run inside a request: no broker, just the jobs table.
+#
+#     python jobs.py work [--kind KIND] [--import MODULE] [--batch-size N] [--once]
+#     python jobs.py stats
+#     python jobs.py retry-dead [--kind KIND]
+#
+# Enqueue in the handler's transaction, before its commit:
+#
+#     jobs.enqueue(cur, "kind", {"escrow_id": escrow_id}, priority=10)
+#
+# and register the function that runs it in a module the worker imports
+# (--import, or JOB_MODULES=mod1,mod2):
+#
+#     @jobs.handler("kind")
+#     def run_kind(cur, payload):
+#         ...
+#
+# A worker claims a batch of jobs (committed, under a lease) and then runs
+# them in one transaction, each inside a savepoint: a handler's database
+# writes commit together with its job's removal, and a failing handler only
+# rolls back its own job, which is retried with exponential backoff and
+# ends up 'dead' after max_attempts. Delivery is at least once: a job whose
+# lease expires mid-run (worker killed, or slower than JOBS_LEASE_SECONDS)
+# runs again, so handlers must be idempotent.
+
+NOTIFY_CHANNEL = "jobs"
+BATCH_SIZE = 20
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", "300"))
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+# Retries and delayed jobs are not notified; idle workers poll this often
+POLL_SECONDS = 10
+ERROR_MAX_LENGTH = 2000
+
+Job = namedtuple("Job", ["id", "kind", "payload", "attempts", "max_attempts"])
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Decorator registering func(cur, payload) as the handler for kind."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(cur, kind, payload=None, priority=0, delay=0, max_attempts=MAX_ATTEMPTS):
+    """
+    Queue a job in the caller's transaction; it becomes visible to workers
+    when that commits. Higher priority runs first; delay is in seconds.
+    Returns the job id.
+    """
+    cur.execute("""
+        INSERT INTO jobs (kind, payload, priority, run_at, max_attempts)
+        VALUES (%s, %s, %s, (now() AT TIME ZONE 'utc') + make_interval(secs => %s), %s)
+        RETURNING id;
+    """, (kind, Json(payload or {}), priority, delay, max_attempts))
+    return cur.fetchone()[0]
+
+
+def enqueue_many(cur, kind, payloads, priority=0, max_attempts=MAX_ATTEMPTS):
+    """Queue one job per payload in a single statement. Returns the job ids."""
+    rows = execute_values(cur, """
+        INSERT INTO jobs (kind, payload, priority, max_attempts)
+        VALUES %s
+        RETURNING id;
+    """, [(kind, Json(p or {}), priority, max_attempts) for p in payloads], fetch=True)
+    return [r[0] for r in rows]
+
+
+def backoff(attempts):
+    """Seconds before retry number attempts (1-based), with jitter."""
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(conn, worker, batch_size=BATCH_SIZE, kinds=None):
+    """Lease up to batch_size due jobs to worker and commit. Returns [Job]."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            WITH next AS (
+                SELECT id FROM jobs
+                WHERE status = 'queued'
+                  AND run_at <= (now() AT TIME ZONE 'utc')
+                  AND (%(kinds)s::text[] IS NULL OR kind = ANY(%(kinds)s))
+                ORDER BY priority DESC, run_at, id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE jobs j
+            SET status = 'running',
+                attempts = j.attempts + 1,
+                locked_by = %(worker)s,
+                locked_until = (now() AT TIME ZONE 'utc') + make_interval(secs => %(lease)s)
+            FROM next
+            WHERE j.id = next.id
+            RETURNING j.id, j.kind, j.payload, j.attempts, j.max_attempts, j.priority;
+        """, {"kinds": kinds or None, "limit": batch_size, "worker": worker, "lease": LEASE_SECONDS})
+        rows = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    # RETURNING order is not the claim order
+    rows.sort(key=lambda r: (-r[5], r[0]))
+    return [Job(*r[:5]) for r in rows]
+
+
+def run_batch(conn, worker, batch_size=BATCH_SIZE, kinds=None):
+    """Claim and run one batch of jobs. Returns the number claimed."""
+    claimed = claim(conn, worker, batch_size, kinds)
+    if not claimed:
+        return 0
+
+    done = []
+    failed = []
+    cur = conn.cursor()
+    try:
+        for job in claimed:
+            cur.execute("SAVEPOINT job;")
+            try:
+                func = HANDLERS.get(job.kind)
+                if func is None:
+                    raise LookupError(f"No handler registered for job kind {job.kind}")
+                func(cur, job.payload)
+                cur.execute("RELEASE SAVEPOINT job;")
+                done.append(job.id)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT job;")
+                dead = job.attempts >= job.max_attempts
+                failed.append((job.id, dead, 0 if dead else backoff(job.attempts),
+                               f"{type(e).__name__}: {e}"[:ERROR_MAX_LENGTH], worker))
+                logger.warning("job %s (%s) attempt %s/%s failed%s: %s", job.id, job.kind, job.attempts,
+                               job.max_attempts, ", giving up" if dead else "", e)
+
+        # Only jobs still leased to this worker; an expired lease may have
+        # been handed to someone else
+        if done:
+            cur.execute("DELETE FROM jobs WHERE id = ANY(%s) AND locked_by = %s;", (done, worker))
+        if failed:
+            execute_values(cur, """
+                UPDATE jobs j
+                SET status = CASE WHEN v.dead THEN 'dead' ELSE 'queued' END,
+                    run_at = (now() AT TIME ZONE 'utc') + make_interval(secs => v.delay),
+                    last_error = v.error,
+                    locked_by = NULL,
+                    locked_until = NULL
+                FROM (VALUES %s) AS v (id, dead, delay, error, worker)
+                WHERE j.id = v.id AND j.locked_by = v.worker;
+            """, failed, template="(%s::bigint, %s::boolean, %s::double precision, %s, %s)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(claimed)
+
+
+def requeue_expired(conn):
+    """Put jobs whose lease ran out back in the queue (or to 'dead'). Returns the number moved."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END,
+                run_at = (now() AT TIME ZONE 'utc'),
+                last_error = 'lease expired on ' || COALESCE(locked_by, '?'),
+                locked_by = NULL,
+                locked_until = NULL
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE status = 'running' AND locked_until < (now() AT TIME ZONE 'utc')
+                FOR UPDATE SKIP LOCKED
+            );
+        """)
+        count = cur.rowcount
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def retry_dead(conn, kinds=None):
+    """Queue dead jobs (of the given kinds) again with fresh attempts. Returns the number requeued."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'queued', attempts = 0, run_at = (now() AT TIME ZONE 'utc')
+            WHERE status = 'dead' AND (%(kinds)s::text[] IS NULL OR kind = ANY(%(kinds)s));
+        """, {"kinds": kinds or None})
+        count = cur.rowcount
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def stats(conn):
+    """[(kind, status, count, oldest run_at)] over the whole table."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT kind, status, count(*), min(run_at)
+            FROM jobs
+            GROUP BY kind, status
+            ORDER BY kind, status;
+        """)
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def import_handlers(modules):
+    for module in modules:
+        importlib.import_module(module)
+
+
+def run_forever(database_url, batch_size=BATCH_SIZE, kinds=None):
+    worker = worker_id()
+    backoff_seconds = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(database_url)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+            conn.commit()
+            cur.close()
+            while True:
+                requeued = requeue_expired(conn)
+                if requeued:
+                    logger.info("requeued %s jobs with expired leases", requeued)
+                while run_batch(conn, worker, batch_size, kinds) == batch_size:
+                    pass
+                backoff_seconds = 1
+
+                # Sleep until a job is enqueued or the poll interval elapses
+                readable, _, _ = select.select([conn], [], [], POLL_SECONDS)
+                if readable:
+                    conn.poll()
+                    conn.notifies.clear()
+        except Exception as e:
+            logger.warning("job worker failed: %s", e)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        time.sleep(backoff_seconds)
+        backoff_seconds = min(backoff_seconds * 2, POLL_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background job queue")
+    parser.add_argument("command", choices=["work", "stats", "retry-dead"])
+    parser.add_argument("--kind", action="append", help="only this job kind (repeatable)")
+    parser.add_argument("--import", dest="modules", action="append", default=[], metavar="MODULE",
+                        help="module registering job handlers (repeatable; also JOB_MODULES)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--once", action="store_true", help="drain due jobs and exit")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    if args.command == "work":
+        import_handlers(args.modules + [m for m in os.getenv("JOB_MODULES", "").split(",") if m])
+        if not args.once:
+            run_forever(database_url, args.batch_size, args.kind)
+            return 0
+
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.command == "stats":
+            for kind, status, count, oldest in stats(conn):
+                print(f"{kind}\t{status}\t{count}\t{oldest.isoformat() if oldest else ''}")
+        elif args.command == "retry-dead":
+            print(f"Requeued {retry_dead(conn, args.kind)} dead jobs")
+        else:
+            worker = worker_id()
+            requeue_expired(conn)
+            processed = 0
+            while True:
+                n = run_batch(conn, worker, args.batch_size, args.kind)
+                processed += n
+                if n < args.batch_size:
+                    break
+            print(f"Ran {processed} jobs")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
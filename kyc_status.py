@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# "Is this seller verified?" for hot paths (escrow creation, payouts) and
+# the latest submission for sellerKYCStatus.
+# users.kyc_status mirrors the status of the user's latest KYC submission
+# (see migrations/008_users_kyc_status.sql), so a miss is one primary-key
+# lookup; answers are then cached per worker for KYC_STATUS_TTL seconds.
+# Reviews in this process invalidate the entry at once; other workers pick
+# the change up when the entry expires.
+
+CACHE_TTL_SECONDS = int(os.getenv("KYC_STATUS_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("KYC_STATUS_CACHE_SIZE", "10000"))
+VERIFIED_STATUS = "approved"
+
+metrics.describe("kyc_status_cache_hits_total", "KYC status lookups served from the cache")
+metrics.describe("kyc_status_cache_misses_total", "KYC status lookups that read users")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Bumped by every invalidation, so a lookup that raced with one doesn't
+# cache what it read
+_generation = 0
+
+
+def get_kyc_status(cur, user_id):
+    """(kyc_status, latest_kyc_id) for a user; (None, None) if they never submitted."""
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is not None and entry[0] > now:
+            _cache.move_to_end(user_id)
+            metrics.inc("kyc_status_cache_hits_total")
+            return entry[1]
+        generation = _generation
+
+    metrics.inc("kyc_status_cache_misses_total")
+    cur.execute("SELECT kyc_status, latest_kyc_id FROM users WHERE id = %s;", (user_id,))
+    row = cur.fetchone()
+    status = (row[0], row[1]) if row else (None, None)
+
+    with _cache_lock:
+        if generation == _generation:
+            _cache[user_id] = (now + CACHE_TTL_SECONDS, status)
+            _cache.move_to_end(user_id)
+            while len(_cache) > CACHE_MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return status
+
+
+def is_verified(cur, user_id):
+    """True if the user's latest KYC submission was approved."""
+    return get_kyc_status(cur, user_id)[0] == VERIFIED_STATUS
+
+
+def invalidate(*user_ids):
+    """Drop cached entries, e.g. after reviewing a user's submission."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        for user_id in user_ids:
+            _cache.pop(user_id, None)
@@ -2,7 +2,9 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
 from decimal import Decimal
+import transactions
 
 def handler(event, context):
     """
@@ -85,9 +87,16 @@ def handler(event, context):
 
     # Mark escrow as paid
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "markPaid", user_id)
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Check if the user is allowed to mark this escrow as paid (must be the buyer)
         cur.execute("""
-            SELECT id, status 
+            SELECT id, status, amount
             FROM escrows 
             WHERE id = %s AND buyer_id = %s
         """, (escrow_id, user_id))
@@ -118,12 +127,14 @@ def handler(event, context):
             SET status = 'paid', updated_at = %s
             WHERE id = %s
         """, (datetime.datetime.utcnow(), escrow_id))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
 
-        return {
+        # Hold the buyer's funds in the escrow's ledger account (once; the
+        # escrow row is locked by the update above)
+        amount = escrow_result[2]
+        if amount and amount > 0 and not transactions.has_hold(cur, escrow_id):
+            transactions.hold(cur, escrow_id, amount)
+        
+        response = {
             "statusCode": 200,
             "body": json.dumps({
                 "success": True,
@@ -133,6 +144,12 @@ def handler(event, context):
                 "new_status": "paid"
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         conn.rollback()
@@ -3,6 +3,7 @@ import os
 import psycopg2
 import datetime
 from decimal import Decimal
+import transactions
 
 def handler(event, context):
     """
@@ -42,7 +43,7 @@ def handler(event, context):
     # Validate token and get user info
     try:
         cur.execute("""
-            SELECT u.id, u.email, u.name, u.role, u.balance
+            SELECT u.id, u.email, u.name, u.role
             FROM sessions s 
             JOIN users u ON s.user_id = u.id 
             WHERE s.session_token = %s AND s.expires_at > %s
@@ -57,7 +58,8 @@ def handler(event, context):
                 "body": json.dumps({"error": "Invalid or expired token"})
             }
         
-        user_id, email, name, role, balance = user_result
+        user_id, email, name, role = user_result
+        balance = transactions.balance(cur, transactions.user_account(user_id))
         
         # Convert Decimal to float for JSON serialization
         if isinstance(balance, Decimal):
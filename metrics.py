@@ -0,0 +1,67 @@
+import threading
+
+# Minimal in-process metrics, rendered in Prometheus text format by app.py at
+# /metrics. Values are per worker process.
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_help = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def describe(name, text):
+    """Set the # HELP line for a metric."""
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def get(name, **labels):
+    """Current value of a counter or gauge (0 if never set)."""
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for label, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    with _lock:
+        series = [(key, value, "counter") for key, value in _counters.items()]
+        series += [(key, value, "gauge") for key, value in _gauges.items()]
+
+    lines = []
+    seen = set()
+    for (name, labels), value, kind in sorted(series, key=lambda s: s[0]):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
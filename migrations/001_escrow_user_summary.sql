@@ -0,0 +1,76 @@
+-- Per-user escrow counts and totals by status.
+--
+-- One row per user (buyer or seller). The rows are maintained by triggers on
+-- escrows, so every status change made by a handler or batch job updates the
+-- summary in the same transaction. Statuses whose count drops to zero are
+-- removed from both maps so a maintained row is identical to a rebuilt one.
+--
+-- Backfill / drift check after applying:
+--     python escrow_summary.py rebuild
+--     python escrow_summary.py check
+
+CREATE TABLE IF NOT EXISTS escrow_user_summary (
+    user_id       INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    status_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status_totals JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at    TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE OR REPLACE FUNCTION escrow_user_summary_apply(
+    p_user_id INTEGER, p_status TEXT, p_count INTEGER, p_amount NUMERIC
+) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_status IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO escrow_user_summary AS s (user_id, status_counts, status_totals, updated_at)
+    VALUES (p_user_id,
+            jsonb_build_object(p_status, p_count),
+            jsonb_build_object(p_status, p_amount),
+            now() AT TIME ZONE 'utc')
+    ON CONFLICT (user_id) DO UPDATE
+    SET status_counts = s.status_counts || jsonb_build_object(
+            p_status, COALESCE((s.status_counts->>p_status)::bigint, 0) + p_count),
+        status_totals = s.status_totals || jsonb_build_object(
+            p_status, COALESCE((s.status_totals->>p_status)::numeric, 0) + p_amount),
+        updated_at = now() AT TIME ZONE 'utc';
+
+    IF p_count < 0 THEN
+        UPDATE escrow_user_summary
+        SET status_counts = status_counts - p_status,
+            status_totals = status_totals - p_status
+        WHERE user_id = p_user_id
+          AND (status_counts->>p_status)::bigint = 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION escrows_maintain_user_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM escrow_user_summary_apply(OLD.buyer_id, OLD.status, -1, -COALESCE(OLD.amount, 0));
+        PERFORM escrow_user_summary_apply(OLD.seller_id, OLD.status, -1, -COALESCE(OLD.amount, 0));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM escrow_user_summary_apply(NEW.buyer_id, NEW.status, 1, COALESCE(NEW.amount, 0));
+        PERFORM escrow_user_summary_apply(NEW.seller_id, NEW.status, 1, COALESCE(NEW.amount, 0));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS escrows_user_summary_ins_del ON escrows;
+CREATE TRIGGER escrows_user_summary_ins_del
+AFTER INSERT OR DELETE ON escrows
+FOR EACH ROW EXECUTE FUNCTION escrows_maintain_user_summary();
+
+DROP TRIGGER IF EXISTS escrows_user_summary_upd ON escrows;
+CREATE TRIGGER escrows_user_summary_upd
+AFTER UPDATE OF status, amount, buyer_id, seller_id ON escrows
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status
+      OR OLD.amount IS DISTINCT FROM NEW.amount
+      OR OLD.buyer_id IS DISTINCT FROM NEW.buyer_id
+      OR OLD.seller_id IS DISTINCT FROM NEW.seller_id)
+EXECUTE FUNCTION escrows_maintain_user_summary();
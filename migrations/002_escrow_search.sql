@@ -0,0 +1,23 @@
+-- Full-text and counterparty search over escrows (searchEscrows).
+--
+-- search_vector covers the free-text fields users remember an escrow by:
+-- delivery terms and deliverables from sellerSubmitDelivery and the reason
+-- given in sellerReject. Counterparty emails live on users and are matched
+-- with trigram indexes instead.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE escrows
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english'::regconfig, COALESCE(seller_terms, '')), 'A') ||
+        setweight(to_tsvector('english'::regconfig, COALESCE(seller_deliverables, '')), 'B') ||
+        setweight(to_tsvector('english'::regconfig, COALESCE(seller_reject_reason, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS escrows_search_vector_idx ON escrows USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS users_email_trgm_idx ON users USING gin (email gin_trgm_ops);
+
+-- Every search is scoped to one side of the caller's escrows
+CREATE INDEX IF NOT EXISTS escrows_buyer_id_idx ON escrows (buyer_id);
+CREATE INDEX IF NOT EXISTS escrows_seller_id_idx ON escrows (seller_id);
@@ -0,0 +1,22 @@
+-- Change notifications for the paymentMethods cache.
+--
+-- paymentMethods serves the list from an in-process cache and LISTENs on
+-- payment_methods_changed so admin edits show up without waiting for the TTL.
+
+CREATE TABLE IF NOT EXISTS payment_methods (
+    method_name TEXT PRIMARY KEY,
+    description TEXT NOT NULL,
+    is_active   BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE OR REPLACE FUNCTION payment_methods_notify_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('payment_methods_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS payment_methods_changed ON payment_methods;
+CREATE TRIGGER payment_methods_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payment_methods
+FOR EACH STATEMENT EXECUTE FUNCTION payment_methods_notify_change();
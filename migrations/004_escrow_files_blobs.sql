@@ -0,0 +1,11 @@
+-- Content-addressed attachment storage (blob_store.py).
+--
+-- Attachments are stored once per SHA-256 in the blob store; escrow_files
+-- rows reference the blob by hash. The sha256 index serves blob_store.gc()
+-- reference checks and dedup lookups.
+
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS sha256 CHAR(64);
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS mime_type TEXT;
+
+CREATE INDEX IF NOT EXISTS escrow_files_sha256_idx ON escrow_files (sha256);
@@ -0,0 +1,38 @@
+-- Resumable chunked uploads (sellerUploadSession / sellerUploadChunk /
+-- sellerUploadFinalize).
+--
+-- Each received chunk is stored as its own blob and recorded here, so a
+-- client that lost its connection asks for the session status and resends
+-- only the missing offsets. Finalize concatenates the chunks into one blob,
+-- verifies the declared SHA-256 and links it in escrow_files. Chunk rows
+-- count as blob references for blob_store.gc(); expired sessions are
+-- deleted by the same sweep.
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id             TEXT PRIMARY KEY,
+    user_id        INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    escrow_id      INTEGER NOT NULL REFERENCES escrows(id) ON DELETE CASCADE,
+    file_name      TEXT NOT NULL,
+    mime_type      TEXT,
+    total_size     BIGINT NOT NULL,
+    chunk_size     INTEGER NOT NULL,
+    sha256         CHAR(64) NOT NULL,
+    status         TEXT NOT NULL DEFAULT 'open',
+    escrow_file_id INTEGER,
+    created_at     TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expires_at     TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS upload_sessions_open_expires_idx
+    ON upload_sessions (expires_at) WHERE status = 'open';
+
+CREATE TABLE IF NOT EXISTS upload_session_chunks (
+    session_id   TEXT NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+    chunk_offset BIGINT NOT NULL,
+    size         INTEGER NOT NULL,
+    sha256       CHAR(64) NOT NULL,
+    received_at  TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (session_id, chunk_offset)
+);
+
+CREATE INDEX IF NOT EXISTS upload_session_chunks_sha256_idx ON upload_session_chunks (sha256);
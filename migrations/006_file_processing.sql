@@ -0,0 +1,43 @@
+-- Post-upload processing (file_processing.py).
+--
+-- New escrow_files rows start as processing_status 'pending'; the worker
+-- claims them with FOR UPDATE SKIP LOCKED, verifies the stored checksum,
+-- sniffs the MIME type, counts PDF pages and renders KYC image thumbnails,
+-- then records the results here. Rows that existed before this migration
+-- keep a NULL status and are not processed. The statement trigger wakes
+-- the worker once the upload transaction commits.
+--
+-- processing_attempts counts batches that crashed a pool worker while the
+-- file was in them; the worker marks a file 'failed' once it reaches its
+-- limit, so a file that always crashes is not retried forever.
+
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS kyc_submission_id INTEGER REFERENCES kyc_submissions(id);
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS processing_status TEXT;
+ALTER TABLE escrow_files ALTER COLUMN processing_status SET DEFAULT 'pending';
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS processing_error TEXT;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS processing_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS detected_mime_type TEXT;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS page_count INTEGER;
+ALTER TABLE escrow_files ADD COLUMN IF NOT EXISTS thumbnail_sha256 CHAR(64);
+
+ALTER TABLE kyc_submissions ADD COLUMN IF NOT EXISTS files_processed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS escrow_files_processing_pending_idx
+    ON escrow_files (id) WHERE processing_status = 'pending';
+CREATE INDEX IF NOT EXISTS escrow_files_kyc_submission_idx
+    ON escrow_files (kyc_submission_id) WHERE kyc_submission_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS escrow_files_thumbnail_sha256_idx
+    ON escrow_files (thumbnail_sha256) WHERE thumbnail_sha256 IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION escrow_files_notify_pending() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('file_processing', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS escrow_files_pending ON escrow_files;
+CREATE TRIGGER escrow_files_pending
+AFTER INSERT ON escrow_files
+FOR EACH STATEMENT EXECUTE FUNCTION escrow_files_notify_pending();
@@ -0,0 +1,14 @@
+-- KYC review queue (adminKYCQueue.py).
+--
+-- Reviewers claim pending submissions for a lease; claimed_by and
+-- claim_expires_at record the claim and an expired lease makes the row
+-- claimable again. The partial index keeps claims and queue statistics to
+-- the pending rows in submission order however large the reviewed history
+-- grows.
+
+ALTER TABLE kyc_submissions ADD COLUMN IF NOT EXISTS claimed_by INTEGER REFERENCES users(id);
+ALTER TABLE kyc_submissions ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP;
+ALTER TABLE kyc_submissions ADD COLUMN IF NOT EXISTS reviewed_by INTEGER REFERENCES users(id);
+
+CREATE INDEX IF NOT EXISTS kyc_submissions_pending_idx
+    ON kyc_submissions (submitted_at, id) WHERE status = 'pending';
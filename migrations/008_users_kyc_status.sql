@@ -0,0 +1,48 @@
+-- Latest KYC submission per user, denormalized onto users.
+--
+-- users.latest_kyc_id points at the user's most recent kyc_submissions row
+-- and users.kyc_status mirrors its status, so sellerKYCStatus and
+-- "is this seller verified?" checks (kyc_status.py) are primary-key
+-- lookups. Triggers keep both columns current: a new submission becomes the
+-- latest one, and a review updates kyc_status if it reviewed the latest.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS latest_kyc_id INTEGER REFERENCES kyc_submissions(id);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS kyc_status TEXT;
+
+CREATE OR REPLACE FUNCTION kyc_submissions_maintain_user_status() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users
+        SET latest_kyc_id = NEW.id, kyc_status = NEW.status
+        WHERE id = NEW.user_id;
+    ELSE
+        UPDATE users
+        SET kyc_status = NEW.status
+        WHERE id = NEW.user_id AND latest_kyc_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS kyc_submissions_user_status_ins ON kyc_submissions;
+CREATE TRIGGER kyc_submissions_user_status_ins
+AFTER INSERT ON kyc_submissions
+FOR EACH ROW EXECUTE FUNCTION kyc_submissions_maintain_user_status();
+
+DROP TRIGGER IF EXISTS kyc_submissions_user_status_upd ON kyc_submissions;
+CREATE TRIGGER kyc_submissions_user_status_upd
+AFTER UPDATE OF status ON kyc_submissions
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION kyc_submissions_maintain_user_status();
+
+-- Backfill from existing submissions
+UPDATE users u
+SET latest_kyc_id = k.id, kyc_status = k.status
+FROM (
+    SELECT DISTINCT ON (user_id) user_id, id, status
+    FROM kyc_submissions
+    ORDER BY user_id, submitted_at DESC, id DESC
+) k
+WHERE u.id = k.user_id
+  AND u.latest_kyc_id IS DISTINCT FROM k.id;
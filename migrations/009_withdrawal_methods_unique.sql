@@ -0,0 +1,19 @@
+-- One withdrawal method row per seller.
+--
+-- setWithdrawalMethod upserts with INSERT ... ON CONFLICT (user_id), which
+-- needs this unique index; getWithdrawalMethod reads through it. Duplicate
+-- rows created by the old select-then-insert race are removed first,
+-- keeping each seller's most recently updated row.
+
+DELETE FROM seller_withdrawal_methods w
+USING (
+    SELECT id, row_number() OVER (
+        PARTITION BY user_id
+        ORDER BY COALESCE(updated_at, created_at) DESC NULLS LAST, id DESC
+    ) AS rn
+    FROM seller_withdrawal_methods
+) ranked
+WHERE w.id = ranked.id AND ranked.rn > 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS seller_withdrawal_methods_user_id_key
+    ON seller_withdrawal_methods (user_id);
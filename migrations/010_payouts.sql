@@ -0,0 +1,38 @@
+-- Seller payouts (payouts.py).
+--
+-- A payout run moves each eligible seller's balance into a payouts row, one
+-- payout_batches row per method_code and batch. Batches start as 'created'
+-- and become 'exported' once their payout file has been written for the
+-- processor. Payout details are a snapshot of the withdrawal method at the
+-- time of the run.
+
+CREATE TABLE IF NOT EXISTS payout_batches (
+    id           SERIAL PRIMARY KEY,
+    method_code  TEXT NOT NULL,
+    rail         TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'created',
+    item_count   INTEGER NOT NULL DEFAULT 0,
+    total_amount NUMERIC NOT NULL DEFAULT 0,
+    file_path    TEXT,
+    created_at   TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    exported_at  TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payouts (
+    id          BIGSERIAL PRIMARY KEY,
+    batch_id    INTEGER NOT NULL REFERENCES payout_batches(id),
+    user_id     INTEGER NOT NULL REFERENCES users(id),
+    method_code TEXT NOT NULL,
+    amount      NUMERIC NOT NULL CHECK (amount > 0),
+    details     JSONB NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    created_at  TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS payouts_batch_id_idx ON payouts (batch_id, id);
+CREATE INDEX IF NOT EXISTS payouts_user_id_idx ON payouts (user_id);
+CREATE INDEX IF NOT EXISTS payout_batches_created_idx
+    ON payout_batches (id) WHERE status = 'created';
+
+-- Sellers with something to pay out, in id order for keyset batching
+CREATE INDEX IF NOT EXISTS users_positive_balance_idx ON users (id) WHERE balance > 0;
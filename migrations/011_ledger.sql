@@ -0,0 +1,95 @@
+-- Append-only double-entry ledger (transactions.py).
+--
+-- Every posting is two or more ledger_entries rows sharing a posting_id and
+-- summing to zero. Accounts are text keys: user:<id> (a seller's payable
+-- balance), escrow:<id> (funds held for an escrow) and external:* (money
+-- entering or leaving the platform). A positive amount adds to the account.
+--
+-- Entries are never updated or deleted. Balances are a snapshot plus the
+-- entries written since: tx_id records the writing transaction, and a
+-- snapshot covers exactly the entries whose transaction is older than its
+-- horizon (the oldest transaction still running when it was taken), so
+-- entries committed late are never missed.
+--
+-- users.balance is no longer written; existing balances are carried over
+-- as opening entries, and escrows currently 'paid' get their hold entry.
+--
+--     python transactions.py snapshot [--loop SECONDS]
+--     python transactions.py check
+
+CREATE SEQUENCE IF NOT EXISTS ledger_posting_seq;
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    id         BIGSERIAL PRIMARY KEY,
+    posting_id BIGINT NOT NULL,
+    account    TEXT NOT NULL,
+    amount     NUMERIC NOT NULL,
+    kind       TEXT NOT NULL,
+    escrow_id  INTEGER,
+    payout_id  BIGINT,
+    tx_id      xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS ledger_entries_account_tx_idx ON ledger_entries (account, tx_id);
+CREATE INDEX IF NOT EXISTS ledger_entries_tx_idx ON ledger_entries (tx_id);
+CREATE INDEX IF NOT EXISTS ledger_entries_posting_idx ON ledger_entries (posting_id);
+-- An escrow is held and released at most once
+CREATE UNIQUE INDEX IF NOT EXISTS ledger_entries_escrow_kind_key
+    ON ledger_entries (escrow_id, kind) WHERE escrow_id IS NOT NULL AND amount > 0;
+
+CREATE OR REPLACE FUNCTION ledger_entries_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'ledger_entries is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ledger_entries_append_only ON ledger_entries;
+CREATE TRIGGER ledger_entries_append_only
+BEFORE UPDATE OR DELETE OR TRUNCATE ON ledger_entries
+FOR EACH STATEMENT EXECUTE FUNCTION ledger_entries_append_only();
+
+CREATE TABLE IF NOT EXISTS ledger_snapshots (
+    account  TEXT PRIMARY KEY,
+    balance  NUMERIC NOT NULL,
+    horizon  xid8 NOT NULL,
+    taken_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Horizon of the last snapshot run; every account's snapshot covers all
+-- entries below it
+CREATE TABLE IF NOT EXISTS ledger_snapshot_state (
+    id       INTEGER PRIMARY KEY CHECK (id = 1),
+    horizon  xid8 NOT NULL,
+    taken_at TIMESTAMP
+);
+INSERT INTO ledger_snapshot_state (id, horizon) VALUES (1, '0') ON CONFLICT (id) DO NOTHING;
+
+-- Opening balances, once
+INSERT INTO ledger_entries (posting_id, account, amount, kind)
+SELECT p.posting_id, leg.account, leg.amount, 'opening'
+FROM (
+    SELECT id, balance, nextval('ledger_posting_seq') AS posting_id
+    FROM users
+    WHERE balance <> 0
+      AND NOT EXISTS (SELECT 1 FROM ledger_entries WHERE kind = 'opening')
+) p
+CROSS JOIN LATERAL (VALUES ('user:' || p.id, p.balance), ('external:opening', -p.balance)) AS leg (account, amount);
+
+-- Funds currently held in escrow: every escrow that was funded and has not
+-- been released yet, whichever step it has moved on to since
+INSERT INTO ledger_entries (posting_id, account, amount, kind, escrow_id)
+SELECT p.posting_id, leg.account, leg.amount, 'hold', p.id
+FROM (
+    SELECT e.id, e.amount, nextval('ledger_posting_seq') AS posting_id
+    FROM escrows e
+    WHERE e.status IN ('paid', 'funds_in_escrow', 'delivered', 'release_requested')
+      AND e.amount > 0
+      AND NOT EXISTS (SELECT 1 FROM ledger_entries l WHERE l.escrow_id = e.id AND l.kind = 'hold')
+) p
+CROSS JOIN LATERAL (VALUES ('escrow:' || p.id, p.amount), ('external:deposits', -p.amount)) AS leg (account, amount);
+
+-- Payout runs now read ledger balances (payouts.py)
+DROP INDEX IF EXISTS users_positive_balance_idx;
+CREATE INDEX IF NOT EXISTS seller_withdrawal_methods_active_method_idx
+    ON seller_withdrawal_methods (method_code, user_id) WHERE active = TRUE;
@@ -0,0 +1,22 @@
+-- Idempotency-Key support for mutating handlers (idempotency.py).
+--
+-- A handler claims (user_id, idempotency_key) at the start of its
+-- transaction and stores its response in the same transaction, so a key is
+-- only ever committed together with the work it did. Retries read the row
+-- back by primary key and replay the response. Expired keys are ignored on
+-- lookup and deleted in batches by
+--
+--     python idempotency.py sweep [--loop SECONDS]
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key TEXT NOT NULL,
+    endpoint        TEXT NOT NULL,
+    request_hash    TEXT NOT NULL,
+    response        JSONB,
+    created_at      TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expires_at      TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at_idx ON idempotency_keys (expires_at);
@@ -0,0 +1,30 @@
+-- Change notifications for the seller directory cache (seller_directory.py).
+--
+-- createEscrow and bulk escrow creation resolve seller emails from an
+-- in-process cache that also remembers unknown emails. A new user, or a
+-- change to a user's email or role, NOTIFYs seller_directory_changed with
+-- the affected email(s) so workers drop those entries at once.
+
+CREATE OR REPLACE FUNCTION users_notify_seller_directory() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM pg_notify('seller_directory_changed', OLD.email);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.email IS DISTINCT FROM OLD.email) THEN
+        PERFORM pg_notify('seller_directory_changed', NEW.email);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_seller_directory_ins_del ON users;
+CREATE TRIGGER users_seller_directory_ins_del
+AFTER INSERT OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION users_notify_seller_directory();
+
+DROP TRIGGER IF EXISTS users_seller_directory_upd ON users;
+CREATE TRIGGER users_seller_directory_upd
+AFTER UPDATE OF email, role ON users
+FOR EACH ROW
+WHEN (OLD.email IS DISTINCT FROM NEW.email OR OLD.role IS DISTINCT FROM NEW.role)
+EXECUTE FUNCTION users_notify_seller_directory();
@@ -0,0 +1,36 @@
+-- Per-escrow deposit instructions (deposit_addresses.py, depositAddress).
+--
+-- deposit_address_pool holds Bitcoin receive addresses derived ahead of
+-- time from DEPOSIT_XPUB; key_source identifies the xpub and
+-- derivation_index the child, so the pool can be re-derived and audited.
+-- An escrow claims the lowest free address with FOR UPDATE SKIP LOCKED.
+--
+-- escrow_deposit_instructions stores what depositAddress returned the first
+-- time, so an escrow's address and bank reference never change and later
+-- calls are a primary-key read.
+--
+--     python deposit_addresses.py refill [--loop SECONDS]
+
+CREATE TABLE IF NOT EXISTS deposit_address_pool (
+    address          TEXT PRIMARY KEY,
+    network          TEXT NOT NULL,
+    key_source       TEXT NOT NULL,
+    derivation_index INTEGER NOT NULL,
+    escrow_id        INTEGER UNIQUE REFERENCES escrows(id),
+    created_at       TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    claimed_at       TIMESTAMP,
+    UNIQUE (network, key_source, derivation_index)
+);
+
+-- Free addresses in claim order
+CREATE INDEX IF NOT EXISTS deposit_address_pool_free_idx
+    ON deposit_address_pool (network, derivation_index) WHERE escrow_id IS NULL;
+
+CREATE TABLE IF NOT EXISTS escrow_deposit_instructions (
+    escrow_id       INTEGER PRIMARY KEY REFERENCES escrows(id) ON DELETE CASCADE,
+    payment_method  TEXT NOT NULL,
+    deposit_address TEXT NOT NULL,
+    reference       TEXT NOT NULL UNIQUE,
+    deposit_info    JSONB NOT NULL,
+    created_at      TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
@@ -0,0 +1,34 @@
+-- Crypto deposit watcher (deposit_watcher.py).
+--
+-- crypto_deposits records every output the watcher saw paying a deposit
+-- address, confirmed or not, so a restart picks up partial payments and
+-- outputs already counted are never counted twice. Rows above a
+-- reorganized block are deleted and rescanned.
+--
+-- deposit_watcher_state is the scan cursor per network: the last block
+-- processed and its hash.
+--
+--     python deposit_watcher.py scan [--loop SECONDS] [--start-height N]
+
+CREATE TABLE IF NOT EXISTS crypto_deposits (
+    network      TEXT NOT NULL,
+    txid         TEXT NOT NULL,
+    vout         INTEGER NOT NULL,
+    address      TEXT NOT NULL,
+    escrow_id    INTEGER NOT NULL REFERENCES escrows(id),
+    value        NUMERIC(20, 8) NOT NULL,
+    block_height INTEGER NOT NULL,
+    block_hash   TEXT NOT NULL,
+    seen_at      TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (network, txid, vout)
+);
+
+CREATE INDEX IF NOT EXISTS crypto_deposits_escrow_idx ON crypto_deposits (escrow_id);
+CREATE INDEX IF NOT EXISTS crypto_deposits_height_idx ON crypto_deposits (network, block_height);
+
+CREATE TABLE IF NOT EXISTS deposit_watcher_state (
+    network    TEXT PRIMARY KEY,
+    height     INTEGER NOT NULL,
+    block_hash TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
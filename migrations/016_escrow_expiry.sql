@@ -0,0 +1,13 @@
+-- Escrow auto-expiry (escrow_expiry.py).
+--
+-- The job looks escrows up by status and time of last change, so each
+-- batch is a short range scan of (status, updated_at) that touches only
+-- rows already due. New escrows get updated_at from the column default;
+-- older ones created without it are filled in from created_at by the job,
+-- a batch at a time, rather than by one long UPDATE here.
+--
+--     python escrow_expiry.py run [--batch-size N] [--dry-run] [--loop SECONDS]
+
+ALTER TABLE escrows ALTER COLUMN updated_at SET DEFAULT (now() AT TIME ZONE 'utc');
+
+CREATE INDEX IF NOT EXISTS escrows_status_updated_at_idx ON escrows (status, updated_at);
@@ -0,0 +1,49 @@
+-- Background job queue (jobs.py).
+--
+-- Handlers enqueue work with jobs.enqueue() in their own transaction, so a
+-- job exists only if the request's writes committed. Workers claim queued
+-- jobs whose run_at has passed, highest priority first, with FOR UPDATE
+-- SKIP LOCKED; a claim marks them 'running' under a lease (locked_until)
+-- and counts the attempt. A finished job is deleted. A failed one goes
+-- back to 'queued' with run_at pushed out by exponential backoff, or to
+-- 'dead' once max_attempts is used up. Jobs whose lease ran out (a worker
+-- died) are put back by the next worker that looks. The statement trigger
+-- wakes idle workers once an enqueueing transaction commits.
+--
+--     python jobs.py work [--kind KIND] [--import MODULE] [--batch-size N] [--once]
+--     python jobs.py stats
+--     python jobs.py retry-dead [--kind KIND]
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id           BIGSERIAL PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    payload      JSONB NOT NULL DEFAULT '{}'::jsonb,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'dead')),
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at       TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    locked_by    TEXT,
+    locked_until TIMESTAMP,
+    last_error   TEXT,
+    created_at   TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Claim order
+CREATE INDEX IF NOT EXISTS jobs_queued_idx
+    ON jobs (priority DESC, run_at, id) WHERE status = 'queued';
+-- Expired leases
+CREATE INDEX IF NOT EXISTS jobs_running_idx
+    ON jobs (locked_until) WHERE status = 'running';
+
+CREATE OR REPLACE FUNCTION jobs_notify_queued() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('jobs', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS jobs_queued ON jobs;
+CREATE TRIGGER jobs_queued
+AFTER INSERT ON jobs
+FOR EACH STATEMENT EXECUTE FUNCTION jobs_notify_queued();
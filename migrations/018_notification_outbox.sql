@@ -0,0 +1,47 @@
+-- Email notifications through a transactional outbox (notifications.py).
+--
+-- createEscrow, bulk escrow creation, sellerConfirm, sellerReject,
+-- sellerSubmitDelivery and releaseFunds insert one row per recipient in
+-- the same transaction as the state change, so an email goes out if and
+-- only if the change committed and no request waits on the mail server. The relay claims pending rows
+-- with FOR UPDATE SKIP LOCKED, sends them and marks them sent, or retries
+-- with backoff until 'dead'. The statement trigger wakes it on commit.
+--
+-- users.locale picks the template language; NULL means the default.
+--
+--     python notifications.py relay [--batch-size N] [--once]
+--     python notifications.py smtp-sink [--port 1025]
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS locale TEXT;
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id              BIGSERIAL PRIMARY KEY,
+    event           TEXT NOT NULL,
+    escrow_id       INTEGER REFERENCES escrows(id) ON DELETE CASCADE,
+    recipient_id    INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    recipient_email TEXT NOT NULL,
+    locale          TEXT NOT NULL,
+    context         JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status          TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'dead')),
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    last_error      TEXT,
+    created_at      TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    sent_at         TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+    ON notification_outbox (next_attempt_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS notification_outbox_escrow_idx ON notification_outbox (escrow_id);
+
+CREATE OR REPLACE FUNCTION notification_outbox_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('notification_outbox', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notification_outbox_pending ON notification_outbox;
+CREATE TRIGGER notification_outbox_pending
+AFTER INSERT ON notification_outbox
+FOR EACH STATEMENT EXECUTE FUNCTION notification_outbox_notify();
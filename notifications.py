@@ -0,0 +1,397 @@
+import argparse
+import logging
+import os
+import select
+import smtplib
+import socketserver
+import sys
+import time
+from collections import defaultdict
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+
+import psycopg2
+from jinja2 import Environment, StrictUndefined
+from psycopg2.extras import Json, execute_values
+
+import jobs
+
+logger = logging.getLogger(__name__)
+
+# Buyer/seller email notifications through a transactional outbox (see
+# migrations/018_notification_outbox.sql).
+#
+#     python notifications.py relay [--batch-size N] [--once]
+#     python notifications.py smtp-sink [--port 1025] [--maildir DIR]
+#
+# Handlers call enqueue() before their commit; it writes one
+# notification_outbox row per recipient, nothing else, so request latency
+# never depends on the mail server. The relay claims pending rows in
+# batches, groups them by (event, locale) so each template is looked up
+# and compiled once, renders each message from its row's context and sends
+# them all over one SMTP connection that stays open between batches.
+# Failed sends are retried with the job queue's backoff (jobs.backoff) and
+# end up 'dead' after NOTIFICATION_MAX_ATTEMPTS. Delivery is at least once:
+# a relay that dies mid-batch leaves its rows pending.
+#
+# smtp-sink is a local stand-in SMTP server for development and tests that
+# accepts everything and prints (or saves) what it receives.
+
+NOTIFY_CHANNEL = "notification_outbox"
+BATCH_SIZE = 100
+MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "8"))
+# Retries are not notified; an idle relay polls this often
+POLL_SECONDS = 30
+ERROR_MAX_LENGTH = 2000
+
+DEFAULT_LOCALE = os.getenv("NOTIFICATION_DEFAULT_LOCALE", "en")
+MAIL_FROM = os.getenv("MAIL_FROM", "Vanguard Escrow <no-reply@vanguardescrow.local>")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "") == "1"
+SMTP_TIMEOUT = 30
+
+# Which side(s) of the escrow hear about each event
+EVENTS = {
+    "escrow_created": ("buyer", "seller"),
+    "escrow_confirmed": ("buyer",),
+    "escrow_rejected": ("buyer",),
+    "delivery_submitted": ("buyer",),
+    "funds_released": ("seller",),
+}
+
+# (event, locale) -> (subject, body) templates. Context: escrow_id, amount,
+# payment_method, status, role (of the recipient), counterparty_email, plus
+# whatever the handler passed to enqueue(). Missing locales fall back to
+# DEFAULT_LOCALE.
+TEMPLATES = {
+    ("escrow_created", "en"): (
+        "{% if role == 'seller' %}New escrow #{{ escrow_id }} from {{ counterparty_email }}"
+        "{% else %}Escrow #{{ escrow_id }} created{% endif %}",
+        "{% if role == 'seller' %}{{ counterparty_email }} opened escrow #{{ escrow_id }} with you "
+        "for {{ amount }} ({{ payment_method }}).\nPlease confirm or reject it.\n"
+        "{% else %}Your escrow #{{ escrow_id }} with {{ counterparty_email }} for {{ amount }} "
+        "({{ payment_method }}) was created.\nWe will let you know when the seller confirms it.\n{% endif %}",
+    ),
+    ("escrow_confirmed", "en"): (
+        "Escrow #{{ escrow_id }} confirmed by the seller",
+        "{{ counterparty_email }} confirmed escrow #{{ escrow_id }} for {{ amount }}.\n"
+        "You can now pay into escrow.\n",
+    ),
+    ("escrow_rejected", "en"): (
+        "Escrow #{{ escrow_id }} rejected by the seller",
+        "{{ counterparty_email }} rejected escrow #{{ escrow_id }} for {{ amount }}.\n\n"
+        "Reason: {{ reason }}\n",
+    ),
+    ("delivery_submitted", "en"): (
+        "Delivery submitted for escrow #{{ escrow_id }}",
+        "{{ counterparty_email }} submitted the delivery for escrow #{{ escrow_id }}.\n"
+        "Please review it and release the funds once you are satisfied.\n",
+    ),
+    ("funds_released", "en"): (
+        "Funds released for escrow #{{ escrow_id }}",
+        "{{ counterparty_email }} released {{ amount }} from escrow #{{ escrow_id }} to your balance.\n",
+    ),
+}
+
+_env = Environment(undefined=StrictUndefined, keep_trailing_newline=True, autoescape=False)
+_compiled = {}
+
+
+def enqueue(cur, event, escrow_id, context=None):
+    """
+    Queue the emails for event on an escrow in the caller's transaction,
+    one per recipient. context adds template variables. Returns the number
+    of rows queued.
+    """
+    return enqueue_many(cur, event, [escrow_id], context)
+
+
+def enqueue_many(cur, event, escrow_ids, context=None):
+    """enqueue() for many escrows at once, in one statement (e.g. bulk creation)."""
+    if event not in EVENTS:
+        raise ValueError(f"Unknown notification event {event}")
+    cur.execute("""
+        INSERT INTO notification_outbox (event, escrow_id, recipient_id, recipient_email, locale, context)
+        SELECT %(event)s, e.id, u.id, u.email, COALESCE(u.locale, %(locale)s),
+               %(context)s::jsonb || jsonb_build_object(
+                   'escrow_id', e.id,
+                   'amount', e.amount,
+                   'payment_method', e.payment_method,
+                   'status', e.status,
+                   'role', r.role,
+                   'counterparty_email', c.email)
+        FROM escrows e
+        CROSS JOIN LATERAL (VALUES ('buyer', e.buyer_id, e.seller_id),
+                                   ('seller', e.seller_id, e.buyer_id)) AS r (role, user_id, counterparty_id)
+        JOIN users u ON u.id = r.user_id
+        LEFT JOIN users c ON c.id = r.counterparty_id
+        WHERE e.id = ANY(%(escrow_ids)s) AND r.role = ANY(%(roles)s) AND u.email IS NOT NULL;
+    """, {"event": event, "locale": DEFAULT_LOCALE, "context": Json(context or {}),
+          "escrow_ids": list(escrow_ids), "roles": list(EVENTS[event])})
+    return cur.rowcount
+
+
+def template(event, locale):
+    """Compiled (subject, body) templates for event in locale; compiled once per process."""
+    key = (event, locale)
+    if key not in _compiled:
+        source = TEMPLATES.get(key) or TEMPLATES[(event, DEFAULT_LOCALE)]
+        _compiled[key] = tuple(_env.from_string(s) for s in source)
+    return _compiled[key]
+
+
+def render(subject, body, recipient, context):
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = recipient
+    message["Subject"] = subject.render(context).strip()
+    message["Date"] = formatdate(usegmt=True)
+    message["Message-ID"] = make_msgid(domain=parseaddr(MAIL_FROM)[1].rpartition("@")[2] or None)
+    message.set_content(body.render(context))
+    return message
+
+
+class Mailer:
+    """An SMTP connection opened on first use and reused until it drops."""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    def send(self, message):
+        for attempt in (1, 2):
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.send_message(message)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Idle connections get closed by the server; reconnect once
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+
+def relay_batch(conn, mailer, batch_size=BATCH_SIZE):
+    """
+    Send up to batch_size pending notifications and record the outcome.
+    The rows stay locked until commit, so a relay that dies mid-batch
+    leaves them pending. Returns the number claimed.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, event, locale, recipient_email, context, attempts
+            FROM notification_outbox
+            WHERE status = 'pending' AND next_attempt_at <= (now() AT TIME ZONE 'utc')
+            ORDER BY next_attempt_at, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED;
+        """, (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        groups = defaultdict(list)
+        for row in rows:
+            groups[(row[1], row[2])].append(row)
+
+        sent = []
+        failed = []
+        for (event, locale), group in groups.items():
+            for outbox_id, _, _, recipient, context, attempts in group:
+                try:
+                    mailer.send(render(*template(event, locale), recipient, context))
+                    sent.append(outbox_id)
+                except Exception as e:
+                    attempts += 1
+                    dead = attempts >= MAX_ATTEMPTS
+                    failed.append((outbox_id, dead, 0 if dead else jobs.backoff(attempts),
+                                   f"{type(e).__name__}: {e}"[:ERROR_MAX_LENGTH]))
+                    logger.warning("notification %s to %s attempt %s/%s failed%s: %s", outbox_id, recipient,
+                                   attempts, MAX_ATTEMPTS, ", giving up" if dead else "", e)
+
+        if sent:
+            cur.execute("""
+                UPDATE notification_outbox
+                SET status = 'sent', attempts = attempts + 1, sent_at = (now() AT TIME ZONE 'utc'),
+                    last_error = NULL
+                WHERE id = ANY(%s);
+            """, (sent,))
+        if failed:
+            execute_values(cur, """
+                UPDATE notification_outbox o
+                SET status = CASE WHEN v.dead THEN 'dead' ELSE 'pending' END,
+                    attempts = o.attempts + 1,
+                    next_attempt_at = (now() AT TIME ZONE 'utc') + make_interval(secs => v.delay),
+                    last_error = v.error
+                FROM (VALUES %s) AS v (id, dead, delay, error)
+                WHERE o.id = v.id;
+            """, failed, template="(%s::bigint, %s::boolean, %s::double precision, %s)")
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def run_forever(database_url, batch_size=BATCH_SIZE):
+    mailer = Mailer()
+    backoff_seconds = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(database_url)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+            conn.commit()
+            cur.close()
+            while True:
+                while relay_batch(conn, mailer, batch_size) == batch_size:
+                    pass
+                backoff_seconds = 1
+
+                # Sleep until a handler commits a notification or the poll interval elapses
+                readable, _, _ = select.select([conn], [], [], POLL_SECONDS)
+                if readable:
+                    conn.poll()
+                    conn.notifies.clear()
+        except Exception as e:
+            logger.warning("notification relay failed: %s", e)
+        finally:
+            mailer.close()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        time.sleep(backoff_seconds)
+        backoff_seconds = min(backoff_seconds * 2, POLL_SECONDS)
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from smtplib."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 smtp-sink ready")
+        data = None
+        for raw in self.rfile:
+            line = raw.rstrip(b"\r\n")
+            if data is not None:
+                if line == b".":
+                    self.server.deliver(b"\r\n".join(data) + b"\r\n")
+                    data = None
+                    self.reply("250 OK")
+                else:
+                    # Undo dot-stuffing
+                    data.append(line[1:] if line.startswith(b".") else line)
+                continue
+            verb = line[:4].upper()
+            if verb in (b"HELO", b"EHLO"):
+                self.reply("250 smtp-sink")
+            elif verb == b"DATA":
+                data = []
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+            elif verb == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, maildir=None):
+        super().__init__(address, _SinkHandler)
+        self.maildir = maildir
+        self.received = 0
+
+    def deliver(self, raw):
+        self.received += 1
+        headers = raw.split(b"\r\n\r\n", 1)[0].decode("utf-8", "replace")
+        summary = {k: v for k, v in (h.split(": ", 1) for h in headers.split("\r\n") if ": " in h)}
+        print(f"{summary.get('To', '?')}: {summary.get('Subject', '')}", flush=True)
+        if self.maildir:
+            with open(os.path.join(self.maildir, f"{time.time_ns()}-{self.received}.eml"), "wb") as f:
+                f.write(raw)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Notification email relay")
+    parser.add_argument("command", choices=["relay", "smtp-sink"])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--once", action="store_true", help="send what is due and exit")
+    parser.add_argument("--host", default="127.0.0.1", help="smtp-sink listen address")
+    parser.add_argument("--port", type=int, default=SMTP_PORT, help="smtp-sink listen port")
+    parser.add_argument("--maildir", help="smtp-sink: save each message here as .eml")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "smtp-sink":
+        if args.maildir:
+            os.makedirs(args.maildir, exist_ok=True)
+        with SmtpSink((args.host, args.port), args.maildir) as server:
+            print(f"smtp-sink listening on {args.host}:{args.port}", flush=True)
+            server.serve_forever()
+        return 0
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    if not args.once:
+        run_forever(database_url, args.batch_size)
+        return 0
+
+    sent = 0
+    mailer = Mailer()
+    conn = psycopg2.connect(database_url)
+    try:
+        while True:
+            n = relay_batch(conn, mailer, args.batch_size)
+            sent += n
+            if n < args.batch_size:
+                break
+    finally:
+        mailer.close()
+        conn.close()
+    print(f"Processed {sent} notifications")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,93 +1,146 @@
 import json
 import os
+import logging
+import select
+import threading
+import time
 import psycopg2
+from psycopg2 import errors
+from http_cache import strong_etag
+
+logger = logging.getLogger(__name__)
+
+# The list changes rarely, so it is served from memory and reloaded in the
+# background: immediately on NOTIFY payment_methods_changed (see
+# migrations/003_payment_methods_notify.sql), otherwise every TTL seconds.
+# The TTL also covers connections that cannot LISTEN, e.g. through a pooler.
+CACHE_TTL_SECONDS = int(os.getenv("PAYMENT_METHODS_TTL", "300"))
+NOTIFY_CHANNEL = "payment_methods_changed"
+
+# How long browsers and CDNs may reuse a response before revalidating
+CLIENT_MAX_AGE_SECONDS = 300
+
+# Only the very first request in a worker waits for the initial load
+INITIAL_LOAD_WAIT_SECONDS = 2
+
+DEFAULT_PAYMENT_METHODS = [
+    {
+        "method": "bank_transfer",
+        "description": "Bank Transfer",
+        "is_active": True
+    },
+    {
+        "method": "crypto",
+        "description": "Cryptocurrency",
+        "is_active": True
+    }
+]
+
+
+def _build_snapshot(payment_methods):
+    body = json.dumps({"payment_methods": payment_methods})
+    return {"body": body, "etag": strong_etag(body)}
+
+
+_snapshot = _build_snapshot(DEFAULT_PAYMENT_METHODS)
+_loaded = threading.Event()
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def _load_payment_methods(cur):
+    """Read active methods, falling back to the default list if there are none."""
+    try:
+        cur.execute("""
+            SELECT method_name, description, is_active
+            FROM payment_methods
+            WHERE is_active = true
+            ORDER BY method_name;
+        """)
+    except errors.UndefinedTable:
+        return DEFAULT_PAYMENT_METHODS
+
+    payment_methods = []
+    for method in cur.fetchall():
+        payment_methods.append({
+            "method": method[0],
+            "description": method[1],
+            "is_active": method[2]
+        })
+    return payment_methods or DEFAULT_PAYMENT_METHODS
+
+
+def _refresh_forever(database_url):
+    global _snapshot
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(database_url)
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+            while True:
+                _snapshot = _build_snapshot(_load_payment_methods(cur))
+                _loaded.set()
+                backoff = 1
+
+                # Sleep until an admin edit is announced or the TTL elapses
+                readable, _, _ = select.select([conn], [], [], CACHE_TTL_SECONDS)
+                if readable:
+                    conn.poll()
+                    conn.notifies.clear()
+        except Exception as e:
+            # Keep serving the last list we had; never fail requests over this
+            logger.warning("payment methods refresh failed: %s", e)
+            _loaded.set()
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        time.sleep(backoff)
+        backoff = min(backoff * 2, CACHE_TTL_SECONDS)
+
+
+def _ensure_refresher():
+    global _refresher
+    if _refresher is not None:
+        return
+    with _refresher_lock:
+        if _refresher is not None:
+            return
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            logger.warning("DATABASE_URL not set; serving default payment methods")
+            _loaded.set()
+            _refresher = False
+            return
+        _refresher = threading.Thread(target=_refresh_forever, args=(database_url,),
+                                      name="payment-methods-refresh", daemon=True)
+        _refresher.start()
+
 
 def handler(event, context):
     """
     Netlify Python Function: /paymentMethods
-    Returns available payment methods (may require database connection for dynamic methods)
+    Returns available payment methods from the in-process cache (no database access on the request path)
     """
 
-    # Connect to Neon DB using ONLY DATABASE_URL
-    try:
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            return {
-                "statusCode": 500,
-                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
-            }
-        
-        conn = psycopg2.connect(database_url)
-        cur = conn.cursor()
-    except Exception as e:
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
-        }
-
-    # Try to get payment methods from database, or return static list if table doesn't exist
-    try:
-        # Example: Query a table named 'payment_methods' if it exists
-        cur.execute("SELECT method_name, description, is_active FROM payment_methods WHERE is_active = true;")
-        methods = cur.fetchall()
-        payment_methods = []
-        for method in methods:
-            payment_methods.append({
-                "method": method[0],
-                "description": method[1],
-                "is_active": method[2]
-            })
-
-        cur.close()
-        conn.close()
-
-        # If no payment methods found in database, return a default list
-        if not payment_methods:
-            payment_methods = [
-                {
-                    "method": "bank_transfer",
-                    "description": "Bank Transfer",
-                    "is_active": True
-                },
-                {
-                    "method": "crypto",
-                    "description": "Cryptocurrency",
-                    "is_active": True
-                }
-            ]
-
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "payment_methods": payment_methods
-            })
-        }
-
-    except Exception as e:
-        # If there's an error (like table doesn't exist), return a default list
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
-
-        # Return static payment methods
-        payment_methods = [
-            {
-                "method": "bank_transfer",
-                "description": "Bank Transfer",
-                "is_active": True
-            },
-            {
-                "method": "crypto",
-                "description": "Cryptocurrency",
-                "is_active": True
-            }
-        ]
-
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "payment_methods": payment_methods
-            })
-        }
+    _ensure_refresher()
+    if not _loaded.is_set():
+        _loaded.wait(INITIAL_LOAD_WAIT_SECONDS)
+
+    snapshot = _snapshot
+
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": "application/json",
+            "Cache-Control": f"public, max-age={CLIENT_MAX_AGE_SECONDS}, stale-while-revalidate={CACHE_TTL_SECONDS}",
+            "ETag": snapshot["etag"]
+        },
+        "body": snapshot["body"]
+    }
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import tempfile
+from decimal import Decimal
+
+import psycopg2
+
+import transactions
+import withdrawal_methods
+
+logger = logging.getLogger(__name__)
+
+# Pays out released seller balances (see migrations/010_payouts.sql).
+#
+#     python payouts.py run [--batch-size N] [--min-amount X] [--method CODE]
+#     python payouts.py export
+#
+# "run" walks sellers with an active withdrawal method, one method_code at a
+# time in user id order. Each batch is one transaction that holds the
+# payout advisory lock, so batches never overlap: a single statement
+# locks the batch's sellers, reads their ledger balances, inserts payouts
+# for those above --min-amount and appends the matching ledger postings
+# (see transactions.py); a second one totals the batch. "export" (also done at the end
+# of "run") writes every batch that has no file yet to
+# PAYOUT_DIR/<rail>/batch-<id>.<csv|json> for the processor. Files are
+# written to a temp name and renamed, so a file only ever appears complete
+# and only for a committed batch; an interrupted export is simply redone.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PAYOUT_DIR = os.getenv("PAYOUT_DIR", os.path.join(ROOT, "payouts"))
+BATCH_SIZE = 5000
+EXPORT_FETCH_SIZE = 5000
+
+# File format per rail; the bank processor takes CSV, crypto rails JSON
+RAIL_FORMATS = {"sepa": "csv"}
+CSV_COLUMNS = ["payout_id", "user_id", "amount", "account_name", "iban", "bic", "reference"]
+
+
+def _create_batch(cur, method, after_user_id, batch_size, min_amount):
+    """
+    Pay out the next batch_size sellers after after_user_id. Returns
+    (batch_id or None if nobody was due, sellers scanned, last user id,
+    payouts created).
+    """
+    cur.execute("""
+        INSERT INTO payout_batches (method_code, rail)
+        VALUES (%s, %s)
+        RETURNING id;
+    """, (method.code, method.rail))
+    batch_id = cur.fetchone()[0]
+
+    # Payout batches run one at a time across all runs and methods. The
+    # balance below is read with the statement's snapshot, so it must start
+    # after any other batch has committed: a users row lock alone would not
+    # do, since nothing updates that row and Postgres would not re-read the
+    # balance once a concurrent run released it. Releases only append
+    # ledger entries and never wait on this lock. Balances are ledger
+    # snapshot + delta, and each payout appends a balanced posting that
+    # empties the seller's account.
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('payout_batches'));")
+    cur.execute("""
+        WITH picked AS (
+            SELECT u.id, w.details
+            FROM users u
+            JOIN seller_withdrawal_methods w ON w.user_id = u.id
+            WHERE u.id > %s
+              AND w.active = TRUE
+              AND w.method_code = %s
+            ORDER BY u.id
+            LIMIT %s
+            FOR UPDATE OF u
+        ), due AS (
+            SELECT p.id, p.details, a.balance
+            FROM picked p
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(s.balance, 0) + COALESCE((
+                    SELECT sum(e.amount)
+                    FROM ledger_entries e
+                    WHERE e.account = 'user:' || p.id
+                      AND e.tx_id >= COALESCE(s.horizon, '0'::xid8)
+                ), 0) AS balance
+                FROM (SELECT 1) one
+                LEFT JOIN ledger_snapshots s ON s.account = 'user:' || p.id
+            ) a
+            WHERE a.balance > %s
+        ), paid AS (
+            INSERT INTO payouts (batch_id, user_id, method_code, amount, details)
+            SELECT %s, id, %s, balance, details
+            FROM due
+            RETURNING id, user_id, amount, nextval('ledger_posting_seq') AS posting_id
+        ), entries AS (
+            INSERT INTO ledger_entries (posting_id, account, amount, kind, payout_id)
+            SELECT posting_id, 'user:' || user_id, -amount, %s, id FROM paid
+            UNION ALL
+            SELECT posting_id, %s, amount, %s, id FROM paid
+        )
+        SELECT (SELECT count(*) FROM picked), (SELECT max(id) FROM picked), (SELECT count(*) FROM paid);
+    """, (after_user_id, method.code, batch_size, min_amount, batch_id, method.code,
+          transactions.KIND_PAYOUT, transactions.EXTERNAL_PAYOUTS, transactions.KIND_PAYOUT))
+    scanned, last_user_id, paid = cur.fetchone()
+    if not paid:
+        return None, scanned, last_user_id, 0
+
+    cur.execute("""
+        UPDATE payout_batches b
+        SET item_count = t.item_count, total_amount = t.total_amount
+        FROM (SELECT count(*) AS item_count, sum(amount) AS total_amount
+              FROM payouts WHERE batch_id = %s) t
+        WHERE b.id = %s;
+    """, (batch_id, batch_id))
+    return batch_id, scanned, last_user_id, paid
+
+
+def run(conn, batch_size=BATCH_SIZE, min_amount=Decimal("0"), method_codes=None):
+    """Create payout batches for every registered method. Returns {method_code: (batches, payouts)}."""
+    summary = {}
+    cur = conn.cursor()
+    try:
+        for code in method_codes or sorted(withdrawal_methods.METHODS):
+            method = withdrawal_methods.METHODS[code]
+            batches = payouts = 0
+            after_user_id = 0
+            while True:
+                try:
+                    batch_id, scanned, last_user_id, count = _create_batch(
+                        cur, method, after_user_id, batch_size, min_amount)
+                except Exception:
+                    conn.rollback()
+                    raise
+                if batch_id:
+                    conn.commit()
+                    batches += 1
+                    payouts += count
+                    logger.info("batch %s: %s %s payouts", batch_id, count, code)
+                else:
+                    # Nobody in this slice was due; drop the empty batch
+                    conn.rollback()
+                if scanned < batch_size:
+                    break
+                after_user_id = last_user_id
+            summary[code] = (batches, payouts)
+
+        # Sellers on methods that are no longer registered keep their balance
+        cur.execute("""
+            SELECT method_code, count(*)
+            FROM seller_withdrawal_methods
+            WHERE active = TRUE AND NOT (method_code = ANY(%s))
+            GROUP BY method_code;
+        """, (sorted(withdrawal_methods.METHODS),))
+        for code, count in cur.fetchall():
+            logger.warning("%s sellers with method %s were not paid out (unknown method)", count, code)
+        conn.rollback()
+    finally:
+        cur.close()
+    return summary
+
+
+def _csv_row(payout_id, user_id, amount, details):
+    return [payout_id, user_id, str(amount), details.get("account_name", ""),
+            details.get("iban", ""), details.get("bic", ""), f"PAYOUT-{payout_id}"]
+
+
+def _write_batch_file(conn, batch_id, rail):
+    fmt = RAIL_FORMATS.get(rail, "json")
+    directory = os.path.join(PAYOUT_DIR, rail)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"batch-{batch_id}.{fmt}")
+
+    # Stream the batch through a server-side cursor; big batches are never
+    # held in memory
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".batch-{batch_id}-")
+    try:
+        with os.fdopen(fd, "w", newline="") as f, conn.cursor(name=f"payout_export_{batch_id}") as rows:
+            rows.itersize = EXPORT_FETCH_SIZE
+            rows.execute("""
+                SELECT id, user_id, amount, details
+                FROM payouts
+                WHERE batch_id = %s
+                ORDER BY id;
+            """, (batch_id,))
+            if fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(CSV_COLUMNS)
+                for payout_id, user_id, amount, details in rows:
+                    writer.writerow(_csv_row(payout_id, user_id, amount, details))
+            else:
+                # One JSON object per line, so the processor can stream it too
+                for payout_id, user_id, amount, details in rows:
+                    f.write(json.dumps({"payout_id": payout_id, "user_id": user_id, "amount": str(amount),
+                                        "details": details, "reference": f"PAYOUT-{payout_id}"}) + "\n")
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def export(conn):
+    """Write files for batches that do not have one yet. Returns the paths written."""
+    cur = conn.cursor()
+    cur.execute("SELECT id, rail FROM payout_batches WHERE status = 'created' ORDER BY id;")
+    pending = cur.fetchall()
+    conn.rollback()
+
+    paths = []
+    try:
+        for batch_id, rail in pending:
+            path = _write_batch_file(conn, batch_id, rail)
+            cur.execute("""
+                UPDATE payout_batches
+                SET status = 'exported', file_path = %s, exported_at = (now() AT TIME ZONE 'utc')
+                WHERE id = %s AND status = 'created';
+            """, (path, batch_id))
+            conn.commit()
+            paths.append(path)
+    finally:
+        cur.close()
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seller payout batches")
+    parser.add_argument("command", choices=["run", "export"])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--min-amount", type=Decimal, default=Decimal("0"),
+                        help="only pay out balances above this amount")
+    parser.add_argument("--method", action="append", choices=sorted(withdrawal_methods.METHODS),
+                        help="limit the run to a method_code (repeatable)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    conn = psycopg2.connect(database_url)
+    try:
+        if args.command == "run":
+            for code, (batches, payouts) in run(conn, args.batch_size, args.min_amount, args.method).items():
+                print(f"{code}: {payouts} payouts in {batches} batches")
+        for path in export(conn):
+            print(f"Wrote {path}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from collections import Counter, namedtuple
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+
+import deposit_addresses
+import deposits
+
+logger = logging.getLogger(__name__)
+
+# Bank statement reconciliation: marks escrows funded from the incoming
+# transfers on a statement file instead of the buyer's word.
+#
+#     python reconciliation.py statement.csv|statement.xml [--format csv|camt053]
+#                              [--report report.csv] [--batch-size N] [--dry-run]
+#
+# Statements are parsed as a stream (CSV rows, or camt.053 <Ntry> elements
+# discarded as soon as they are read). Each credit's text is searched for
+# the ESCROW-<id>-<cc> reference depositAddress hands out and matched
+# against an in-memory index of the escrows still waiting for payment, so
+# memory is bounded by open escrows, not statement size. Escrows whose
+# payments add up to their amount are moved to 'paid' in set-based batches
+# (deposits.mark_funded). Every line gets a report row: matched, partial
+# (short of the amount so far) or unmatched, with the reason.
+
+FORMATS = ("csv", "camt053")
+BATCH_SIZE = 1000
+REPORT_COLUMNS = ["line", "entry_ref", "amount", "escrow_id", "result", "detail"]
+
+# CSV column names, compared case-insensitively with spaces as underscores
+CSV_AMOUNT_COLUMNS = ("amount", "credit", "credit_amount")
+CSV_DEBIT_COLUMNS = ("debit", "debit_amount")
+CSV_REF_COLUMNS = ("transaction_id", "entry_id", "id", "bank_reference")
+CSV_TEXT_COLUMNS = ("reference", "payment_reference", "remittance_information", "remittance",
+                    "description", "details", "memo", "narrative")
+
+StatementLine = namedtuple("StatementLine", ["line", "entry_ref", "amount", "text"])
+
+
+def _parse_amount(value):
+    """Decimal from '1234.56', '1,234.56' or '1234,56'; None if blank or unparseable."""
+    value = (value or "").strip().replace(" ", "")
+    if not value:
+        return None
+    if "," in value and "." in value:
+        value = value.replace(",", "")
+    else:
+        value = value.replace(",", ".")
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def read_csv(f):
+    """Yield StatementLines from a CSV statement with a header row."""
+    reader = csv.reader(f)
+    header = [h.strip().lower().replace(" ", "_").replace("-", "_") for h in next(reader, [])]
+
+    def column(names):
+        return next((header.index(n) for n in names if n in header), None)
+
+    amount_col = column(CSV_AMOUNT_COLUMNS)
+    debit_col = column(CSV_DEBIT_COLUMNS)
+    ref_col = column(CSV_REF_COLUMNS)
+    text_cols = [header.index(n) for n in CSV_TEXT_COLUMNS if n in header]
+    if amount_col is None or not text_cols:
+        raise ValueError("CSV statement needs an amount (or credit) column and a reference or description column")
+
+    for line, row in enumerate(reader, 2):
+        if not row:
+            continue
+        cell = lambda i: row[i] if i is not None and i < len(row) else ""
+        amount = _parse_amount(cell(amount_col))
+        debit = _parse_amount(cell(debit_col))
+        if amount is None and debit:
+            amount = -debit
+        yield StatementLine(line, cell(ref_col), amount, " ".join(cell(i) for i in text_cols))
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child(elem, name):
+    return next((c for c in elem if _local(c.tag) == name), None)
+
+
+def read_camt053(f):
+    """
+    Yield StatementLines from a camt.053 (ISO 20022 bank-to-customer
+    statement) file, one per <Ntry>. Each entry is detached from the tree
+    once read, so the parsed document never grows.
+    """
+    stack = []
+    entry = 0
+    for event, elem in ElementTree.iterparse(f, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        if _local(elem.tag) != "Ntry":
+            continue
+
+        entry += 1
+        amount_elem = _child(elem, "Amt")
+        amount = _parse_amount(amount_elem.text if amount_elem is not None else None)
+        indicator = _child(elem, "CdtDbtInd")
+        if amount is not None and indicator is not None and (indicator.text or "").strip() == "DBIT":
+            amount = -amount
+        # Elements without children are falsy, so no `or` here
+        ref = _child(elem, "AcctSvcrRef")
+        if ref is None:
+            ref = _child(elem, "NtryRef")
+        texts = []
+        for node in elem.iter():
+            if _local(node.tag) in ("RmtInf", "EndToEndId", "AddtlNtryInf", "AddtlTxInf"):
+                texts.extend(t.strip() for t in node.itertext() if t.strip())
+        yield StatementLine(entry, ref.text.strip() if ref is not None and ref.text else "", amount, " ".join(texts))
+
+        if stack:
+            stack[-1].remove(elem)
+        elem.clear()
+
+
+def read_statement(f, fmt):
+    return read_camt053(f) if fmt == "camt053" else read_csv(f)
+
+
+def detect_format(path):
+    return "camt053" if path.lower().endswith(".xml") else "csv"
+
+
+def reconcile(conn, lines, report=None, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Match statement lines against escrows waiting for payment and fund the
+    ones paid in full. report is a csv.writer for per-line results (or
+    None). Returns a Counter of results.
+    """
+    awaiting = deposits.load_awaiting_payment(conn)
+    logger.info("%s escrows awaiting payment", len(awaiting))
+    received = {}
+    summary = Counter()
+    # Report rows since the last flush, and the escrows they fund; bounded
+    # by batch_size
+    pending_rows = []
+    to_fund = []
+
+    def flush():
+        funded = set()
+        if to_fund and not dry_run:
+            cur = conn.cursor()
+            try:
+                funded = set(deposits.mark_funded(cur, to_fund))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+        elif to_fund:
+            funded = {escrow_id for escrow_id, _ in to_fund}
+        for row in pending_rows:
+            if row[4] == "matched" and row[3] not in funded:
+                # Changed status since the index was built
+                row[4], row[5] = "unmatched", "escrow no longer awaiting payment"
+            summary[row[4]] += 1
+            if report is not None:
+                report.writerow(row)
+        summary["funded"] += len(funded)
+        pending_rows.clear()
+        to_fund.clear()
+
+    for line in lines:
+        amount = line.amount
+        escrow_id = deposit_addresses.parse_reference(line.text)
+        row = [line.line, line.entry_ref, amount, escrow_id, "unmatched", ""]
+        if amount is None or amount <= 0:
+            row[5] = "not a credit"
+        elif escrow_id is None:
+            row[5] = "no escrow reference"
+        elif escrow_id not in awaiting:
+            row[5] = "escrow not awaiting payment"
+        else:
+            expected = awaiting[escrow_id]
+            total = received.get(escrow_id, 0) + amount
+            if total < expected:
+                received[escrow_id] = total
+                row[4], row[5] = "partial", f"{total} of {expected} received"
+            else:
+                del awaiting[escrow_id]
+                received.pop(escrow_id, None)
+                row[4] = "matched"
+                if total > expected:
+                    row[5] = f"overpaid by {total - expected}"
+                to_fund.append((escrow_id, f"Bank statement deposit {line.entry_ref or 'line ' + str(line.line)}"))
+        pending_rows.append(row)
+        if len(pending_rows) >= batch_size:
+            flush()
+    flush()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile a bank statement against escrows awaiting payment")
+    parser.add_argument("statement", help="statement file (CSV or camt.053 XML)")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--report", help="write per-line results to this CSV file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="match and report without changing escrows")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    logging.basicConfig(level=logging.INFO)
+    fmt = args.format or detect_format(args.statement)
+    conn = psycopg2.connect(database_url)
+    report_file = open(args.report, "w", newline="") if args.report else None
+    try:
+        report = None
+        if report_file:
+            report = csv.writer(report_file)
+            report.writerow(REPORT_COLUMNS)
+        mode = "rb" if fmt == "camt053" else "r"
+        with open(args.statement, mode, **({} if mode == "rb" else {"newline": "", "encoding": "utf-8-sig"})) as f:
+            summary = reconcile(conn, read_statement(f, fmt), report, args.batch_size, args.dry_run)
+    finally:
+        if report_file:
+            report_file.close()
+        conn.close()
+
+    print(f"{summary['matched']} matched, {summary['partial']} partial, {summary['unmatched']} unmatched; "
+          f"{summary['funded']} escrows {'would be ' if args.dry_run else ''}funded")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
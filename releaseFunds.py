@@ -2,7 +2,10 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
+import notifications
 from decimal import Decimal
+import transactions
 
 def handler(event, context):
     """
@@ -85,6 +88,13 @@ def handler(event, context):
 
     # Release funds to seller
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "releaseFunds", user_id)
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Get escrow details and verify user has permission (must be the buyer)
         cur.execute("""
             SELECT e.id, e.amount, e.status, e.seller_id
@@ -119,28 +129,23 @@ def handler(event, context):
             WHERE id = %s
         """, (datetime.datetime.utcnow(), escrow_id))
 
-        # Update seller's balance (add the escrow amount)
-        cur.execute("""
-            UPDATE users 
-            SET balance = balance + %s
-            WHERE id = %s
-        """, (amount, seller_id))
+        # Credit the seller through the ledger. This only appends entries,
+        # so releases to the same seller don't queue on a balance row lock
+        transactions.release(cur, escrow_id, seller_id, amount)
+
+        # Emailed by the notification relay once this commits
+        notifications.enqueue(cur, "funds_released", escrow_id)
 
         # Get the new seller balance for the response
-        cur.execute("SELECT balance FROM users WHERE id = %s", (seller_id,))
-        new_seller_balance = cur.fetchone()[0]
+        new_seller_balance = transactions.balance(cur, transactions.user_account(seller_id))
         
-        conn.commit()
-        cur.close()
-        conn.close()
-
         # Convert Decimal to float for JSON serialization
         if isinstance(amount, Decimal):
             amount = float(amount)
         if isinstance(new_seller_balance, Decimal):
             new_seller_balance = float(new_seller_balance)
 
-        return {
+        response = {
             "statusCode": 200,
             "body": json.dumps({
                 "success": True,
@@ -153,6 +158,12 @@ def handler(event, context):
                 "new_status": "released"
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         conn.rollback()
@@ -0,0 +1,122 @@
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent as-is: headers dominate and compressing
+# costs more CPU than it saves on the wire
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Levels tuned for latency rather than ratio; higher levels cost several
+# times the CPU for a few percent on JSON
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Compressed bodies are reused for responses with the same ETag (the same
+# bytes), e.g. the cached paymentMethods list or an unchanged escrow list
+CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/")
+
+metrics.describe("compression_responses_total", "Responses sent compressed")
+metrics.describe("compression_bytes_in_total", "Uncompressed bytes of compressed responses")
+metrics.describe("compression_bytes_out_total", "Compressed bytes sent")
+metrics.describe("compression_ratio", "Cumulative compressed/uncompressed byte ratio")
+metrics.describe("compression_cpu_seconds_total", "Thread CPU time spent compressing")
+metrics.describe("compression_cache_hits_total", "Compressed bodies served from the cache")
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+        return data
+
+
+def _cache_put(key, data):
+    global _cache_bytes
+    if len(data) > CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = data
+        _cache_bytes += len(data)
+        while _cache_bytes > CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def negotiate(request):
+    """Best content coding the client accepts, or None."""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress_response(response, request):
+    """Compress a buffered response in place if the client and size allow it."""
+    if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+        return response
+    if "Content-Encoding" in response.headers:
+        return response
+    if not (response.mimetype or "").startswith(COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+
+    encoding = negotiate(request)
+    if not encoding:
+        return response
+
+    etag = response.headers.get("ETag")
+    cache_key = (etag, encoding) if etag else None
+
+    compressed = _cache_get(cache_key) if cache_key else None
+    if compressed is not None:
+        metrics.inc("compression_cache_hits_total", encoding=encoding)
+    else:
+        started = time.thread_time()
+        compressed = _compress(body, encoding)
+        metrics.inc("compression_cpu_seconds_total", time.thread_time() - started, encoding=encoding)
+        if cache_key:
+            _cache_put(cache_key, compressed)
+
+    metrics.inc("compression_responses_total", encoding=encoding)
+    metrics.inc("compression_bytes_in_total", len(body), encoding=encoding)
+    metrics.inc("compression_bytes_out_total", len(compressed), encoding=encoding)
+    bytes_in = metrics.get("compression_bytes_in_total", encoding=encoding)
+    metrics.set_gauge("compression_ratio",
+                      metrics.get("compression_bytes_out_total", encoding=encoding) / bytes_in,
+                      encoding=encoding)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    # The ETag names the uncompressed bytes; like nginx, mark it weak for the
+    # encoded representation (If-None-Match still matches on weak comparison)
+    if etag and not etag.startswith("W/"):
+        response.headers["ETag"] = "W/" + etag
+    return response
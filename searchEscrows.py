@@ -0,0 +1,190 @@
+import json
+import os
+import psycopg2
+import datetime
+from decimal import Decimal
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_QUERY_LENGTH = 200
+
+def handler(event, context):
+    """
+    Netlify Python Function: /searchEscrows
+    Searches the current user's escrows by counterparty email, delivery terms,
+    deliverables and rejection reason (requires authentication via token)
+    Query: ?q=<text>&limit=20&offset=0
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Get search parameters from query string
+    query_params = event.get('queryStringParameters') or {}
+    search_text = (query_params.get('q') or '').strip()
+
+    if not search_text:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Missing q parameter"})
+        }
+    if len(search_text) > MAX_QUERY_LENGTH:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": f"q must be at most {MAX_QUERY_LENGTH} characters"})
+        }
+
+    try:
+        limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(query_params.get('offset', 0))
+    except ValueError:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "limit and offset must be integers"})
+        }
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+
+    # Connect to Neon DB using ONLY DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role = user_result
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Scope the search to the caller's side of the escrow
+    if role == 'buyer':
+        own_column, counterparty_column = "buyer_id", "seller_id"
+    elif role == 'seller':
+        own_column, counterparty_column = "seller_id", "buyer_id"
+    else:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Invalid user role"})
+        }
+
+    # Escape LIKE wildcards so the text is matched literally
+    email_pattern = "%" + search_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    # Search escrows
+    try:
+        # Text matches use the GIN index on search_vector, email matches the
+        # trigram index on users.email; both branches stay inside the caller's escrows
+        cur.execute(f"""
+            WITH query AS (
+                SELECT websearch_to_tsquery('english', %(q)s) AS tsq
+            ),
+            matches AS (
+                SELECT e.id
+                FROM escrows e, query
+                WHERE e.{own_column} = %(user_id)s AND e.search_vector @@ query.tsq
+                UNION
+                SELECT e.id
+                FROM escrows e
+                JOIN users c ON c.id = e.{counterparty_column}
+                WHERE e.{own_column} = %(user_id)s AND c.email ILIKE %(email_pattern)s
+            )
+            SELECT e.id, e.amount, e.payment_method, e.status, e.created_at, c.email,
+                   ts_rank(e.search_vector, query.tsq) AS rank
+            FROM matches m
+            JOIN escrows e ON e.id = m.id
+            LEFT JOIN users c ON c.id = e.{counterparty_column}
+            CROSS JOIN query
+            ORDER BY rank DESC, e.created_at DESC, e.id DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            "q": search_text,
+            "user_id": user_id,
+            "email_pattern": email_pattern,
+            "limit": limit + 1,
+            "offset": offset
+        })
+
+        rows = cur.fetchall()
+        has_more = len(rows) > limit
+        escrows_list = []
+        for escrow in rows[:limit]:
+            # Convert Decimal to float for JSON serialization
+            amount = escrow[1]
+            if isinstance(amount, Decimal):
+                amount = float(amount)
+
+            escrows_list.append({
+                "id": escrow[0],
+                "amount": amount,
+                "payment_method": escrow[2],
+                "status": escrow[3],
+                "created_at": escrow[4].isoformat() if escrow[4] else None,
+                "counterparty_email": escrow[5],
+                "rank": float(escrow[6])
+            })
+
+        cur.close()
+        conn.close()
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "escrows": escrows_list,
+                "limit": limit,
+                "offset": offset,
+                "next_offset": offset + limit if has_more else None
+            })
+        }
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to search escrows", "details": str(e)})
+        }
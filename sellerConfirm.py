@@ -2,6 +2,8 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
+import notifications
 
 def handler(event, context):
     """
@@ -89,6 +91,13 @@ def handler(event, context):
 
     # Process seller confirmation
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "sellerConfirm", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Verify the escrow belongs to this seller
         cur.execute("SELECT status FROM escrows WHERE id = %s AND seller_id = %s;", (escrow_id, user["id"]))
         row = cur.fetchone()
@@ -119,15 +128,20 @@ def handler(event, context):
             FROM escrows WHERE id = %s;
         """, (escrow_id,))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Emailed by the notification relay once this commits
+        notifications.enqueue(cur, "escrow_confirmed", escrow_id)
 
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({"message": "Escrow confirmed successfully", "escrow_id": escrow_id, "status": "confirmed"})
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("DB error:", e)
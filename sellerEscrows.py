@@ -3,6 +3,8 @@ import json
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from http_cache import version_etag, etag_matches, not_modified
+from escrow_summary import summary_version
 
 def handler(event, context):
     """
@@ -51,6 +53,13 @@ def handler(event, context):
         
         seller_id = user['id']
         
+        # Skip the list query entirely if the client already has this version
+        etag = version_etag("sellerEscrows", seller_id, summary_version(cur, seller_id))
+        if etag_matches(event, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+
         # Get all escrows for this seller
         cur.execute("""
             SELECT 
@@ -84,7 +93,8 @@ def handler(event, context):
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Access-Control-Allow-Origin': '*',
+                'ETag': etag
             },
             'body': json.dumps(escrows)
         }
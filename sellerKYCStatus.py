@@ -2,6 +2,7 @@ import json
 import os
 import psycopg2
 import datetime
+import kyc_status
 
 def handler(event, context):
     """
@@ -75,16 +76,18 @@ def handler(event, context):
 
     # Get KYC status
     try:
-        # Get most recent KYC submission for this seller
-        cur.execute("""
-            SELECT id, kyc_type, status, admin_note, submitted_at, reviewed_at
-            FROM kyc_submissions
-            WHERE user_id = %s
-            ORDER BY submitted_at DESC
-            LIMIT 1;
-        """, (user["id"],))
-
-        row = cur.fetchone()
+        # Get most recent KYC submission for this seller (users.latest_kyc_id,
+        # kept current by triggers on kyc_submissions and cached by
+        # kyc_status); the submission itself is read fresh by primary key
+        _, latest_kyc_id = kyc_status.get_kyc_status(cur, user["id"])
+        row = None
+        if latest_kyc_id is not None:
+            cur.execute("""
+                SELECT id, kyc_type, status, admin_note, submitted_at, reviewed_at
+                FROM kyc_submissions
+                WHERE id = %s;
+            """, (latest_kyc_id,))
+            row = cur.fetchone()
         cur.close()
         conn.close()
 
@@ -3,6 +3,8 @@ import os
 import psycopg2
 import datetime
 from decimal import Decimal
+from http_cache import version_etag, etag_matches, not_modified
+from escrow_summary import summary_version
 
 def handler(event, context):
     """
@@ -76,6 +78,21 @@ def handler(event, context):
             "body": json.dumps({"error": "Token validation failed", "details": str(e)})
         }
 
+    # Skip the list query entirely if the client already has this version
+    try:
+        etag = version_etag("sellerPendingEscrows", user_id, summary_version(cur, user_id))
+        if etag_matches(event, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to get pending escrows", "details": str(e)})
+        }
+
     # Get seller's pending escrows
     try:
         cur.execute("""
@@ -105,6 +122,7 @@ def handler(event, context):
 
         return {
             "statusCode": 200,
+            "headers": {"ETag": etag},
             "body": json.dumps({
                 "escrows": escrows_list
             })
@@ -2,6 +2,8 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
+import notifications
 
 def handler(event, context):
     """
@@ -92,6 +94,13 @@ def handler(event, context):
 
     # Process seller rejection
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "sellerReject", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Verify the escrow belongs to this seller and is not already confirmed/rejected
         cur.execute("SELECT status FROM escrows WHERE id = %s AND seller_id = %s;", (escrow_id, user["id"]))
         row = cur.fetchone()
@@ -121,11 +130,10 @@ def handler(event, context):
             VALUES (%s, 'reject', %s);
         """, (escrow_id, f"Seller rejected escrow: {reason}"))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Emailed by the notification relay once this commits
+        notifications.enqueue(cur, "escrow_rejected", escrow_id, {"reason": reason})
 
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({
@@ -134,6 +142,12 @@ def handler(event, context):
                 "status": "rejected"
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("DB error:", e)
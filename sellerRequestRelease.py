@@ -2,6 +2,7 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
 
 def handler(event, context):
     """
@@ -93,6 +94,13 @@ def handler(event, context):
 
     # Process release request
     try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "sellerRequestRelease", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Verify escrow belongs to seller and has been delivered
         cur.execute("SELECT status FROM escrows WHERE id = %s AND seller_id = %s;", (escrow_id, user["id"]))
         row = cur.fetchone()
@@ -122,11 +130,7 @@ def handler(event, context):
             VALUES (%s, 'release_request', %s);
         """, (escrow_id, note or "Seller requested payment release"))
 
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({
@@ -134,6 +138,12 @@ def handler(event, context):
                 "status": "release_requested"
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("DB error:", e)
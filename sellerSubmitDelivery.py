@@ -2,11 +2,18 @@ import os
 import json
 import psycopg2
 import datetime
-import base64
+import idempotency
+import notifications
+from uploads import UploadError, is_multipart, read_multipart, read_json_attachments
+
+# Attachments are streamed from the request body (see uploads.py)
+STREAM_REQUEST_BODY = True
 
 def handler(event, context):
     """
     POST /.netlify/functions/sellerSubmitDelivery
+    Content-Type: multipart/form-data (fields escrowId, deliveryTerms,
+    deliverableContent plus one file part per attachment), or
     Content-Type: application/json
     Body: {
         "escrowId": 123,
@@ -83,17 +90,27 @@ def handler(event, context):
         conn.close()
         return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
 
-    # Parse request body
+    # Parse request body. Attachments (multipart parts or base64 strings in
+    # JSON) are streamed to storage as they arrive
+    stored_attachments = []
     try:
-        body = json.loads(event.get("body") or "{}")
+        # Don't hold a transaction open while the upload streams in
+        conn.rollback()
+        if is_multipart(event):
+            body, stored_attachments = read_multipart(event)
+        else:
+            body, stored_attachments = read_json_attachments(event)
         escrow_id = body.get("escrowId")
         delivery_terms = body.get("deliveryTerms", "")
         deliverable_content = body.get("deliverableContent", "")
-        attachments = body.get("attachments", [])
         if not escrow_id:
             cur.close()
             conn.close()
             return {"statusCode": 400, "body": json.dumps({"error": "escrowId is required"})}
+    except UploadError as e:
+        cur.close()
+        conn.close()
+        return {"statusCode": e.status_code, "body": json.dumps({"error": e.message})}
     except Exception:
         cur.close()
         conn.close()
@@ -101,6 +118,16 @@ def handler(event, context):
 
     # Process delivery submission
     try:
+        # A retried request gets the stored response instead of running again.
+        # The body was streamed, so the request is identified by its
+        # fields and the uploaded files' hashes
+        idem, replay = idempotency.begin(cur, event, "sellerSubmitDelivery", user["id"],
+            fingerprint=[body, [a["sha256"] for a in stored_attachments]])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Verify the escrow belongs to this seller
         cur.execute("SELECT id, status FROM escrows WHERE id = %s AND seller_id = %s;", (escrow_id, user["id"]))
         escrow = cur.fetchone()
@@ -126,21 +153,13 @@ def handler(event, context):
             WHERE id = %s;
         """, (delivery_terms, deliverable_content, datetime.datetime.utcnow(), datetime.datetime.utcnow(), escrow_id))
 
-        # Insert attachments if any
-        for file in attachments:
-            filename = file.get("filename")
-            content_b64 = file.get("content")
-            if not filename or not content_b64:
-                continue
-            # Save to /tmp temporarily (Netlify runtime)
-            path = f"/tmp/{filename}"
-            with open(path, "wb") as f:
-                f.write(base64.b64decode(content_b64))
-            # Record file metadata
+        # Record file metadata
+        for stored in stored_attachments:
             cur.execute("""
-                INSERT INTO escrow_files (escrow_id, file_name, purpose, uploaded_at)
-                VALUES (%s, %s, 'delivery', %s);
-            """, (escrow_id, filename, datetime.datetime.utcnow()))
+                INSERT INTO escrow_files (escrow_id, file_name, purpose, uploaded_at, sha256, size_bytes, mime_type)
+                VALUES (%s, %s, 'delivery', %s, %s, %s, %s);
+            """, (escrow_id, stored["filename"], datetime.datetime.utcnow(),
+                  stored["sha256"], stored["size"], stored["content_type"]))
 
         # Record transaction
         cur.execute("""
@@ -148,15 +167,20 @@ def handler(event, context):
             VALUES (%s, 'delivery', 'Seller submitted delivery');
         """, (escrow_id,))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Emailed by the notification relay once this commits
+        notifications.enqueue(cur, "delivery_submitted", escrow_id)
 
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({"message": "Delivery submitted successfully", "status": "delivered"})
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("delivery error:", e)
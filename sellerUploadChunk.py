@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import psycopg2
+import datetime
+from uploads import UploadError, chunk_size_at, missing_offsets, read_raw_attachment
+
+# Chunks are streamed from the request body (see uploads.py)
+STREAM_REQUEST_BODY = True
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def handler(event, context):
+    """
+    PUT /.netlify/functions/sellerUploadChunk?upload_id=<id>&offset=<byte offset>
+    Content-Type: application/octet-stream
+    X-Chunk-SHA256: <hex digest of this chunk>   (optional)
+    Body: the raw bytes of one chunk of a sellerUploadSession upload.
+    Offsets are multiples of the session's chunk_size; resending a chunk
+    replaces it. Returns the offsets still missing.
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Connect to Neon DB using DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role, u.name, u.email
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role, name, email = user_result
+        user = {"id": user_id, "role": role, "name": name, "email": email}
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Check if user is seller
+    if user["role"] != "seller":
+        cur.close()
+        conn.close()
+        return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
+
+    # Validate parameters
+    params = event.get("queryStringParameters") or {}
+    upload_id = params.get("upload_id")
+    offset = params.get("offset", "")
+    if not upload_id or not offset.isdigit():
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "upload_id and offset are required"})}
+    offset = int(offset)
+
+    expected_sha256 = (headers.get("x-chunk-sha256") or headers.get("X-Chunk-SHA256") or "").strip().lower()
+    if expected_sha256 and not SHA256_RE.match(expected_sha256):
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "X-Chunk-SHA256 must be a hex SHA-256 digest"})}
+
+    try:
+        cur.execute("""
+            SELECT total_size, chunk_size, status, expires_at
+            FROM upload_sessions
+            WHERE id = %s AND user_id = %s;
+        """, (upload_id, user["id"]))
+        session = cur.fetchone()
+    except Exception as e:
+        print("DB error:", e)
+        try:
+            cur.close()
+            conn.close()
+        except:
+            pass
+        return {"statusCode": 500, "body": json.dumps({"error": "Database query failed", "details": str(e)})}
+
+    if not session:
+        cur.close()
+        conn.close()
+        return {"statusCode": 404, "body": json.dumps({"error": "Upload session not found"})}
+
+    total_size, chunk_size, status, expires_at = session
+    if status != "open" or expires_at < datetime.datetime.utcnow():
+        cur.close()
+        conn.close()
+        return {"statusCode": 409, "body": json.dumps({"error": f"Upload session is {'expired' if status == 'open' else status}"})}
+
+    expected_size = chunk_size_at(offset, total_size, chunk_size)
+    if offset % chunk_size or expected_size <= 0:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": f"offset must be a multiple of {chunk_size} below {total_size}"})}
+
+    # Stream the chunk to the blob store
+    try:
+        # Don't hold a transaction open while the chunk streams in
+        conn.rollback()
+        stored = read_raw_attachment(event, expected_size)
+    except UploadError as e:
+        cur.close()
+        conn.close()
+        return {"statusCode": e.status_code, "body": json.dumps({"error": e.message})}
+
+    if stored["size"] != expected_size:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": f"Chunk at offset {offset} must be {expected_size} bytes"})}
+    if expected_sha256 and stored["sha256"] != expected_sha256:
+        cur.close()
+        conn.close()
+        return {"statusCode": 422, "body": json.dumps({"error": "Chunk checksum mismatch"})}
+
+    # Record the chunk
+    try:
+        cur.execute("""
+            INSERT INTO upload_session_chunks (session_id, chunk_offset, size, sha256)
+            SELECT id, %s, %s, %s FROM upload_sessions WHERE id = %s AND status = 'open'
+            ON CONFLICT (session_id, chunk_offset)
+            DO UPDATE SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, received_at = (now() AT TIME ZONE 'utc');
+        """, (offset, stored["size"], stored["sha256"], upload_id))
+        if cur.rowcount == 0:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return {"statusCode": 409, "body": json.dumps({"error": "Upload session is no longer open"})}
+
+        cur.execute("SELECT chunk_offset FROM upload_session_chunks WHERE session_id = %s;", (upload_id,))
+        received = [r[0] for r in cur.fetchall()]
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({
+                "upload_id": upload_id,
+                "offset": offset,
+                "size": stored["size"],
+                "sha256": stored["sha256"],
+                "missing_offsets": missing_offsets(total_size, chunk_size, received)
+            })
+        }
+
+    except Exception as e:
+        print("DB error:", e)
+        try:
+            cur.close()
+            conn.close()
+        except:
+            pass
+        return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
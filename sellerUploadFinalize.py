@@ -0,0 +1,241 @@
+import os
+import json
+import psycopg2
+import datetime
+import idempotency
+from blob_store import concatenate
+from uploads import UPLOAD_SESSION_ESCROW_STATUSES, missing_offsets
+
+def handler(event, context):
+    """
+    POST /.netlify/functions/sellerUploadFinalize
+    Body: { "upload_id": "<id from sellerUploadSession>" }
+    Assembles the received chunks into one file, checks it against the
+    session's sha256 and attaches it to the escrow as a delivery file.
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Connect to Neon DB using DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role, u.name, u.email
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role, name, email = user_result
+        user = {"id": user_id, "role": role, "name": name, "email": email}
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Check if user is seller
+    if user["role"] != "seller":
+        cur.close()
+        conn.close()
+        return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
+
+    # Parse request body
+    try:
+        body = json.loads(event.get("body") or "{}")
+        upload_id = body.get("upload_id")
+        if not upload_id:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": "upload_id is required"})}
+    except Exception:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
+
+    # Finalize upload. Assembling and hashing the file can take minutes for
+    # a large upload, so it runs with no transaction open; the session is
+    # only locked afterwards, to re-check it and attach the file
+    try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "sellerUploadFinalize", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
+        cur.execute("""
+            SELECT escrow_id, file_name, mime_type, total_size, chunk_size, sha256, status, escrow_file_id
+            FROM upload_sessions
+            WHERE id = %s AND user_id = %s;
+        """, (upload_id, user["id"]))
+        session = cur.fetchone()
+        if not session:
+            cur.close()
+            conn.close()
+            return {"statusCode": 404, "body": json.dumps({"error": "Upload session not found"})}
+
+        escrow_id, file_name, mime_type, total_size, chunk_size, sha256, status, escrow_file_id = session
+        if status == "complete":
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"message": "Upload already finalized", "file_id": escrow_file_id, "sha256": sha256})
+            }
+
+        cur.execute("""
+            SELECT chunk_offset, size, sha256
+            FROM upload_session_chunks
+            WHERE session_id = %s
+            ORDER BY chunk_offset;
+        """, (upload_id,))
+        chunks = cur.fetchall()
+        conn.rollback()
+
+        # Chunks must tile the file exactly
+        position = 0
+        for chunk_offset, size, _ in chunks:
+            if chunk_offset != position:
+                break
+            position += size
+        if position != total_size:
+            missing = missing_offsets(total_size, chunk_size, [c[0] for c in chunks])
+            cur.close()
+            conn.close()
+            return {"statusCode": 409, "body": json.dumps({"error": "Upload is incomplete", "missing_offsets": missing})}
+
+        try:
+            digest, size, _ = concatenate([c[2] for c in chunks])
+        except FileNotFoundError:
+            cur.close()
+            conn.close()
+            return {"statusCode": 409, "body": json.dumps({"error": "Stored chunks are missing, upload the file again"})}
+
+        if digest != sha256 or size != total_size:
+            cur.close()
+            conn.close()
+            return {"statusCode": 422, "body": json.dumps({"error": "Checksum mismatch", "sha256": digest})}
+
+        # The key claimed above was rolled back with the reads; claim it
+        # again, lock the session so concurrent finalize calls attach the file
+        # once, then make sure nothing changed while the file was assembled
+        idem, replay = idempotency.begin(cur, event, "sellerUploadFinalize", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
+        cur.execute("""
+            SELECT status, escrow_file_id
+            FROM upload_sessions
+            WHERE id = %s AND user_id = %s
+            FOR UPDATE;
+        """, (upload_id, user["id"]))
+        status, escrow_file_id = cur.fetchone()
+        if status == "complete":
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"message": "Upload already finalized", "file_id": escrow_file_id, "sha256": sha256})
+            }
+
+        cur.execute("""
+            SELECT chunk_offset, size, sha256
+            FROM upload_session_chunks
+            WHERE session_id = %s
+            ORDER BY chunk_offset;
+        """, (upload_id,))
+        if cur.fetchall() != chunks:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return {"statusCode": 409, "body": json.dumps({"error": "Upload changed while it was being finalized, try again"})}
+
+        # The escrow may have moved on (released, cancelled) meanwhile
+        cur.execute("SELECT status FROM escrows WHERE id = %s FOR SHARE;", (escrow_id,))
+        escrow_status = cur.fetchone()[0]
+        if escrow_status not in UPLOAD_SESSION_ESCROW_STATUSES:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": f"Cannot upload delivery files in status {escrow_status}"})}
+
+        cur.execute("""
+            INSERT INTO escrow_files (escrow_id, file_name, purpose, uploaded_at, sha256, size_bytes, mime_type)
+            VALUES (%s, %s, 'delivery', %s, %s, %s, %s)
+            RETURNING id;
+        """, (escrow_id, file_name, datetime.datetime.utcnow(), digest, size, mime_type))
+        escrow_file_id = cur.fetchone()[0]
+
+        # The assembled blob is referenced now; the chunk blobs become
+        # unreferenced and are collected by blob_store gc
+        cur.execute("""
+            UPDATE upload_sessions
+            SET status = 'complete', escrow_file_id = %s
+            WHERE id = %s;
+        """, (escrow_file_id, upload_id))
+        cur.execute("DELETE FROM upload_session_chunks WHERE session_id = %s;", (upload_id,))
+
+        response = {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": "Upload finalized", "file_id": escrow_file_id, "sha256": digest, "size": size})
+        }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
+
+    except Exception as e:
+        print("DB error:", e)
+        try:
+            cur.close()
+            conn.close()
+        except:
+            pass
+        return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
@@ -2,12 +2,18 @@ import os
 import json
 import psycopg2
 import datetime
-import base64
+import idempotency
+import kyc_status
+from uploads import UploadError, is_multipart, read_multipart, read_json_attachments
+
+# Attachments are streamed from the request body (see uploads.py)
+STREAM_REQUEST_BODY = True
 
 def handler(event, context):
     """
     POST /.netlify/functions/sellerUploadKYC
-    Input JSON example:
+    Accepts multipart/form-data (field kyc_type plus one file part per
+    document), or JSON, e.g.:
     {
         "kyc_type": "ID Verification",
         "attachments": [
@@ -81,15 +87,25 @@ def handler(event, context):
         conn.close()
         return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
 
-    # Parse request body
+    # Parse request body. Documents (multipart parts or base64 strings in
+    # JSON) are streamed to storage as they arrive
+    stored_attachments = []
     try:
-        body = json.loads(event.get("body") or "{}")
+        # Don't hold a transaction open while the upload streams in
+        conn.rollback()
+        if is_multipart(event):
+            body, stored_attachments = read_multipart(event)
+        else:
+            body, stored_attachments = read_json_attachments(event)
         kyc_type = body.get("kyc_type", "General Verification")
-        attachments = body.get("attachments", [])
-        if not attachments:
+        if not stored_attachments:
             cur.close()
             conn.close()
             return {"statusCode": 400, "body": json.dumps({"error": "No attachments provided"})}
+    except UploadError as e:
+        cur.close()
+        conn.close()
+        return {"statusCode": e.status_code, "body": json.dumps({"error": e.message})}
     except Exception:
         cur.close()
         conn.close()
@@ -97,6 +113,16 @@ def handler(event, context):
 
     # Process KYC upload
     try:
+        # A retried request gets the stored response instead of a second submission.
+        # The body was streamed, so the request is identified by its
+        # fields and the uploaded files' hashes
+        idem, replay = idempotency.begin(cur, event, "sellerUploadKYC", user["id"],
+            fingerprint=[body, [a["sha256"] for a in stored_attachments]])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
         # Create a KYC submission record
         cur.execute("""
             INSERT INTO kyc_submissions (user_id, kyc_type, status, submitted_at)
@@ -105,27 +131,15 @@ def handler(event, context):
         """, (user["id"], kyc_type, datetime.datetime.utcnow()))
         kyc_id = cur.fetchone()[0]
 
-        # Save each uploaded file
-        for file in attachments:
-            filename = file.get("filename")
-            content_b64 = file.get("content")
-            if not filename or not content_b64:
-                continue
-            path = f"/tmp/{filename}"
-            with open(path, "wb") as f:
-                f.write(base64.b64decode(content_b64))
-
-            # Store record in DB
+        # Store records in DB
+        for stored in stored_attachments:
             cur.execute("""
-                INSERT INTO escrow_files (escrow_id, file_name, purpose, uploaded_at)
-                VALUES (NULL, %s, 'kyc', %s);
-            """, (filename, datetime.datetime.utcnow()))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+                INSERT INTO escrow_files (escrow_id, kyc_submission_id, file_name, purpose, uploaded_at, sha256, size_bytes, mime_type)
+                VALUES (NULL, %s, %s, 'kyc', %s, %s, %s, %s);
+            """, (kyc_id, stored["filename"], datetime.datetime.utcnow(),
+                  stored["sha256"], stored["size"], stored["content_type"]))
 
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({
@@ -134,6 +148,13 @@ def handler(event, context):
                 "status": "pending"
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        kyc_status.invalidate(user["id"])
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("KYC upload error:", e)
@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import psycopg2
+import datetime
+import idempotency
+import secrets
+import mimetypes
+from uploads import (UPLOAD_SESSION_MAX_BYTES, UPLOAD_SESSION_CHUNK_SIZE, UPLOAD_SESSION_MIN_CHUNK_SIZE,
+                     UPLOAD_SESSION_MAX_CHUNK_SIZE, UPLOAD_SESSION_TTL_HOURS, UPLOAD_SESSION_ESCROW_STATUSES,
+                     missing_offsets)
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def handler(event, context):
+    """
+    POST /.netlify/functions/sellerUploadSession
+    Starts a resumable delivery upload:
+    {
+        "escrowId": 123,
+        "filename": "delivery.zip",
+        "size": 734003200,
+        "sha256": "<hex digest of the whole file>",
+        "chunkSize": 8388608            (optional)
+    }
+
+    GET /.netlify/functions/sellerUploadSession?upload_id=<id>
+    Returns the session and the chunk offsets still missing, so a client
+    that lost its connection resends only those (PUT sellerUploadChunk),
+    then calls sellerUploadFinalize.
+    """
+
+    # Get token from Authorization header
+    headers = event.get('headers', {})
+    auth_header = headers.get('authorization', '') or headers.get('Authorization', '')
+
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {
+            "statusCode": 401,
+            "body": json.dumps({"error": "Missing or invalid authorization header"})
+        }
+
+    token = auth_header.replace('Bearer ', '').strip()
+
+    # Connect to Neon DB using DATABASE_URL
+    try:
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            return {
+                "statusCode": 500,
+                "body": json.dumps({"error": "DATABASE_URL environment variable not set"})
+            }
+
+        conn = psycopg2.connect(database_url)
+        cur = conn.cursor()
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Database connection failed", "details": str(e)})
+        }
+
+    # Validate token and get user info
+    try:
+        cur.execute("""
+            SELECT u.id, u.role, u.name, u.email
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > %s
+        """, (token, datetime.datetime.utcnow()))
+
+        user_result = cur.fetchone()
+        if not user_result:
+            cur.close()
+            conn.close()
+            return {
+                "statusCode": 401,
+                "body": json.dumps({"error": "Invalid or expired token"})
+            }
+
+        user_id, role, name, email = user_result
+        user = {"id": user_id, "role": role, "name": name, "email": email}
+
+    except Exception as e:
+        cur.close()
+        conn.close()
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Token validation failed", "details": str(e)})
+        }
+
+    # Check if user is seller
+    if user["role"] != "seller":
+        cur.close()
+        conn.close()
+        return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
+
+    # Session status
+    if event.get("httpMethod") == "GET":
+        upload_id = (event.get("queryStringParameters") or {}).get("upload_id")
+        if not upload_id:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": "upload_id is required"})}
+
+        try:
+            cur.execute("""
+                SELECT id, escrow_id, file_name, total_size, chunk_size, sha256, status, escrow_file_id, expires_at
+                FROM upload_sessions
+                WHERE id = %s AND user_id = %s;
+            """, (upload_id, user["id"]))
+            row = cur.fetchone()
+            if not row:
+                cur.close()
+                conn.close()
+                return {"statusCode": 404, "body": json.dumps({"error": "Upload session not found"})}
+
+            cur.execute("SELECT chunk_offset FROM upload_session_chunks WHERE session_id = %s;", (upload_id,))
+            received = [r[0] for r in cur.fetchall()]
+            cur.close()
+            conn.close()
+
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({
+                    "upload_id": row[0],
+                    "escrow_id": row[1],
+                    "filename": row[2],
+                    "size": row[3],
+                    "chunk_size": row[4],
+                    "sha256": row[5],
+                    "status": row[6],
+                    "escrow_file_id": row[7],
+                    "expires_at": row[8].isoformat(),
+                    "missing_offsets": missing_offsets(row[3], row[4], received) if row[6] == "open" else []
+                })
+            }
+
+        except Exception as e:
+            print("DB error:", e)
+            try:
+                cur.close()
+                conn.close()
+            except:
+                pass
+            return {"statusCode": 500, "body": json.dumps({"error": "Database query failed", "details": str(e)})}
+
+    # Parse request body
+    try:
+        body = json.loads(event.get("body") or "{}")
+        escrow_id = body.get("escrowId")
+        filename = (body.get("filename") or "").strip()
+        size = body.get("size")
+        sha256 = (body.get("sha256") or "").strip().lower()
+        chunk_size = body.get("chunkSize") or UPLOAD_SESSION_CHUNK_SIZE
+        if not escrow_id or not filename or not sha256 or size is None:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": "escrowId, filename, size and sha256 are required"})}
+    except Exception:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
+
+    if not SHA256_RE.match(sha256):
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": "sha256 must be a hex SHA-256 digest"})}
+    if not isinstance(size, int) or size <= 0 or size > UPLOAD_SESSION_MAX_BYTES:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": f"size must be between 1 and {UPLOAD_SESSION_MAX_BYTES} bytes"})}
+    if not isinstance(chunk_size, int) or not UPLOAD_SESSION_MIN_CHUNK_SIZE <= chunk_size <= UPLOAD_SESSION_MAX_CHUNK_SIZE:
+        cur.close()
+        conn.close()
+        return {"statusCode": 400, "body": json.dumps({"error": f"chunkSize must be between {UPLOAD_SESSION_MIN_CHUNK_SIZE} and {UPLOAD_SESSION_MAX_CHUNK_SIZE} bytes"})}
+
+    # Create upload session
+    try:
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "sellerUploadSession", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
+
+        # Verify the escrow belongs to this seller and can take delivery files
+        cur.execute("SELECT status FROM escrows WHERE id = %s AND seller_id = %s;", (escrow_id, user["id"]))
+        escrow = cur.fetchone()
+        if not escrow:
+            cur.close()
+            conn.close()
+            return {"statusCode": 404, "body": json.dumps({"error": "Escrow not found for this seller"})}
+
+        current_status = escrow[0]
+        if current_status not in UPLOAD_SESSION_ESCROW_STATUSES:
+            cur.close()
+            conn.close()
+            return {"statusCode": 400, "body": json.dumps({"error": f"Cannot upload delivery files in status {current_status}"})}
+
+        upload_id = secrets.token_hex(16)
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+        cur.execute("""
+            INSERT INTO upload_sessions (id, user_id, escrow_id, file_name, mime_type, total_size, chunk_size, sha256, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+        """, (upload_id, user["id"], escrow_id, filename, mimetypes.guess_type(filename)[0],
+              size, chunk_size, sha256, expires_at))
+
+        response = {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({
+                "upload_id": upload_id,
+                "chunk_size": chunk_size,
+                "expires_at": expires_at.isoformat(),
+                "missing_offsets": missing_offsets(size, chunk_size, [])
+            })
+        }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
+
+    except Exception as e:
+        print("DB error:", e)
+        try:
+            cur.close()
+            conn.close()
+        except:
+            pass
+        return {"statusCode": 500, "body": json.dumps({"error": "Database operation failed", "details": str(e)})}
@@ -0,0 +1,159 @@
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seller email -> user id for escrow creation (createEscrow, bulk_escrows).
+# Most escrows go to the same few thousand sellers, so lookups are served
+# from a bounded per-worker LRU. Unknown emails are cached too (as None),
+# for a shorter time, so retries against a typo don't all reach the
+# database. Entries are dropped on NOTIFY seller_directory_changed, sent by
+# a trigger when a user is created or their email or role changes (see
+# migrations/013_seller_directory_notify.sql); the TTLs cover connections
+# that cannot LISTEN, e.g. through a pooler.
+
+CACHE_TTL_SECONDS = int(os.getenv("SELLER_DIRECTORY_TTL", "300"))
+NEGATIVE_TTL_SECONDS = int(os.getenv("SELLER_DIRECTORY_NEGATIVE_TTL", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("SELLER_DIRECTORY_CACHE_SIZE", "10000"))
+NOTIFY_CHANNEL = "seller_directory_changed"
+
+metrics.describe("seller_directory_hits_total", "Seller email lookups served from the cache")
+metrics.describe("seller_directory_misses_total", "Seller email lookups that read users")
+metrics.describe("seller_directory_entries", "Seller emails cached, including unknown ones")
+metrics.describe("seller_directory_hit_ratio", "Share of seller email lookups served from the cache")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Bumped by every invalidation, so a lookup that raced with one doesn't
+# cache what it read
+_generation = 0
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _update_gauges():
+    hits = metrics.get("seller_directory_hits_total")
+    total = hits + metrics.get("seller_directory_misses_total")
+    metrics.set_gauge("seller_directory_entries", len(_cache))
+    metrics.set_gauge("seller_directory_hit_ratio", round(hits / total, 4) if total else 0)
+
+
+def lookup_many(cur, emails):
+    """{email: seller id} for the given emails; unknown emails and non-sellers are left out."""
+    _ensure_listener()
+    now = time.monotonic()
+    emails = set(emails)
+    found = {}
+    missing = []
+    with _cache_lock:
+        for email in emails:
+            entry = _cache.get(email)
+            if entry is not None and entry[0] > now:
+                _cache.move_to_end(email)
+                if entry[1] is not None:
+                    found[email] = entry[1]
+            else:
+                missing.append(email)
+        generation = _generation
+    metrics.inc("seller_directory_hits_total", len(emails) - len(missing))
+
+    if missing:
+        metrics.inc("seller_directory_misses_total", len(missing))
+        cur.execute("""
+            SELECT email, id FROM users
+            WHERE email = ANY(%s) AND role = 'seller';
+        """, (missing,))
+        loaded = dict(cur.fetchall())
+        found.update(loaded)
+
+        with _cache_lock:
+            if generation == _generation:
+                for email in missing:
+                    seller_id = loaded.get(email)
+                    ttl = CACHE_TTL_SECONDS if seller_id is not None else NEGATIVE_TTL_SECONDS
+                    _cache[email] = (now + ttl, seller_id)
+                    _cache.move_to_end(email)
+                while len(_cache) > CACHE_MAX_ENTRIES:
+                    _cache.popitem(last=False)
+
+    _update_gauges()
+    return found
+
+
+def lookup(cur, email):
+    """The seller's user id, or None if no seller has that email."""
+    return lookup_many(cur, [email]).get(email)
+
+
+def invalidate(*emails):
+    """Drop cached entries, e.g. after creating a user."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        for email in emails:
+            _cache.pop(email, None)
+    _update_gauges()
+
+
+def clear():
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        _cache.clear()
+    _update_gauges()
+
+
+def _listen_forever(database_url):
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(database_url)
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL};")
+            # Changes made while we weren't listening are unknown
+            clear()
+            backoff = 1
+            while True:
+                readable, _, _ = select.select([conn], [], [], 60)
+                if readable:
+                    conn.poll()
+                    emails = [n.payload for n in conn.notifies]
+                    conn.notifies.clear()
+                    if emails:
+                        invalidate(*emails)
+        except Exception as e:
+            logger.warning("seller directory listener failed: %s", e)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        time.sleep(backoff)
+        backoff = min(backoff * 2, CACHE_TTL_SECONDS)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is not None:
+            return
+        database_url = os.getenv("DATABASE_URL")
+        if not database_url:
+            _listener = False
+            return
+        _listener = threading.Thread(target=_listen_forever, args=(database_url,),
+                                     name="seller-directory-listen", daemon=True)
+        _listener.start()
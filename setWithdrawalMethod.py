@@ -2,6 +2,8 @@ import json
 import os
 import psycopg2
 import datetime
+import idempotency
+import withdrawal_methods
 
 def handler(event, context):
     """
@@ -14,6 +16,8 @@ def handler(event, context):
         "note": "Send only USDT on TRC20"
       }
     }
+    method_code must be registered in withdrawal_methods.py, which also
+    defines and validates the details fields of each method.
     """
 
     # Get token from Authorization header
@@ -28,6 +32,21 @@ def handler(event, context):
     
     token = auth_header.replace('Bearer ', '').strip()
 
+    # Parse and validate request body before touching the database
+    try:
+        body = json.loads(event.get("body") or "{}")
+        method_code = body.get("method_code")
+        details = body.get("details")
+        if not method_code or not details:
+            return {"statusCode": 400, "body": json.dumps({"error": "method_code and details are required"})}
+    except Exception:
+        return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
+
+    try:
+        method_code, details = withdrawal_methods.validate(method_code, details)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
     # Connect to Neon DB using DATABASE_URL
     try:
         database_url = os.getenv("DATABASE_URL")
@@ -80,43 +99,27 @@ def handler(event, context):
         conn.close()
         return {"statusCode": 403, "body": json.dumps({"error": "Only sellers allowed"})}
 
-    # Parse request body
-    try:
-        body = json.loads(event.get("body") or "{}")
-        method_code = body.get("method_code")
-        details = body.get("details")
-        if not method_code or not details:
-            return {"statusCode": 400, "body": json.dumps({"error": "method_code and details are required"})}
-    except Exception:
-        return {"statusCode": 400, "body": json.dumps({"error": "Invalid JSON input"})}
-
     # Set withdrawal method
     try:
-        # Check if user already has a method set
-        cur.execute("SELECT id FROM seller_withdrawal_methods WHERE user_id = %s;", (user["id"],))
-        existing = cur.fetchone()
-
-        if existing:
-            # Update existing record
-            cur.execute("""
-                UPDATE seller_withdrawal_methods
-                SET method_code = %s,
-                    details = %s::jsonb,
-                    updated_at = %s
-                WHERE user_id = %s;
-            """, (method_code, json.dumps(details), datetime.datetime.utcnow(), user["id"]))
-        else:
-            # Insert new record
-            cur.execute("""
-                INSERT INTO seller_withdrawal_methods (user_id, method_code, details, created_at)
-                VALUES (%s, %s, %s::jsonb, %s);
-            """, (user["id"], method_code, json.dumps(details), datetime.datetime.utcnow()))
+        # A retried request gets the stored response instead of running again
+        idem, replay = idempotency.begin(cur, event, "setWithdrawalMethod", user["id"])
+        if replay:
+            cur.close()
+            conn.close()
+            return replay
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # One row per seller (unique index on user_id)
+        now = datetime.datetime.utcnow()
+        cur.execute("""
+            INSERT INTO seller_withdrawal_methods (user_id, method_code, details, created_at)
+            VALUES (%s, %s, %s::jsonb, %s)
+            ON CONFLICT (user_id) DO UPDATE
+            SET method_code = EXCLUDED.method_code,
+                details = EXCLUDED.details,
+                updated_at = %s;
+        """, (user["id"], method_code, json.dumps(details), now, now))
 
-        return {
+        response = {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({
@@ -124,6 +127,12 @@ def handler(event, context):
                 "method_code": method_code
             })
         }
+        idempotency.finish(cur, idem, response)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return response
 
     except Exception as e:
         print("DB error:", e)
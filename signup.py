@@ -4,6 +4,7 @@ import psycopg2
 import hashlib
 import secrets
 import datetime
+import seller_directory
 
 def handler(event, context):
     """
@@ -78,6 +79,8 @@ def handler(event, context):
         
         user_id = cur.fetchone()[0]
         conn.commit()
+        # The email may be cached as unknown
+        seller_directory.invalidate(email)
         cur.close()
         conn.close()
 
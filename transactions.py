@@ -0,0 +1,228 @@
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Double-entry ledger over ledger_entries (see migrations/011_ledger.sql).
+# Money movements only ever append a balanced posting, so concurrent
+# releases to one seller do not contend on a balance row; balances are read
+# as snapshot + entries since the snapshot's horizon.
+#
+#     python transactions.py snapshot [--loop SECONDS]
+#     python transactions.py check
+
+KIND_OPENING = "opening"
+KIND_HOLD = "hold"
+KIND_RELEASE = "release"
+KIND_PAYOUT = "payout"
+
+EXTERNAL_DEPOSITS = "external:deposits"
+EXTERNAL_PAYOUTS = "external:payouts"
+
+
+def user_account(user_id):
+    return f"user:{user_id}"
+
+
+def escrow_account(escrow_id):
+    return f"escrow:{escrow_id}"
+
+
+# Balance of each account in accounts(account): snapshot plus the entries
+# written by transactions at or after the snapshot's horizon, read through
+# the (account, tx_id) index
+BALANCES_SQL = """
+    SELECT a.account,
+           COALESCE(s.balance, 0) + COALESCE((
+               SELECT sum(e.amount)
+               FROM ledger_entries e
+               WHERE e.account = a.account
+                 AND e.tx_id >= COALESCE(s.horizon, '0'::xid8)
+           ), 0)
+    FROM accounts a
+    LEFT JOIN ledger_snapshots s ON s.account = a.account
+"""
+
+
+def post(cur, kind, legs, escrow_id=None, payout_id=None):
+    """
+    Append one posting. legs is [(account, amount), ...] and must sum to
+    zero. Returns the posting id.
+    """
+    legs = [(account, Decimal(str(amount))) for account, amount in legs]
+    if len(legs) < 2 or sum(amount for _, amount in legs) != 0:
+        raise ValueError(f"Unbalanced {kind} posting: {legs}")
+
+    rows = execute_values(cur, """
+        WITH posting AS (SELECT nextval('ledger_posting_seq') AS id)
+        INSERT INTO ledger_entries (posting_id, account, amount, kind, escrow_id, payout_id)
+        SELECT posting.id, v.account, v.amount, v.kind, v.escrow_id, v.payout_id
+        FROM posting, (VALUES %s) AS v (account, amount, kind, escrow_id, payout_id)
+        RETURNING posting_id;
+    """, [(account, amount, kind, escrow_id, payout_id) for account, amount in legs],
+        template="(%s, %s::numeric, %s, %s::integer, %s::bigint)", fetch=True)
+    return rows[0][0]
+
+
+def hold(cur, escrow_id, amount):
+    """Buyer's funds arrive and are held for the escrow."""
+    return post(cur, KIND_HOLD, [(EXTERNAL_DEPOSITS, -amount), (escrow_account(escrow_id), amount)],
+                escrow_id=escrow_id)
+
+
+def has_hold(cur, escrow_id):
+    cur.execute("""
+        SELECT 1 FROM ledger_entries
+        WHERE escrow_id = %s AND kind = %s AND amount > 0;
+    """, (escrow_id, KIND_HOLD))
+    return cur.fetchone() is not None
+
+
+def release(cur, escrow_id, seller_id, amount):
+    """Move an escrow's held funds to the seller's balance. Append-only: no row is locked."""
+    return post(cur, KIND_RELEASE, [(escrow_account(escrow_id), -amount), (user_account(seller_id), amount)],
+                escrow_id=escrow_id)
+
+
+def balances(cur, accounts):
+    """{account: Decimal balance} for the given accounts."""
+    accounts = list(accounts)
+    if not accounts:
+        return {}
+    cur.execute(f"""
+        WITH accounts AS (SELECT unnest(%s::text[]) AS account)
+        {BALANCES_SQL};
+    """, (accounts,))
+    return dict(cur.fetchall())
+
+
+def balance(cur, account):
+    return balances(cur, [account])[account]
+
+
+def snapshot(conn):
+    """
+    Fold entries written since the last run into ledger_snapshots. The new
+    horizon is the oldest transaction still running, so every entry below
+    it is committed (or aborted) and visible to this statement; entries at
+    or above it are read as deltas. Returns the number of accounts updated.
+    """
+    cur = conn.cursor()
+    try:
+        # Serializes snapshot runs
+        cur.execute("SELECT horizon::text FROM ledger_snapshot_state WHERE id = 1 FOR UPDATE;")
+        previous = cur.fetchone()[0]
+
+        cur.execute("""
+            WITH h AS (
+                SELECT pg_snapshot_xmin(pg_current_snapshot()) AS horizon
+            ), delta AS (
+                SELECT e.account, sum(e.amount) AS amount
+                FROM ledger_entries e, h
+                WHERE e.tx_id >= %s::xid8 AND e.tx_id < h.horizon
+                GROUP BY e.account
+            ), upserted AS (
+                INSERT INTO ledger_snapshots AS s (account, balance, horizon, taken_at)
+                SELECT d.account, d.amount, h.horizon, now() AT TIME ZONE 'utc'
+                FROM delta d, h
+                ON CONFLICT (account) DO UPDATE
+                SET balance = s.balance + EXCLUDED.balance,
+                    horizon = EXCLUDED.horizon,
+                    taken_at = EXCLUDED.taken_at
+                RETURNING 1
+            )
+            UPDATE ledger_snapshot_state
+            SET horizon = h.horizon, taken_at = now() AT TIME ZONE 'utc'
+            FROM h
+            WHERE id = 1
+            RETURNING (SELECT count(*) FROM upserted);
+        """, (previous,))
+        updated = cur.fetchone()[0]
+        conn.commit()
+        return updated
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def check(conn):
+    """
+    Verify that every posting balances and that snapshot + delta equals the
+    full sum for every account. Returns a list of problems (empty if none).
+    """
+    problems = []
+    cur = conn.cursor()
+    try:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute("""
+            SELECT posting_id, sum(amount)
+            FROM ledger_entries
+            GROUP BY posting_id
+            HAVING sum(amount) <> 0;
+        """)
+        for posting_id, total in cur.fetchall():
+            problems.append(f"posting {posting_id} sums to {total}")
+
+        cur.execute(f"""
+            WITH full_sum AS (
+                SELECT account, sum(amount) AS balance FROM ledger_entries GROUP BY account
+            ), accounts AS (
+                SELECT account FROM full_sum
+            ), derived AS (
+                {BALANCES_SQL}
+            )
+            SELECT f.account, f.balance, d.balance
+            FROM full_sum f
+            JOIN derived d (account, balance) ON d.account = f.account
+            WHERE f.balance <> d.balance;
+        """)
+        for account, expected, derived in cur.fetchall():
+            problems.append(f"{account}: entries sum to {expected}, snapshot + delta gives {derived}")
+    finally:
+        cur.close()
+        conn.rollback()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ledger maintenance")
+    parser.add_argument("command", choices=["snapshot", "check"])
+    parser.add_argument("--loop", type=int, metavar="SECONDS",
+                        help="keep running, snapshotting every SECONDS")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        print("DATABASE_URL environment variable not set", file=sys.stderr)
+        return 2
+
+    if args.command == "check":
+        conn = psycopg2.connect(database_url)
+        try:
+            problems = check(conn)
+        finally:
+            conn.close()
+        for problem in problems:
+            print(problem)
+        print("OK" if not problems else f"{len(problems)} problems")
+        return 1 if problems else 0
+
+    while True:
+        conn = psycopg2.connect(database_url)
+        try:
+            print(f"Snapshotted {snapshot(conn)} accounts")
+        finally:
+            conn.close()
+        if not args.loop:
+            return 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
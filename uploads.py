@@ -0,0 +1,474 @@
+import binascii
+import io
+import json
+import mimetypes
+import os
+import re
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+from blob_store import get_blob_store
+
+# Attachment handling shared by sellerSubmitDelivery and sellerUploadKYC.
+#
+# Both functions set STREAM_REQUEST_BODY, so app.py does not buffer their
+# bodies; they get the raw request stream as event["bodyStream"] instead.
+# read_multipart() and read_json_attachments() copy each attachment to the
+# blob store in fixed-size chunks, hashing as they go, so worker memory stays
+# flat whatever the upload size.
+#
+# Stored blobs are content-addressed and may be shared with other uploads, so
+# a failed request never deletes them; blob_store.gc() sweeps any that end up
+# unreferenced.
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+MAX_FILES = 20
+MAX_FIELD_BYTES = 1024 * 1024
+
+# Resumable upload sessions (sellerUploadSession and friends)
+UPLOAD_SESSION_MAX_BYTES = int(os.getenv("UPLOAD_SESSION_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_SESSION_MIN_CHUNK_SIZE = 256 * 1024
+UPLOAD_SESSION_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = 24
+# Escrow statuses that accept delivery files
+UPLOAD_SESSION_ESCROW_STATUSES = ("confirmed", "paid", "awaiting_delivery", "delivered")
+MAX_JSON_DEPTH = 32
+
+
+class UploadError(Exception):
+    """Upload rejected; status_code is the HTTP status to return."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def _header(event, name):
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def is_multipart(event):
+    content_type = _header(event, 'content-type') or ''
+    return parse_options_header(content_type)[0] == 'multipart/form-data'
+
+
+class AttachmentWriter:
+    """
+    Streams one attachment into the blob store, enforcing the size limit as
+    bytes arrive. The filename may be set any time before commit(), since
+    JSON clients can send it after the content.
+    """
+
+    def __init__(self, filename=None, content_type=None, max_bytes=MAX_FILE_BYTES):
+        self.filename = filename
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.blob = get_blob_store().open_writer()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadError(413, f"Attachment {self.filename or ''} exceeds {self.max_bytes} bytes")
+        self.blob.write(chunk)
+
+    def commit(self):
+        sha256, size, _ = self.blob.commit()
+        content_type = self.content_type
+        if not content_type or content_type == "application/octet-stream":
+            content_type = mimetypes.guess_type(self.filename or "")[0] or "application/octet-stream"
+        return {
+            "filename": self.filename,
+            "sha256": sha256,
+            "size": size,
+            "content_type": content_type
+        }
+
+    def abort(self):
+        self.blob.abort()
+
+
+def chunk_size_at(offset, total_size, chunk_size):
+    """Expected size of the chunk starting at offset (the last one may be short)."""
+    return min(chunk_size, total_size - offset)
+
+
+def missing_offsets(total_size, chunk_size, received_offsets):
+    """Chunk offsets of a session that have not been received yet."""
+    received = set(received_offsets)
+    return [offset for offset in range(0, total_size, chunk_size) if offset not in received]
+
+
+def read_raw_attachment(event, max_bytes, filename=None, content_type=None):
+    """
+    Stream a raw (application/octet-stream) request body into the blob store,
+    e.g. one chunk of a resumable upload. Returns the stored file like
+    AttachmentWriter.commit(); raises UploadError if it exceeds max_bytes.
+    """
+    content_length = _header(event, 'content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadError(413, f"Body exceeds {max_bytes} bytes")
+
+    stream = event.get('bodyStream')
+    if stream is None:
+        raise UploadError(400, "Missing request body")
+
+    writer = AttachmentWriter(filename, content_type, max_bytes)
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        return writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+
+
+def read_multipart(event, max_file_bytes=MAX_FILE_BYTES, max_request_bytes=MAX_REQUEST_BYTES):
+    """
+    Stream a multipart/form-data body. Returns (fields, attachments) where
+    fields maps form field names to strings and attachments is a list of
+    stored files as returned by AttachmentWriter.commit(). Size limits are
+    enforced as bytes arrive; errors are raised as UploadError.
+    """
+    _, options = parse_options_header(_header(event, 'content-type') or '')
+    boundary = options.get('boundary')
+    if not boundary:
+        raise UploadError(400, "Missing multipart boundary")
+
+    content_length = _header(event, 'content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_request_bytes:
+        raise UploadError(413, f"Request exceeds {max_request_bytes} bytes")
+
+    stream = event.get('bodyStream')
+    if stream is None:
+        raise UploadError(400, "Missing request body")
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    fields = {}
+    attachments = []
+    writer = None
+    field_name = None
+    field_value = None
+    received = 0
+
+    try:
+        finished = False
+        while not finished:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise UploadError(413, f"Request exceeds {max_request_bytes} bytes")
+            decoder.receive_data(chunk or None)
+
+            part = decoder.next_event()
+            while not isinstance(part, (NeedData, Epilogue)):
+                if isinstance(part, File):
+                    if part.filename:
+                        if len(attachments) >= MAX_FILES:
+                            raise UploadError(413, f"At most {MAX_FILES} attachments per request")
+                        writer = AttachmentWriter(part.filename, part.headers.get('content-type'), max_file_bytes)
+                elif isinstance(part, Field):
+                    field_name = part.name
+                    field_value = bytearray()
+                elif isinstance(part, Data):
+                    if writer is not None:
+                        writer.write(part.data)
+                        if not part.more_data:
+                            attachments.append(writer.commit())
+                            writer = None
+                    elif field_name is not None:
+                        field_value += part.data
+                        if len(field_value) > MAX_FIELD_BYTES:
+                            raise UploadError(413, f"Field {field_name} exceeds {MAX_FIELD_BYTES} bytes")
+                        if not part.more_data:
+                            fields[field_name] = field_value.decode('utf-8')
+                            field_name = None
+                part = decoder.next_event()
+
+            if isinstance(part, Epilogue):
+                finished = True
+            elif not chunk:
+                raise UploadError(400, "Incomplete multipart body")
+
+        return fields, attachments
+
+    except Exception as e:
+        if writer is not None:
+            writer.abort()
+        if isinstance(e, (ValueError, UnicodeDecodeError)) and not isinstance(e, UploadError):
+            raise UploadError(400, f"Malformed multipart body: {e}") from e
+        raise
+
+
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_STRING_ESCAPES = {
+    b'"': b'"', b'\\': b'\\', b'/': b'/', b'b': b'\b',
+    b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t'
+}
+_SCALAR_END = frozenset(b',:}] \t\r\n')
+
+
+class _JsonStream:
+    """
+    Pull parser over a JSON byte stream that holds at most one read chunk in
+    memory. Strings can be consumed piecewise with string_chunks(), which is
+    how attachment contents avoid ever being materialized.
+    """
+
+    def __init__(self, stream, max_request_bytes):
+        self.stream = stream
+        self.max_request_bytes = max_request_bytes
+        self.received = 0
+        self.inline_bytes = 0
+        self.buf = b""
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.received += len(chunk)
+        if self.received > self.max_request_bytes:
+            raise UploadError(413, f"Request exceeds {self.max_request_bytes} bytes")
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _ensure(self, n):
+        while len(self.buf) - self.pos < n:
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def peek(self):
+        """Next non-whitespace byte without consuming it (b"" at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in b" \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            if not self._fill():
+                return b""
+
+    def expect(self, token):
+        if self.peek() != token:
+            raise ValueError(f"Expected {token.decode()!r}")
+        self.pos += 1
+
+    def string_chunks(self):
+        """Yield the decoded bytes of a string whose opening quote was consumed."""
+        while True:
+            if self.pos >= len(self.buf) and not self._fill():
+                raise ValueError("Unterminated string")
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                yield self.buf[self.pos:]
+                self.pos = len(self.buf)
+                continue
+
+            stop = match.start()
+            if stop > self.pos:
+                yield self.buf[self.pos:stop]
+            self.pos = stop
+            if self.buf[stop:stop + 1] == b'"':
+                self.pos += 1
+                return
+
+            self._ensure(2)
+            escape = self.buf[self.pos + 1:self.pos + 2]
+            if escape != b'u':
+                if escape not in _STRING_ESCAPES:
+                    raise ValueError("Invalid string escape")
+                yield _STRING_ESCAPES[escape]
+                self.pos += 2
+                continue
+
+            self._ensure(6)
+            code = int(self.buf[self.pos + 2:self.pos + 6], 16)
+            self.pos += 6
+            if 0xD800 <= code < 0xDC00:
+                self._ensure(6)
+                if self.buf[self.pos:self.pos + 2] != b'\\u':
+                    raise ValueError("Unpaired surrogate in string")
+                low = int(self.buf[self.pos + 2:self.pos + 6], 16)
+                code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                self.pos += 6
+            yield chr(code).encode('utf-8')
+
+    def _small_string(self):
+        parts = []
+        for piece in self.string_chunks():
+            self.inline_bytes += len(piece)
+            if self.inline_bytes > MAX_FIELD_BYTES:
+                raise UploadError(413, f"Fields exceed {MAX_FIELD_BYTES} bytes")
+            parts.append(piece)
+        return b"".join(parts).decode('utf-8')
+
+    def _scalar(self):
+        token = bytearray()
+        while True:
+            if self.pos >= len(self.buf) and not self._fill():
+                break
+            byte = self.buf[self.pos]
+            if byte in _SCALAR_END:
+                break
+            token.append(byte)
+            self.pos += 1
+            if len(token) > 64:
+                raise ValueError("JSON token too long")
+        return json.loads(token)
+
+    def members(self):
+        """Iterate object keys after '{'; the caller consumes each value."""
+        if self.peek() == b'}':
+            self.pos += 1
+            return
+        while True:
+            self.expect(b'"')
+            key = self._small_string()
+            self.expect(b':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == b'}':
+                return
+            if separator != b',':
+                raise ValueError("Expected ',' or '}'")
+
+    def items(self):
+        """Iterate array positions after '['; the caller consumes each value."""
+        if self.peek() == b']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.pos += 1
+            if separator == b']':
+                return
+            if separator != b',':
+                raise ValueError("Expected ',' or ']'")
+
+    def value(self, depth=0):
+        """Parse a (small) value into Python objects."""
+        if depth > MAX_JSON_DEPTH:
+            raise ValueError("JSON nested too deeply")
+        token = self.peek()
+        if token == b'"':
+            self.pos += 1
+            return self._small_string()
+        if token == b'{':
+            self.pos += 1
+            return {key: self.value(depth + 1) for key in self.members()}
+        if token == b'[':
+            self.pos += 1
+            return [self.value(depth + 1) for _ in self.items()]
+        if token == b"":
+            raise ValueError("Unexpected end of JSON")
+        return self._scalar()
+
+
+class _Base64Writer:
+    """Decodes base64 text incrementally into an AttachmentWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = b""
+
+    def feed(self, text):
+        data = self.pending + text.translate(None, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.writer.write(binascii.a2b_base64(data[:usable], strict_mode=True))
+        self.pending = data[usable:]
+
+    def close(self):
+        if self.pending:
+            raise ValueError("Truncated base64 content")
+
+
+def _read_json_attachment(reader, max_file_bytes):
+    """Read one {"filename": ..., "content": "<base64>"} item; None if skipped."""
+    if reader.peek() != b'{':
+        reader.value()
+        return None
+    reader.pos += 1
+
+    filename = None
+    writer = None
+    try:
+        for key in reader.members():
+            if key == "content" and writer is None and reader.peek() == b'"':
+                reader.pos += 1
+                writer = AttachmentWriter(max_bytes=max_file_bytes)
+                decoder = _Base64Writer(writer)
+                for piece in reader.string_chunks():
+                    decoder.feed(piece)
+                decoder.close()
+            else:
+                value = reader.value()
+                if key == "filename":
+                    filename = value
+
+        if writer is None:
+            return None
+        if not isinstance(filename, str) or not filename or writer.size == 0:
+            writer.abort()
+            return None
+        writer.filename = filename
+        return writer.commit()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+
+def read_json_attachments(event, max_file_bytes=MAX_FILE_BYTES, max_request_bytes=MAX_REQUEST_BYTES):
+    """
+    Stream a JSON body of the form {..., "attachments": [{"filename": ...,
+    "content": "<base64>"}, ...]}. Returns (fields, attachments) like
+    read_multipart(): every top-level key except attachments is parsed
+    normally, while each attachment's content is base64-decoded to storage
+    chunk by chunk. Raises UploadError.
+    """
+    stream = event.get('bodyStream')
+    if stream is None:
+        stream = io.BytesIO((event.get('body') or '').encode('utf-8'))
+
+    reader = _JsonStream(stream, max_request_bytes)
+    fields = {}
+    attachments = []
+    try:
+        if reader.peek() == b"":
+            return fields, attachments
+        reader.expect(b'{')
+        for key in reader.members():
+            if key == "attachments" and reader.peek() == b'[':
+                reader.pos += 1
+                for _ in reader.items():
+                    if len(attachments) >= MAX_FILES:
+                        raise UploadError(413, f"At most {MAX_FILES} attachments per request")
+                    stored = _read_json_attachment(reader, max_file_bytes)
+                    if stored is not None:
+                        attachments.append(stored)
+            else:
+                fields[key] = reader.value()
+        if reader.peek() != b"":
+            raise ValueError("Unexpected data after JSON body")
+        return fields, attachments
+
+    except Exception as e:
+        if isinstance(e, (ValueError, UnicodeDecodeError)) and not isinstance(e, UploadError):
+            raise UploadError(400, "Invalid JSON input") from e
+        raise
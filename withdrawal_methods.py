@@ -0,0 +1,183 @@
+import hashlib
+import re
+
+# Withdrawal methods sellers can register (setWithdrawalMethod) and that the
+# payout job pays out through. Each method lists the details fields it
+# accepts with a validator; validators are built once at import and run
+# before a request touches the database. A validator returns the normalized
+# value or raises ValueError.
+
+NOTE_MAX_LENGTH = 200
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BASE58_INDEX = {c: i for i, c in enumerate(_BASE58_ALPHABET)}
+_BECH32_ALPHABET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+_TRON_ADDRESS = re.compile(r"^T[1-9A-HJ-NP-Za-km-z]{33}$")
+_ETH_ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+_BTC_BASE58_ADDRESS = re.compile(r"^[13][1-9A-HJ-NP-Za-km-z]{25,34}$")
+_BTC_BECH32_ADDRESS = re.compile(r"^bc1[ac-hj-np-z02-9]{11,71}$")
+_IBAN = re.compile(r"^[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}$")
+_BIC = re.compile(r"^[A-Z]{4}[A-Z]{2}[A-Z0-9]{2}([A-Z0-9]{3})?$")
+_WHITESPACE = re.compile(r"\s+")
+
+# IBAN lengths for common countries; others only get the generic checks
+_IBAN_LENGTHS = {
+    "AD": 24, "AE": 23, "AT": 20, "BE": 16, "BG": 22, "CH": 21, "CY": 28,
+    "CZ": 24, "DE": 22, "DK": 18, "EE": 20, "ES": 24, "FI": 18, "FR": 27,
+    "GB": 22, "GR": 27, "HR": 21, "HU": 28, "IE": 22, "IT": 27, "LT": 20,
+    "LU": 20, "LV": 21, "MT": 31, "NL": 18, "NO": 15, "PL": 28, "PT": 25,
+    "RO": 24, "SA": 24, "SE": 24, "SI": 19, "SK": 24, "TR": 26,
+}
+
+
+def _base58check_decode(text):
+    """Payload of a Base58Check string; raises ValueError on a bad checksum."""
+    number = 0
+    for char in text:
+        number = number * 58 + _BASE58_INDEX[char]
+    raw = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    raw = b"\x00" * (len(text) - len(text.lstrip("1"))) + raw
+    payload, checksum = raw[:-4], raw[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("checksum mismatch")
+    return payload
+
+
+def _bech32_verify(address):
+    hrp, _, data = address.rpartition("1")
+    values = [_BECH32_ALPHABET.index(c) for c in data]
+    checksum = 1
+    generator = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+    for value in [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp] + values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= generator[i]
+    # bech32 (segwit v0) or bech32m (v1+)
+    if checksum not in (1, 0x2BC830A3):
+        raise ValueError("checksum mismatch")
+
+
+def tron_address(value):
+    value = str(value).strip()
+    if not _TRON_ADDRESS.match(value):
+        raise ValueError("must be a TRON address (T...)")
+    try:
+        payload = _base58check_decode(value)
+    except ValueError:
+        raise ValueError("has an invalid checksum")
+    if len(payload) != 21 or payload[0] != 0x41:
+        raise ValueError("must be a TRON address (T...)")
+    return value
+
+
+def ethereum_address(value):
+    value = str(value).strip()
+    if not _ETH_ADDRESS.match(value):
+        raise ValueError("must be a 0x-prefixed Ethereum address")
+    return value
+
+
+def bitcoin_address(value):
+    value = str(value).strip()
+    if _BTC_BECH32_ADDRESS.match(value.lower()) and value in (value.lower(), value.upper()):
+        value = value.lower()
+        try:
+            _bech32_verify(value)
+        except ValueError:
+            raise ValueError("has an invalid checksum")
+        return value
+    if _BTC_BASE58_ADDRESS.match(value):
+        try:
+            payload = _base58check_decode(value)
+        except ValueError:
+            raise ValueError("has an invalid checksum")
+        if len(payload) != 21:
+            raise ValueError("must be a Bitcoin address")
+        return value
+    raise ValueError("must be a Bitcoin address")
+
+
+def iban(value):
+    value = _WHITESPACE.sub("", str(value)).upper()
+    if not _IBAN.match(value):
+        raise ValueError("must be an IBAN")
+    expected_length = _IBAN_LENGTHS.get(value[:2])
+    if expected_length and len(value) != expected_length:
+        raise ValueError(f"must be {expected_length} characters for {value[:2]}")
+    rearranged = value[4:] + value[:4]
+    if int("".join(str(int(c, 36)) for c in rearranged)) % 97 != 1:
+        raise ValueError("has an invalid checksum")
+    return value
+
+
+def bic(value):
+    value = _WHITESPACE.sub("", str(value)).upper()
+    if not _BIC.match(value):
+        raise ValueError("must be a BIC/SWIFT code")
+    return value
+
+
+def account_name(value):
+    value = " ".join(str(value).split())
+    if not 2 <= len(value) <= 140:
+        raise ValueError("must be 2 to 140 characters")
+    return value
+
+
+def note(value):
+    value = str(value).strip()
+    if len(value) > NOTE_MAX_LENGTH:
+        raise ValueError(f"must be at most {NOTE_MAX_LENGTH} characters")
+    return value
+
+
+class WithdrawalMethod:
+    def __init__(self, code, description, rail, required, optional=None):
+        self.code = code
+        self.description = description
+        # Payouts are grouped per rail
+        self.rail = rail
+        self.required = required
+        self.optional = dict(optional or {}, note=note)
+
+    def validate(self, details):
+        """Normalized details; raises ValueError naming the first bad field."""
+        if not isinstance(details, dict):
+            raise ValueError("details must be an object")
+        unknown = set(details) - set(self.required) - set(self.optional)
+        if unknown:
+            raise ValueError(f"Unknown details field {sorted(unknown)[0]} for {self.code}")
+
+        normalized = {}
+        for fields, required in ((self.required, True), (self.optional, False)):
+            for field, validator in fields.items():
+                value = details.get(field)
+                if value is None or value == "":
+                    if required:
+                        raise ValueError(f"details.{field} is required for {self.code}")
+                    continue
+                try:
+                    normalized[field] = validator(value)
+                except ValueError as e:
+                    raise ValueError(f"details.{field} {e}")
+        return normalized
+
+
+METHODS = {m.code: m for m in [
+    WithdrawalMethod("USDT_TRC20", "USDT on TRON (TRC20)", "tron", {"address": tron_address}),
+    WithdrawalMethod("USDT_ERC20", "USDT on Ethereum (ERC20)", "ethereum", {"address": ethereum_address}),
+    WithdrawalMethod("BTC", "Bitcoin", "bitcoin", {"address": bitcoin_address}),
+    WithdrawalMethod("BANK_TRANSFER", "Bank transfer (IBAN)", "sepa",
+                     {"iban": iban, "account_name": account_name}, {"bic": bic}),
+]}
+
+
+def validate(method_code, details):
+    """(method_code, normalized details) for a registered method; raises ValueError."""
+    method = METHODS.get(method_code)
+    if method is None:
+        raise ValueError(f"Unsupported method_code. Must be one of {', '.join(sorted(METHODS))}")
+    return method.code, method.validate(details)